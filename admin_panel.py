@@ -7,10 +7,13 @@ Web-интерфейс для управления VPN ботом
 import os
 import sys
 import sqlite3
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import (Flask, Response, render_template, request, redirect, url_for, session, flash, jsonify,
+                   stream_with_context)
 from functools import wraps
 import hashlib
 import json
+import time
+import atexit
 
 # Добавляем текущую директорию в путь для импорта
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -18,6 +21,9 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 try:
     from database import Database
     from config import Config
+    from payment import YooMoneyNotificationReceiver, PaymentFulfilment
+    from outbox import OutboxWorkerPool
+    from live_events import EventPublisher, SettledPaymentFeed, LIVE_RETRY_MS
 except ImportError as e:
     print(f"❌ Ошибка импорта: {e}")
     sys.exit(1)
@@ -29,6 +35,28 @@ app.config['SESSION_TYPE'] = 'filesystem'
 # Загрузка конфигурации
 config = Config()
 db = Database()
+# Только заказ или баланс: клиент на панели после оплаты не включается
+fulfilment = PaymentFulfilment(db)
+# Выдача оплат из outbox; события пишутся и процессом monitoring.py (YooMoneyPoller)
+# Пул запускается явно (start_outbox_pool), а не при импорте модуля
+outbox_pool = OutboxWorkerPool(db, fulfilment.handlers, **config.get_outbox_settings())
+yoomoney_receiver = YooMoneyNotificationReceiver(
+    db, config.get_yoomoney_notification_secret(), on_settled=outbox_pool.notify
+)
+# Живые обновления дашборда: новые оплаты, один опрос на процесс
+payment_feed = SettledPaymentFeed(db)
+live_publisher = EventPublisher(payment_feed.poll, reset=payment_feed.reset)
+
+def start_outbox_pool():
+    """Запуск обработчиков outbox в этом процессе; остановка при выходе"""
+    outbox_pool.start()
+    atexit.register(outbox_pool.stop)
+
+def create_app():
+    """Приложение для WSGI-сервера (gunicorn 'admin_panel:create_app()'):
+    пул outbox запускается в каждом рабочем процессе"""
+    start_outbox_pool()
+    return app
 
 def hash_password(password):
     """Хеширование пароля"""
@@ -258,7 +286,91 @@ def api_statistics():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/traffic/top')
+@login_required
+def api_traffic_top():
+    """API: пользователи с наибольшим трафиком за период"""
+    try:
+        now = time.time()
+        end = request.args.get('end', type=float) or now
+        start = request.args.get('start', type=float) or end - request.args.get('hours', 24, type=int) * 3600
+        limit = min(request.args.get('limit', 10, type=int), 100)
+        
+        rows = db.get_top_traffic_users(start, end, limit)
+        return jsonify({
+            'start': start,
+            'end': end,
+            'users': [{
+                'user_id': row['user_id'],
+                'username': row['username'],
+                'bytes_up': row['bytes_up'],
+                'bytes_down': row['bytes_down'],
+                'bytes_total': row['bytes_total']
+            } for row in rows]
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/outbox')
+@login_required
+def api_outbox():
+    """API: состояние outbox выдачи оплат - очередь, отставание, пропускная способность"""
+    try:
+        stats = outbox_pool.get_stats()
+        stats['dead_events'] = [{
+            'id': row['id'],
+            'event_type': row['event_type'],
+            'payload': json.loads(row['payload']),
+            'attempts': row['attempts'],
+            'last_error': row['last_error'],
+            'created_at': row['created_at'],
+            'processed_at': row['processed_at']
+        } for row in db.get_dead_outbox_events()]
+        return jsonify(stats)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/outbox/requeue', methods=['POST'])
+@login_required
+def api_outbox_requeue():
+    """API: вернуть события из dead letter в очередь (все или по списку id)"""
+    try:
+        event_ids = (request.get_json(silent=True) or {}).get('ids')
+        count = db.requeue_dead_outbox_events(event_ids)
+        db.log_admin_action(session['admin_id'], 'outbox_requeue', f'Requeued {count} outbox events',
+                            request.remote_addr, request.headers.get('User-Agent'))
+        outbox_pool.notify()
+        return jsonify({'requeued': count})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/events')
+@login_required
+def api_events():
+    """Поток живых обновлений (SSE): новые оплаты"""
+    subscriber = live_publisher.subscribe(request.headers.get('Last-Event-ID'))
+    
+    def stream():
+        try:
+            yield f"retry: {LIVE_RETRY_MS}\n\n"
+            yield from subscriber.messages()
+        finally:
+            live_publisher.unsubscribe(subscriber)
+    
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # Шаблоны HTML
+@app.route('/payments/yoomoney/notify', methods=['POST'])
+def yoomoney_notification():
+    """HTTP-уведомление YooMoney о входящем переводе (без авторизации, проверяется подпись)"""
+    try:
+        status, message = yoomoney_receiver.handle(request.form.to_dict())
+        return message, status
+    except Exception as e:
+        # Не 200 - YooMoney повторит уведомление позже
+        return f"error: {str(e)}", 500
+
 @app.route('/templates/<template_name>')
 def serve_template(template_name):
     """Сервис для отдачи HTML шаблонов"""
@@ -549,4 +661,7 @@ if __name__ == '__main__':
     print(f"📊 Доступ к панели: http://localhost:{port}")
     print("⏹️  Для остановки нажмите Ctrl+C")
     
+    # В debug-режиме модуль выполняет и процесс reloader'а - пул нужен только рабочему
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_outbox_pool()
     app.run(host=host, port=port, debug=debug)
\ No newline at end of file
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Число SQL-запросов и время построения дашборда веб-панели по числу панелей.
+
+Сравниваются прежний вариант (COUNT подписок отдельным запросом на каждую
+панель), build_dashboard_snapshot (постоянное число запросов) и чтение
+готового снимка из SnapshotCache. База - временный SQLite-файл.
+Если в модуле database нет моделей SQLAlchemy, используются модели с
+теми же полями, объявленные здесь.
+
+Запуск: python benchmarks/dashboard_benchmark.py [--panels 10,50,200,1000]
+        [--clients N] [--rounds N]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import (create_engine, event, func, Column, Integer, String, Float, Boolean,
+                        DateTime, Text, ForeignKey)
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+import database
+
+if hasattr(database, 'Panel'):
+    Base = database.Base
+else:
+    Base = declarative_base()
+
+    class User(Base):
+        __tablename__ = 'users'
+        id = Column(Integer, primary_key=True)
+        user_id = Column(Integer, unique=True)
+        username = Column(String(100))
+        created_at = Column(DateTime, default=datetime.utcnow)
+
+    class Panel(Base):
+        __tablename__ = 'panels'
+        id = Column(Integer, primary_key=True)
+        name = Column(String(100))
+        location = Column(String(100))
+        url = Column(String(255))
+        max_clients = Column(Integer, default=100)
+        is_active = Column(Boolean, default=True)
+        last_check = Column(DateTime)
+        created_at = Column(DateTime, default=datetime.utcnow)
+
+    class Subscription(Base):
+        __tablename__ = 'subscriptions'
+        id = Column(Integer, primary_key=True)
+        user_id = Column(Integer, ForeignKey('users.id'))
+        panel_id = Column(Integer, ForeignKey('panels.id'), index=True)
+        is_active = Column(Boolean, default=True)
+        created_at = Column(DateTime, default=datetime.utcnow)
+
+    class Payment(Base):
+        __tablename__ = 'payments'
+        id = Column(Integer, primary_key=True)
+        user_id = Column(Integer, ForeignKey('users.id'))
+        amount = Column(Float)
+        payment_method = Column(String(50))
+        status = Column(String(20))
+        created_at = Column(DateTime, default=datetime.utcnow)
+        completed_at = Column(DateTime)
+
+    class Alert(Base):
+        __tablename__ = 'alerts'
+        id = Column(Integer, primary_key=True)
+        alert_type = Column(String(50))
+        message = Column(Text)
+        is_resolved = Column(Boolean, default=False)
+        created_at = Column(DateTime, default=datetime.utcnow)
+
+    for model in (User, Panel, Subscription, Payment, Alert):
+        setattr(database, model.__name__, model)
+
+from database import Panel, Subscription, User, Payment, Alert
+from dashboard_stats import build_dashboard_snapshot
+from snapshot_cache import SnapshotCache
+
+
+def legacy_dashboard(db):
+    """Прежний web_panel.dashboard: отдельный COUNT подписок на каждую панель"""
+    now = datetime.utcnow()
+    result = {
+        'total_users': db.query(User).count(),
+        'total_active_subs': db.query(Subscription).filter(Subscription.is_active == True).count(),
+        'total_panels': db.query(Panel).count(),
+        'total_revenue': db.query(Payment).filter(Payment.status == 'completed').with_entities(
+            func.sum(Payment.amount)).scalar() or 0,
+        'active_panels': db.query(Panel).filter(
+            Panel.is_active == True, Panel.last_check > now - timedelta(minutes=10)).count(),
+        'recent_payments': db.query(Payment).filter(Payment.status == 'completed').order_by(
+            Payment.completed_at.desc()).limit(10).all(),
+        'recent_alerts': db.query(Alert).filter(Alert.is_resolved == False).order_by(
+            Alert.created_at.desc()).limit(10).all(),
+    }
+    panels_stats = []
+    for panel in db.query(Panel).all():
+        clients_count = db.query(Subscription).filter(
+            Subscription.panel_id == panel.id, Subscription.is_active == True).count()
+        panels_stats.append({'id': panel.id, 'clients_count': clients_count})
+    result['panels_stats'] = panels_stats
+    return result
+
+
+def populate(session_factory, panels, clients, rng):
+    now = datetime.utcnow()
+    db = session_factory()
+    db.bulk_insert_mappings(User, [{'id': i + 1, 'user_id': 100000 + i, 'username': f'user{i}'}
+                                   for i in range(panels * clients)])
+    db.bulk_insert_mappings(Panel, [{
+        'id': i + 1, 'name': f'panel{i}', 'location': 'EU', 'url': f'https://panel{i}.example',
+        'max_clients': clients * 2, 'is_active': True,
+        'last_check': now - timedelta(minutes=rng.choice([1, 2, 30])),
+    } for i in range(panels)])
+    db.bulk_insert_mappings(Subscription, [{
+        'user_id': i + 1, 'panel_id': i % panels + 1, 'is_active': rng.random() < 0.8,
+    } for i in range(panels * clients)])
+    db.bulk_insert_mappings(Payment, [{
+        'user_id': rng.randrange(panels * clients) + 1, 'amount': 100.0, 'payment_method': 'yoomoney',
+        'status': 'completed', 'completed_at': now - timedelta(minutes=i),
+    } for i in range(panels * clients // 2)])
+    db.bulk_insert_mappings(Alert, [{
+        'alert_type': 'panel_down', 'message': f'panel{i} down', 'is_resolved': i % 3 == 0,
+    } for i in range(panels)])
+    db.commit()
+    db.close()
+
+
+def measure(session_factory, counter, func_, rounds):
+    times = []
+    queries = 0
+    for _ in range(rounds):
+        db = session_factory()
+        counter[0] = 0
+        started = time.perf_counter()
+        func_(db)
+        times.append(time.perf_counter() - started)
+        queries = counter[0]
+        db.close()
+    return queries, statistics.median(times)
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='dashboard_bench_')
+    print(f"{'panels':>7} {'legacy queries':>15} {'legacy ms':>10} {'grouped queries':>16} "
+          f"{'grouped ms':>11} {'cached ms':>10}")
+    for panels in args.panels:
+        engine = create_engine(f"sqlite:///{os.path.join(workdir, f'bench_{panels}.db')}")
+        Base.metadata.create_all(engine)
+        session_factory = sessionmaker(bind=engine)
+        populate(session_factory, panels, args.clients, rng)
+
+        counter = [0]
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def count_query(*_):
+            counter[0] += 1
+
+        legacy_queries, legacy_time = measure(session_factory, counter, legacy_dashboard, args.rounds)
+        grouped_queries, grouped_time = measure(session_factory, counter, build_dashboard_snapshot,
+                                                args.rounds)
+
+        cache = SnapshotCache(ttl=60, directory=os.path.join(workdir, f'cache_{panels}'))
+
+        def cached(db):
+            return cache.get('dashboard', lambda: build_dashboard_snapshot(db))
+
+        cached(session_factory())
+        _, cached_time = measure(session_factory, counter, cached, args.rounds)
+
+        print(f"{panels:>7} {legacy_queries:>15} {legacy_time * 1000:>10.1f} {grouped_queries:>16} "
+              f"{grouped_time * 1000:>11.1f} {cached_time * 1000:>10.2f}")
+        engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--panels', type=lambda s: [int(x) for x in s.split(',')],
+                        default=[10, 50, 200, 1000], help='числа панелей через запятую')
+    parser.add_argument('--clients', type=int, default=50, help='подписок на панель')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
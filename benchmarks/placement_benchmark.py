@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Симуляция размещения клиентов: 100 панелей, 1 000 000 клиентов.
+
+Запуск: python benchmarks/placement_benchmark.py [--panels N] [--clients N]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from placement import PlacementEngine, NoPanelAvailableError
+
+
+def run(panels, clients, churn, seed):
+    rng = random.Random(seed)
+    engine = PlacementEngine()
+
+    # Панели разной ёмкости с запасом в 20% на весь поток клиентов
+    capacities = [rng.choice((5000, 10000, 20000)) for _ in range(panels)]
+    scale = clients * 1.2 / sum(capacities)
+    for panel_id, capacity in enumerate(capacities):
+        engine.upsert_panel(panel_id, max(1, int(capacity * scale)))
+
+    placed = []
+    rejected = 0
+    unhealthy = set()
+    started = time.perf_counter()
+
+    for i in range(clients):
+        # Периодически часть панелей "падает" и возвращается
+        if i % 50000 == 0:
+            for panel_id in unhealthy:
+                engine.set_health(panel_id, True, latency=rng.uniform(0.05, 0.3))
+            unhealthy = set(rng.sample(range(panels), max(1, panels // 20)))
+            for panel_id in unhealthy:
+                engine.set_health(panel_id, False)
+
+        try:
+            placed.append(engine.place())
+        except NoPanelAvailableError:
+            rejected += 1
+
+        if placed and rng.random() < churn:
+            index = rng.randrange(len(placed))
+            placed[index], placed[-1] = placed[-1], placed[index]
+            engine.release(placed.pop())
+
+    elapsed = time.perf_counter() - started
+    operations = clients + int(clients * churn)
+
+    snapshot = engine.snapshot()
+    fill = [s['active_clients'] / s['max_clients'] for s in snapshot.values()]
+
+    print(f"panels:            {panels}")
+    print(f"clients offered:   {clients}")
+    print(f"placed / rejected: {len(placed)} / {rejected}")
+    print(f"elapsed:           {elapsed:.2f} s")
+    print(f"throughput:        {operations / elapsed:,.0f} ops/s")
+    print(f"per placement:     {elapsed / clients * 1e6:.2f} us")
+    print(f"fill min/avg/max:  {min(fill):.3f} / {statistics.mean(fill):.3f} / {max(fill):.3f}")
+    print(f"fill stdev:        {statistics.pstdev(fill):.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--panels', type=int, default=100)
+    parser.add_argument('--clients', type=int, default=1_000_000)
+    parser.add_argument('--churn', type=float, default=0.1,
+                        help='вероятность отключения случайного клиента на каждом шаге')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    run(args.panels, args.clients, args.churn, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Нагрузочные замеры клиента X-UI на имитаторе панелей.
+
+Сценарии:
+  provisioning - создание и включение клиентов через ProvisioningQueue
+                 (с пакетным API панели и без него)
+  health       - циклы параллельной проверки статуса панелей
+  memory       - память и время чтения списка клиентов по размеру панели
+
+Запуск: python benchmarks/xui_benchmark.py [provisioning|health|memory ...]
+        [--panels N] [--clients N] [--latency S] [--error-rate P]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from xui_simulator import start_in_process
+from circuit_breaker import get_breaker_states
+from provisioning import ProvisioningQueue
+from xui_api import get_async_xui_api, close_async_clients
+
+SCENARIOS = ('provisioning', 'health', 'memory')
+
+
+def panel_configs(urls):
+    return [{'url': url, 'username': 'admin', 'password': 'admin'} for url in urls]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0.0
+
+
+async def provisioning(args, batch):
+    process, urls = start_in_process(panels=args.panels, clients=0, latency=args.latency,
+                                     jitter=args.jitter, error_rate=args.error_rate,
+                                     batch=batch, seed=args.seed)
+    panels = panel_configs(urls)
+    queue = ProvisioningQueue()
+    await queue.start()
+    try:
+        started = time.perf_counter()
+        results = await asyncio.gather(*(
+            queue.create_client(panels[i % len(panels)], f'bench{i}', 100000 + i)
+            for i in range(args.clients)
+        ), return_exceptions=True)
+        create_time = time.perf_counter() - started
+
+        created = [(i, client_id) for i, client_id in enumerate(results)
+                   if not isinstance(client_id, Exception)]
+        started = time.perf_counter()
+        enabled = await asyncio.gather(*(
+            queue.enable_client(panels[i % len(panels)], client_id) for i, client_id in created
+        ), return_exceptions=True)
+        enable_time = time.perf_counter() - started
+    finally:
+        await queue.stop()
+        await close_async_clients()
+        process.terminate()
+
+    stats = queue.get_stats()
+    print(f"provisioning ({'batch API' if batch else 'single requests'}):")
+    print(f"  panels / clients:  {args.panels} / {args.clients}")
+    print(f"  create:            {len(created)} ok in {create_time:.2f} s, "
+          f"{len(created) / create_time:,.0f} clients/s")
+    enabled_ok = sum(1 for r in enabled if not isinstance(r, Exception))
+    print(f"  enable:            {enabled_ok} ok in {enable_time:.2f} s, "
+          f"{enabled_ok / enable_time if enable_time else 0:,.0f} clients/s")
+    print(f"  failed:            {stats['failed']}, retries: {stats['retries']}")
+    print(f"  batches:           {stats['batches']}, avg size {stats['avg_batch_size']:.1f}, "
+          f"single requests: {stats['single_requests']}")
+    print(f"  latency p50/p95:   {stats['latency_p50'] or 0:.3f} / {stats['latency_p95'] or 0:.3f} s")
+
+
+async def health(args):
+    process, urls = start_in_process(panels=args.panels, clients=0, latency=args.latency,
+                                     jitter=args.jitter, error_rate=args.error_rate,
+                                     seed=args.seed)
+    clients = [get_async_xui_api(config) for config in panel_configs(urls)]
+    for xui in clients:
+        # Каждый цикл должен доходить до панели, а не до кэша результата
+        xui.result_ttl = 0
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def check(xui):
+        # Та же схема, что в MonitoringService._check_panel, без базы и алертов
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                status = await asyncio.wait_for(xui.get_panel_status(timeout=args.timeout),
+                                                args.timeout)
+            except asyncio.TimeoutError:
+                status = None
+            return time.monotonic() - started, status is not None
+
+    cycles = []
+    durations = []
+    try:
+        for _ in range(args.rounds):
+            started = time.perf_counter()
+            results = await asyncio.gather(*(check(xui) for xui in clients))
+            cycles.append((time.perf_counter() - started, sum(1 for r in results if r[1])))
+            durations.extend(r[0] for r in results)
+    finally:
+        await close_async_clients()
+        process.terminate()
+
+    wall_times = [c[0] for c in cycles]
+    open_circuits = sum(1 for s in get_breaker_states().values() if s['state'] != 'closed')
+    print("health check cycle:")
+    print(f"  panels / concurrency: {args.panels} / {args.concurrency}")
+    print(f"  cycle wall time:      min {min(wall_times):.3f}, "
+          f"avg {statistics.mean(wall_times):.3f}, max {max(wall_times):.3f} s")
+    print(f"  panel check p50/p95:  {percentile(durations, 0.5):.3f} / "
+          f"{percentile(durations, 0.95):.3f} s")
+    print(f"  online per cycle:     {', '.join(str(c[1]) for c in cycles)}")
+    print(f"  open circuits:        {open_circuits}")
+
+
+async def memory(args):
+    process, urls = start_in_process(clients=args.sizes, seed=args.seed)
+    print("client listing memory (tracemalloc peak):")
+    print(f"  {'clients':>8} {'get_clients':>16} {'iter_clients':>16} {'index':>10}")
+    try:
+        for size, config in zip(args.sizes, panel_configs(urls)):
+            xui = get_async_xui_api(config)
+            xui.result_ttl = 0
+            await xui.login()
+
+            tracemalloc.start()
+            await xui.refresh_client_index(force=True)
+            index_size = tracemalloc.get_traced_memory()[0]
+
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            started = time.perf_counter()
+            result = await xui.get_clients()
+            del result
+            full_time = time.perf_counter() - started
+            full_peak = tracemalloc.get_traced_memory()[1] - base
+
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            started = time.perf_counter()
+            count = 0
+            async for _ in xui.iter_clients():
+                count += 1
+            stream_time = time.perf_counter() - started
+            stream_peak = tracemalloc.get_traced_memory()[1] - base
+            tracemalloc.stop()
+
+            print(f"  {size:>8} {full_peak / 2 ** 20:>8.1f} MB {full_time:>5.2f}s"
+                  f" {stream_peak / 2 ** 20:>8.1f} MB {stream_time:>5.2f}s"
+                  f" {index_size / 2 ** 20:>7.1f} MB")
+    finally:
+        await close_async_clients()
+        process.terminate()
+
+
+async def run(args):
+    for scenario in args.scenarios:
+        if scenario == 'provisioning':
+            await provisioning(args, batch=True)
+            await provisioning(args, batch=False)
+        elif scenario == 'health':
+            await health(args)
+        elif scenario == 'memory':
+            await memory(args)
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('scenarios', nargs='*', metavar='scenario', default=list(SCENARIOS),
+                        help=f"{', '.join(SCENARIOS)} (по умолчанию все)")
+    parser.add_argument('--panels', type=int, default=20)
+    parser.add_argument('--clients', type=int, default=5000,
+                        help='сколько клиентов создать в сценарии provisioning')
+    parser.add_argument('--sizes', type=lambda s: [int(x) for x in s.split(',')],
+                        default=[1000, 10000, 100000],
+                        help='размеры панелей для сценария memory, через запятую')
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--jitter', type=float, default=0.03)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--timeout', type=float, default=15)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(sorted(unknown))}")
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
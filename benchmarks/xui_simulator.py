@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Локальный имитатор X-UI панелей для нагрузочных тестов.
+
+Один процесс обслуживает несколько панелей, каждая на своём порту и под
+своим префиксом: http://127.0.0.1:2053/panel0, http://127.0.0.1:2054/panel1 ...
+(отдельные порты нужны, чтобы лимит соединений на хост у клиента
+действовал на каждую панель, как с настоящими серверами).
+Поддерживаются все запросы XUIAPI/AsyncXUIAPI, включая пакетные.
+
+Запуск: python benchmarks/xui_simulator.py [--panels N] [--clients N]
+        [--latency S] [--jitter S] [--error-rate P] [--no-batch]
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import secrets
+import time
+
+from aiohttp import web
+
+
+class SimulatedPanel:
+    """Состояние одной панели: клиенты, сессии и счётчики запросов"""
+
+    def __init__(self, name, clients=0, rng=None):
+        self.name = name
+        self.rng = rng or random.Random()
+        self.clients = {}
+        self.sessions = set()
+        self.next_id = 1
+        self.version = 0
+        self.started_at = time.time()
+        self.requests = {}
+        self._listing = None
+
+        for i in range(clients):
+            self.add_client({
+                'email': f'{name}_user{i}',
+                'telegramId': str(100000 + i),
+                'enable': self.rng.random() < 0.8,
+                'expiryTime': 0,
+                'up': self.rng.randrange(10 ** 9),
+                'down': self.rng.randrange(10 ** 10),
+            })
+
+    def add_client(self, payload):
+        client_id = str(self.next_id)
+        self.next_id += 1
+        client = {
+            'id': client_id,
+            'email': payload.get('email'),
+            'telegramId': payload.get('telegramId'),
+            'enable': bool(payload.get('enable', False)),
+            'expiryTime': payload.get('expiryTime', 0),
+            'up': payload.get('up', 0),
+            'down': payload.get('down', 0),
+        }
+        self.clients[client_id] = client
+        self.changed()
+        return client_id
+
+    def changed(self):
+        self.version += 1
+        self._listing = None
+
+    def listing(self):
+        """Тело /api/clients; сериализуется заново только после изменений"""
+        if self._listing is None:
+            body = {'success': True, 'msg': '', 'obj': list(self.clients.values())}
+            self._listing = json.dumps(body).encode()
+        return self._listing
+
+    def status(self):
+        return {
+            'success': True,
+            'obj': {
+                'cpu': round(self.rng.uniform(1, 60), 1),
+                'mem': {'current': self.rng.randrange(2 ** 28, 2 ** 30), 'total': 2 ** 31},
+                'uptime': int(time.time() - self.started_at),
+                'clients': len(self.clients),
+            },
+        }
+
+
+class PanelSimulator:
+    """HTTP-сервер с набором имитируемых панелей.
+
+    latency + случайная добавка до jitter секунд задерживает каждый
+    ответ, error_rate - доля запросов к /api, завершающихся HTTP 500.
+    С batch=False пакетные запросы отвечают 404, как старые панели.
+    """
+
+    def __init__(self, panels=1, clients=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 batch=True, seed=None):
+        self.rng = random.Random(seed)
+        sizes = clients if isinstance(clients, (list, tuple)) else [clients] * panels
+        self.panels = {
+            f'panel{i}': SimulatedPanel(f'panel{i}', size, self.rng)
+            for i, size in enumerate(sizes)
+        }
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.batch = batch
+        self.runner = None
+        self.ports = []
+
+    def make_app(self):
+        app = web.Application(middlewares=[self._middleware], client_max_size=64 * 1024 ** 2)
+        app.router.add_post('/{panel}/login', self.login)
+        app.router.add_get('/{panel}/api/status', self.get_status)
+        app.router.add_get('/{panel}/api/clients', self.get_clients)
+        app.router.add_post('/{panel}/api/client', self.create_client)
+        app.router.add_post('/{panel}/api/client/{client_id}/enable', self.enable_client)
+        app.router.add_post('/{panel}/api/client/{client_id}/disable', self.disable_client)
+        app.router.add_delete('/{panel}/api/client/{client_id}', self.delete_client)
+        app.router.add_post('/{panel}/api/clients/batch', self.create_clients)
+        app.router.add_post('/{panel}/api/clients/enable', self.enable_clients)
+        app.router.add_post('/{panel}/api/clients/disable', self.disable_clients)
+        return app
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        panel = self.panels.get(request.match_info.get('panel'))
+        if panel is None:
+            raise web.HTTPNotFound()
+        route = f"{request.method} {request.match_info.route.resource.canonical[len('/{panel}'):]}"
+        panel.requests[route] = panel.requests.get(route, 0) + 1
+
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if not request.path.endswith('/login'):
+            if request.cookies.get('session') not in panel.sessions:
+                return web.Response(status=401)
+            if self.error_rate and self.rng.random() < self.error_rate:
+                return web.json_response({'success': False, 'msg': 'simulated error'}, status=500)
+        request['panel'] = panel
+        return await handler(request)
+
+    async def login(self, request):
+        panel = request['panel']
+        token = secrets.token_hex(16)
+        panel.sessions.add(token)
+        response = web.json_response({'success': True, 'msg': 'Login successful'})
+        response.set_cookie('session', token)
+        return response
+
+    async def get_status(self, request):
+        return web.json_response(request['panel'].status())
+
+    async def get_clients(self, request):
+        panel = request['panel']
+        etag = f'"{panel.version}"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(body=panel.listing(), content_type='application/json',
+                            headers={'ETag': etag})
+
+    async def create_client(self, request):
+        client_id = request['panel'].add_client(await request.json())
+        return web.json_response({'success': True, 'id': client_id})
+
+    def _set_enabled(self, panel, client_ids, enabled):
+        for client_id in client_ids:
+            client = panel.clients.get(str(client_id))
+            if client is not None:
+                client['enable'] = enabled
+        panel.changed()
+
+    async def enable_client(self, request):
+        return self._single(request, True)
+
+    async def disable_client(self, request):
+        return self._single(request, False)
+
+    def _single(self, request, enabled):
+        panel = request['panel']
+        client_id = request.match_info['client_id']
+        if client_id not in panel.clients:
+            return web.json_response({'success': False, 'msg': 'client not found'}, status=404)
+        self._set_enabled(panel, [client_id], enabled)
+        return web.json_response({'success': True})
+
+    async def delete_client(self, request):
+        panel = request['panel']
+        if panel.clients.pop(request.match_info['client_id'], None) is None:
+            return web.json_response({'success': False, 'msg': 'client not found'}, status=404)
+        panel.changed()
+        return web.json_response({'success': True})
+
+    async def create_clients(self, request):
+        if not self.batch:
+            raise web.HTTPNotFound()
+        panel = request['panel']
+        body = await request.json()
+        ids = [panel.add_client(client) for client in body.get('clients', [])]
+        return web.json_response({'success': True, 'ids': ids})
+
+    async def enable_clients(self, request):
+        return await self._batch_set(request, True)
+
+    async def disable_clients(self, request):
+        return await self._batch_set(request, False)
+
+    async def _batch_set(self, request, enabled):
+        if not self.batch:
+            raise web.HTTPNotFound()
+        body = await request.json()
+        self._set_enabled(request['panel'], body.get('ids', []), enabled)
+        return web.json_response({'success': True})
+
+    def urls(self, host='127.0.0.1'):
+        return [f'http://{host}:{port}/{name}' for port, name in zip(self.ports, self.panels)]
+
+    def get_stats(self):
+        return {name: dict(panel.requests) for name, panel in self.panels.items()}
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Запуск панелей на портах port, port + 1, ... (port=0 - любые свободные)"""
+        self.runner = web.AppRunner(self.make_app(), access_log=None)
+        await self.runner.setup()
+        for i in range(len(self.panels)):
+            await web.TCPSite(self.runner, host, port + i if port else 0).start()
+        self.ports = [address[1] for address in self.runner.addresses]
+        return self.urls(host)
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+def _serve(options, conn):
+    async def serve():
+        simulator = PanelSimulator(**options)
+        urls = await simulator.start()
+        conn.send(urls)
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+def start_in_process(**options):
+    """Запуск имитатора в отдельном процессе, чтобы его работа не
+    смешивалась с измерениями. Возвращает (process, urls)."""
+    parent_conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_serve, args=(options, child_conn), daemon=True)
+    process.start()
+    urls = parent_conn.recv()
+    return process, urls
+
+
+async def main(args):
+    simulator = PanelSimulator(args.panels, args.clients, args.latency, args.jitter,
+                               args.error_rate, not args.no_batch, args.seed)
+    urls = await simulator.start(args.host, args.port)
+    print("Panels:")
+    for url in urls:
+        print(f"  {url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await simulator.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Имитатор X-UI панелей")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2053)
+    parser.add_argument('--panels', type=int, default=1)
+    parser.add_argument('--clients', type=int, default=1000, help='клиентов на каждой панели')
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа, секунды')
+    parser.add_argument('--jitter', type=float, default=0.0, help='случайная добавка к задержке')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов HTTP 500')
+    parser.add_argument('--no-batch', action='store_true', help='без пакетного API')
+    parser.add_argument('--seed', type=int, default=None)
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
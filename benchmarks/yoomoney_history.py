@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Локальная замена истории операций YooMoney и замер проверки оплат.
+
+HistoryStub повторяет operation_history из yoomoney.Client: фильтры
+type/label/from_date/till_date, постраничную выдачу с next_record и
+порядок от новых операций к старым. Замер сравнивает проверку каждого
+платежа отдельным запросом (PaymentProcessor.check_yoomoney_payment)
+с одним проходом YooMoneyPoller.
+
+Запуск: python benchmarks/yoomoney_history.py [--pending N] [--paid P]
+        [--noise N] [--api-latency S]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Operation:
+    __slots__ = ('operation_id', 'status', 'datetime', 'title', 'direction',
+                 'amount', 'label', 'type')
+
+    def __init__(self, operation_id, status, datetime, amount, label=None):
+        self.operation_id = operation_id
+        self.status = status
+        self.datetime = datetime
+        self.title = f'Пополнение {operation_id}'
+        self.direction = 'in'
+        self.amount = amount
+        self.label = label
+        self.type = 'deposition'
+
+
+class History:
+    def __init__(self, operations, next_record=None):
+        self.operations = operations
+        self.next_record = next_record
+
+
+class HistoryStub:
+    """История операций в памяти с интерфейсом yoomoney.Client"""
+
+    def __init__(self, latency=0.0):
+        self.operations = []
+        self.latency = latency
+        self.calls = 0
+        self._next_id = 1
+
+    def add_operation(self, label, amount, when=None, status='success'):
+        operation = Operation(str(self._next_id), status, when or datetime.utcnow(), amount, label)
+        self._next_id += 1
+        self.operations.append(operation)
+        return operation
+
+    def operation_history(self, type=None, label=None, from_date=None, till_date=None,
+                          start_record=None, records=None, details=None):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        selected = [
+            op for op in self.operations
+            if (type is None or op.type in type.split())
+            and (label is None or op.label == label)
+            and (from_date is None or op.datetime >= from_date)
+            and (till_date is None or op.datetime < till_date)
+        ]
+        selected.sort(key=lambda op: op.datetime, reverse=True)
+
+        start = int(start_record or 0)
+        count = min(int(records or 30), 100)
+        page = selected[start:start + count]
+        next_record = str(start + count) if start + count < len(selected) else None
+        return History(page, next_record)
+
+
+def run(pending, paid, noise, api_latency, seed):
+    from database import Database
+    from payment import PaymentProcessor, YooMoneyPoller
+
+    rng = random.Random(seed)
+    # Database() создаёт config.ini и базу в текущем каталоге
+    os.chdir(tempfile.mkdtemp(prefix='yoomoney_bench_'))
+    db = Database()
+    db.init_db()
+
+    stub = HistoryStub(api_latency)
+    now = datetime.utcnow()
+    labels = [f'{100000 + i}_{now:%Y%m%d%H%M%S}_bench' for i in range(pending)]
+    for i, label in enumerate(labels):
+        db.add_user(100000 + i, f'user{i}', f'User {i}')
+        db.create_payment(100000 + i, 100.0, label)
+    for label in rng.sample(labels, int(pending * paid)):
+        stub.add_operation(label, 100.0, now + timedelta(seconds=rng.randrange(600)))
+    for i in range(noise):
+        stub.add_operation(f'other_{i}', 50.0, now + timedelta(seconds=rng.randrange(600)))
+
+    processor = PaymentProcessor(db, 'token', 'receiver', client=stub)
+    started = time.perf_counter()
+    found = sum(1 for label in labels
+                if processor.check_yoomoney_payment(label).get('status') == 'completed')
+    per_label_time = time.perf_counter() - started
+    per_label_calls = stub.calls
+
+    stub.calls = 0
+    poller = YooMoneyPoller(db, stub)
+    started = time.perf_counter()
+    completed = poller.poll()
+    poll_time = time.perf_counter() - started
+    poll_calls = stub.calls
+
+    # Повторный проход: все оплаченные уже закрыты, читается только хвост истории
+    stub.calls = 0
+    again = poller.poll()
+
+    print(f"pending payments:     {pending} ({int(pending * paid)} paid, {noise} other operations)")
+    print(f"per-label checks:     {per_label_calls} API calls, {per_label_time:.2f} s, {found} paid")
+    print(f"batched poll:         {poll_calls} API calls, {poll_time:.2f} s, "
+          f"{len(completed)} completed")
+    print(f"second poll:          {stub.calls} API calls, {len(again)} completed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pending', type=int, default=500)
+    parser.add_argument('--paid', type=float, default=0.3, help='доля оплаченных платежей')
+    parser.add_argument('--noise', type=int, default=200, help='посторонних операций в истории')
+    parser.add_argument('--api-latency', type=float, default=0.01,
+                        help='задержка одного запроса к API, секунды')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    run(args.pending, args.paid, args.noise, args.api_latency, args.seed)
+
+
+if __name__ == '__main__':
+    main()
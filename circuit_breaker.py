@@ -0,0 +1,192 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+# Окно последних вызовов, по которому считается доля ошибок
+WINDOW_SIZE = 20
+# Минимум вызовов в окне, прежде чем размыкать цепь
+MIN_CALLS = 5
+# Доля ошибок, при которой цепь размыкается
+ERROR_RATE_THRESHOLD = 0.5
+# Сколько секунд цепь остаётся разомкнутой до пробного запроса
+OPEN_DURATION = 30
+# Через сколько секунд снова спрашивать, пока идёт пробный запрос
+PROBE_RETRY_DELAY = 1
+
+# Адаптивный таймаут: p95 задержки * множитель в пределах [min, max]
+LATENCY_SAMPLES = 50
+TIMEOUT_MULTIPLIER = 3
+MIN_TIMEOUT = 2
+MAX_TIMEOUT = 10
+
+
+class CircuitOpenError(Exception):
+    """Запрос отклонён: цепь панели разомкнута"""
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class CircuitBreaker:
+    """Автомат closed -> open -> half_open для одной панели.
+
+    Размыкается, когда доля ошибок в окне последних вызовов превышает
+    порог; после OPEN_DURATION пропускает один пробный запрос и по его
+    результату замыкается или снова размыкается.
+    """
+
+    def __init__(self, name, window_size=WINDOW_SIZE, min_calls=MIN_CALLS,
+                 error_rate_threshold=ERROR_RATE_THRESHOLD, open_duration=OPEN_DURATION,
+                 max_timeout=MAX_TIMEOUT):
+        self.name = name
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.open_duration = open_duration
+        self.max_timeout = max_timeout
+
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=window_size)
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._state = STATE_CLOSED
+        self._opened_at = None
+        self._probe_in_flight = False
+        self._rejected = 0
+        self._last_error = None
+
+    def _error_rate(self):
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def _open(self, reason):
+        self._state = STATE_OPEN
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        logger.warning(f"Circuit for {self.name} opened: {reason}")
+
+    @property
+    def state(self):
+        with self._lock:
+            if (self._state == STATE_OPEN
+                    and time.monotonic() - self._opened_at >= self.open_duration):
+                return STATE_HALF_OPEN
+            return self._state
+
+    def allow_request(self):
+        """Можно ли выполнить запрос к панели сейчас"""
+        with self._lock:
+            if self._state == STATE_CLOSED:
+                return True
+            if self._state == STATE_OPEN:
+                if time.monotonic() - self._opened_at < self.open_duration:
+                    self._rejected += 1
+                    return False
+                self._state = STATE_HALF_OPEN
+            # half_open: пропускаем только один пробный запрос
+            if self._probe_in_flight:
+                self._rejected += 1
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def before_call(self):
+        """Проверка перед запросом, CircuitOpenError если цепь разомкнута"""
+        if not self.allow_request():
+            raise CircuitOpenError(f"Circuit open for {self.name}, request rejected")
+
+    def retry_after(self):
+        """Через сколько секунд цепь снова пропустит запрос (0 - уже сейчас)"""
+        with self._lock:
+            if self._state == STATE_OPEN:
+                return max(self.open_duration - (time.monotonic() - self._opened_at), 0)
+            if self._state == STATE_HALF_OPEN and self._probe_in_flight:
+                return PROBE_RETRY_DELAY
+            return 0
+
+    def record_success(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+            if self._state == STATE_HALF_OPEN:
+                logger.info(f"Circuit for {self.name} closed after successful probe")
+                self._state = STATE_CLOSED
+                self._opened_at = None
+                self._outcomes.clear()
+            self._probe_in_flight = False
+            self._outcomes.append(True)
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self._last_error = str(error) if error is not None else None
+            self._outcomes.append(False)
+            if self._state == STATE_HALF_OPEN:
+                self._open("probe request failed")
+                return
+            self._probe_in_flight = False
+            if (self._state == STATE_CLOSED
+                    and len(self._outcomes) >= self.min_calls
+                    and self._error_rate() >= self.error_rate_threshold):
+                self._open(f"error rate {self._error_rate():.0%}")
+
+    def record_cancelled(self):
+        """Запрос прервал вызывающий: исход не учитывается, слот пробы освобождается"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def timeout(self):
+        """Таймаут запроса по наблюдаемому p95 задержки панели"""
+        with self._lock:
+            p95 = _percentile(sorted(self._latencies), 0.95)
+        if p95 is None:
+            return self.max_timeout
+        return max(MIN_TIMEOUT, min(self.max_timeout, p95 * TIMEOUT_MULTIPLIER))
+
+    def snapshot(self):
+        """Состояние цепи для мониторинга и админ-панели"""
+        state = self.state
+        with self._lock:
+            latencies = sorted(self._latencies)
+            opened_for = (time.monotonic() - self._opened_at) if self._opened_at else None
+            snapshot = {
+                'name': self.name,
+                'state': state,
+                'error_rate': round(self._error_rate(), 3),
+                'calls_in_window': len(self._outcomes),
+                'rejected': self._rejected,
+                'opened_for': round(opened_for, 1) if opened_for is not None else None,
+                'last_error': self._last_error,
+                'latency_p50': _percentile(latencies, 0.5),
+                'latency_p95': _percentile(latencies, 0.95),
+            }
+        snapshot['timeout'] = self.timeout()
+        return snapshot
+
+
+# Цепи по URL панели, общие для синхронного и асинхронного клиентов
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(panel_url):
+    """Цепь для панели, создаётся при первом обращении"""
+    with _breakers_lock:
+        breaker = _breakers.get(panel_url)
+        if breaker is None:
+            breaker = CircuitBreaker(panel_url)
+            _breakers[panel_url] = breaker
+        return breaker
+
+def get_breaker_states():
+    """Снимок состояния всех цепей процесса"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
@@ -0,0 +1,217 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд индекс считается устаревшим и перечитывается
+CLIENT_INDEX_TTL = 300
+
+
+class IndexedClient:
+    """Компактная запись клиента панели в индексе"""
+    __slots__ = ('client_id', 'email', 'telegram_id', 'enabled')
+
+    def __init__(self, client_id, email, telegram_id=None, enabled=True):
+        self.client_id = client_id
+        self.email = email
+        self.telegram_id = telegram_id
+        self.enabled = enabled
+
+    def __repr__(self):
+        return f"IndexedClient({self.client_id!r}, {self.email!r}, {self.telegram_id!r}, {self.enabled!r})"
+
+
+class ClientRecord:
+    """Клиент из списка панели без лишних полей ответа"""
+    __slots__ = ('client_id', 'email', 'telegram_id', 'enabled', 'up', 'down')
+
+    def __init__(self, client_id, email, telegram_id=None, enabled=True, up=0, down=0):
+        self.client_id = client_id
+        self.email = email
+        self.telegram_id = telegram_id
+        self.enabled = enabled
+        self.up = up
+        self.down = down
+
+    def __repr__(self):
+        return f"ClientRecord({self.client_id!r}, {self.email!r}, {self.telegram_id!r}, {self.enabled!r})"
+
+
+def client_record(client):
+    """ClientRecord из словаря клиента в ответе панели"""
+    return ClientRecord(
+        client.get('id'),
+        client.get('email'),
+        str(client.get('telegramId') or '') or None,
+        bool(client.get('enable', True)),
+        int(client.get('up') or 0),
+        int(client.get('down') or 0),
+    )
+
+
+def client_list(result):
+    """Список клиентов из ответа /api/clients (список или {'obj': [...]})"""
+    if isinstance(result, dict):
+        result = result.get('obj') or result.get('clients') or []
+    return result or []
+
+
+def check_listing(fields):
+    """Ответ панели {"success": false, "msg": ...} - ошибка, а не пустой список.
+
+    3x-ui так отвечает с кодом 200, например при истёкшей сессии; пустой
+    список удалил бы из индекса всех клиентов.
+    """
+    if isinstance(fields, dict) and fields.get('success') is False:
+        raise Exception(f"Client listing refused by panel: {fields.get('msg') or 'success=false'}")
+
+
+def client_records(result):
+    """ClientRecord по одному из уже разобранного ответа /api/clients"""
+    check_listing(result)
+    for client in client_list(result):
+        yield client_record(client)
+
+
+class ClientIndex:
+    """Индекс клиентов одной панели: email, telegram id и client id.
+
+    Полный список клиентов читается не чаще раза в ttl секунд (с ETag,
+    если панель его отдаёт), а create/enable/disable/delete обновляют
+    индекс локально, без повторного чтения списка.
+    """
+
+    def __init__(self, panel_url, ttl=CLIENT_INDEX_TTL):
+        self.panel_url = panel_url
+        self.ttl = ttl
+        self.etag = None
+        self.refreshed_at = None
+        # Клиентов в последнем полностью прочитанном списке (None - списка не было)
+        self.listed_count = None
+
+        self._lock = threading.Lock()
+        self._by_email = {}
+        self._by_id = {}
+        self._by_telegram = {}
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def is_stale(self):
+        return self.refreshed_at is None or time.monotonic() - self.refreshed_at >= self.ttl
+
+    def invalidate(self):
+        """Принудительно перечитать список при следующем обращении"""
+        self.refreshed_at = None
+        self.etag = None
+
+    def _put(self, record):
+        old = self._by_id.get(record.client_id)
+        if old is not None:
+            self._unlink(old)
+        self._by_id[record.client_id] = record
+        if record.email:
+            self._by_email[record.email] = record
+        if record.telegram_id:
+            self._by_telegram.setdefault(record.telegram_id, set()).add(record.client_id)
+
+    def _unlink(self, record):
+        if self._by_email.get(record.email) is record:
+            del self._by_email[record.email]
+        ids = self._by_telegram.get(record.telegram_id)
+        if ids is not None:
+            ids.discard(record.client_id)
+            if not ids:
+                del self._by_telegram[record.telegram_id]
+
+    def apply_listing(self, records, etag=None):
+        """Обновить индекс по полному списку клиентов панели (ClientRecord).
+
+        Изменённые записи перезаписываются, отсутствующие в списке
+        удаляются; неизменные остаются теми же объектами. records может
+        быть генератором, читающим ответ панели по частям; если он
+        прервался ошибкой, список неполон и никто не удаляется.
+        """
+        seen = set()
+        for record in records:
+            self.apply_record(record, seen)
+        self.finish_listing(seen, etag)
+
+    def apply_record(self, record, seen):
+        """Учесть одного клиента из читаемого списка; seen - id уже учтённых"""
+        if record.client_id is None:
+            return
+        with self._lock:
+            seen.add(record.client_id)
+            indexed = self._by_id.get(record.client_id)
+            if (indexed is not None and indexed.email == record.email
+                    and indexed.telegram_id == record.telegram_id):
+                indexed.enabled = record.enabled
+                return
+            self._put(IndexedClient(record.client_id, record.email, record.telegram_id,
+                                    record.enabled))
+
+    def finish_listing(self, seen, etag=None):
+        """Список прочитан до конца: удалить клиентов, которых в нём не было"""
+        with self._lock:
+            for client_id in [cid for cid in self._by_id if cid not in seen]:
+                self._unlink(self._by_id.pop(client_id))
+            self.etag = etag
+            self.refreshed_at = time.monotonic()
+            self.listed_count = len(seen)
+        logger.debug(f"Client index for {self.panel_url} refreshed: {len(seen)} clients")
+
+    def has_confirmed_listing(self):
+        """Индекс свеж и построен по полному списку, успешно прочитанному
+        с панели (в том числе пустому).
+
+        Только тогда отсутствие клиента в индексе значит, что его нет на
+        панели: отказ панели или оборванный ответ список не завершают.
+        """
+        return not self.is_stale() and self.listed_count is not None
+
+    def mark_fresh(self):
+        """Панель ответила 304: список не изменился"""
+        self.refreshed_at = time.monotonic()
+
+    def add(self, client_id, email, telegram_id=None, enabled=False):
+        with self._lock:
+            self._put(IndexedClient(client_id, email,
+                                    str(telegram_id) if telegram_id else None, enabled))
+
+    def set_enabled(self, client_id, enabled):
+        with self._lock:
+            record = self._by_id.get(client_id)
+            if record is not None:
+                record.enabled = enabled
+
+    def remove(self, client_id):
+        with self._lock:
+            record = self._by_id.pop(client_id, None)
+            if record is not None:
+                self._unlink(record)
+
+    def find_by_email(self, email):
+        return self._by_email.get(email)
+
+    def find_by_id(self, client_id):
+        return self._by_id.get(client_id)
+
+    def find_by_telegram_id(self, telegram_id):
+        with self._lock:
+            ids = list(self._by_telegram.get(str(telegram_id), ()))
+            return [self._by_id[client_id] for client_id in ids]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_client_index(panel_url):
+    """Индекс клиентов панели, общий для процесса"""
+    with _indexes_lock:
+        index = _indexes.get(panel_url)
+        if index is None:
+            index = ClientIndex(panel_url)
+            _indexes[panel_url] = index
+        return index
@@ -14,7 +14,8 @@ class Config:
         self.config['DATABASE'] = {
             'path': 'data/vpn_bot.db',
             'backup_path': 'data/backups/',
-            'backup_retention_days': '30'
+            'backup_retention_days': '30',
+            'snapshot_path': 'data/snapshots/'
         }
         
         self.config['BOT'] = {
@@ -27,7 +28,13 @@ class Config:
         self.config['PAYMENTS'] = {
             'yookassa_shop_id': 'YOUR_YOOKASSA_SHOP_ID_HERE',
             'yookassa_secret_key': 'YOUR_YOOKASSA_SECRET_KEY_HERE',
-            'payment_timeout_minutes': '30'
+            'payment_timeout_minutes': '30',
+            'yoomoney_notification_secret': '',
+            'yoomoney_token': '',
+            'outbox_workers': '4',
+            'outbox_max_attempts': '8',
+            'outbox_retry_delay_seconds': '2',
+            'outbox_max_retry_delay_seconds': '600'
         }
         
         self.config['VPN'] = {
@@ -44,6 +51,13 @@ class Config:
             'password_min_length': '8'
         }
         
+        self.config['MONITORING'] = {
+            'panel_check_concurrency': '10',
+            'panel_check_timeout_seconds': '15',
+            'cycle_timeout_seconds': '60',
+            'expiry_concurrency_per_panel': '5'
+        }
+        
         self.config['LOGGING'] = {
             'level': 'INFO',
             'file': 'logs/vpn_bot.log',
@@ -93,6 +107,14 @@ class Config:
         
         return db_path
     
+    def get_snapshot_path(self):
+        """Get directory for cached snapshots shared by web panel workers"""
+        if not os.path.exists(self.config_file):
+            self.create_config()
+        
+        self.load_config()
+        return self.config['DATABASE'].get('snapshot_path', 'data/snapshots/')
+    
     def get_bot_token(self):
         """Get bot token from configuration"""
         self.load_config()
@@ -103,6 +125,32 @@ class Config:
         self.load_config()
         return self.config['BOT'].get('admin_id')
     
+    def get_payment_timeout_minutes(self):
+        """Get how long a payment may stay pending"""
+        self.load_config()
+        return int(self.config['PAYMENTS'].get('payment_timeout_minutes', '30'))
+    
+    def get_yoomoney_notification_secret(self):
+        """Get the secret for verifying YooMoney HTTP notifications"""
+        self.load_config()
+        return self.config['PAYMENTS'].get('yoomoney_notification_secret', '')
+    
+    def get_yoomoney_token(self):
+        """Get the YooMoney API token used to read the operation history"""
+        self.load_config()
+        return self.config['PAYMENTS'].get('yoomoney_token', '')
+    
+    def get_outbox_settings(self):
+        """Get payment outbox worker pool settings"""
+        self.load_config()
+        section = self.config['PAYMENTS']
+        return {
+            'workers': int(section.get('outbox_workers', '4')),
+            'max_attempts': int(section.get('outbox_max_attempts', '8')),
+            'retry_delay': float(section.get('outbox_retry_delay_seconds', '2')),
+            'max_retry_delay': float(section.get('outbox_max_retry_delay_seconds', '600'))
+        }
+    
     def get_security_settings(self):
         """Get security settings"""
         self.load_config()
@@ -112,6 +160,17 @@ class Config:
             'session_timeout': int(self.config['SECURITY'].get('session_timeout_minutes', '60'))
         }
 
+    def get_monitoring_settings(self):
+        """Get panel monitoring settings"""
+        self.load_config()
+        section = self.config['MONITORING'] if self.config.has_section('MONITORING') else {}
+        return {
+            'max_concurrency': int(section.get('panel_check_concurrency', '10')),
+            'panel_timeout': int(section.get('panel_check_timeout_seconds', '15')),
+            'cycle_timeout': int(section.get('cycle_timeout_seconds', '60')),
+            'expiry_concurrency': int(section.get('expiry_concurrency_per_panel', '5'))
+        }
+
 if __name__ == "__main__":
     config = Config()
     config.create_config()
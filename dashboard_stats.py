@@ -0,0 +1,251 @@
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, table, column
+
+from database import Panel, Subscription, User, Payment, Alert, OUTBOX_PAYMENT_SETTLED
+
+# Панель считается онлайн, если мониторинг проверял её не раньше этого
+PANEL_ONLINE_WINDOW = timedelta(minutes=10)
+RECENT_PAYMENTS = 10
+RECENT_ALERTS = 10
+
+# События зачисления оплат: id растёт в порядке зачисления, в отличие от
+# completed_at (время операции у провайдера), поэтому годится как позиция
+payment_outbox = table('payment_outbox', column('id'), column('event_type'), column('payload'))
+
+
+def panel_client_counts(db):
+    """Подзапрос panel_id -> число активных подписок (один GROUP BY по всем панелям)"""
+    return (
+        db.query(Subscription.panel_id, func.count(Subscription.id).label('clients_count'))
+        .filter(Subscription.is_active == True)
+        .group_by(Subscription.panel_id)
+        .subquery()
+    )
+
+
+def build_dashboard_snapshot(db, now=None):
+    """Данные дашборда за постоянное число запросов, независимо от числа панелей.
+
+    1) счётчики пользователей, активных подписок и выручка - скалярные
+       подзапросы в одном SELECT;
+    2) панели вместе с числом клиентов - LEFT JOIN с GROUP BY по panel_id;
+    3-4) последние платежи и нерешённые алерты.
+    Результат - словари и списки, готовые для JSON.
+    """
+    now = now or datetime.utcnow()
+    online_since = now - PANEL_ONLINE_WINDOW
+
+    total_users, total_active_subs, total_revenue = db.query(
+        db.query(func.count(User.id)).scalar_subquery(),
+        db.query(func.count(Subscription.id)).filter(Subscription.is_active == True).scalar_subquery(),
+        db.query(func.coalesce(func.sum(Payment.amount), 0))
+        .filter(Payment.status == 'completed').scalar_subquery(),
+    ).one()
+
+    counts = panel_client_counts(db)
+    panel_rows = (
+        db.query(Panel.id, Panel.name, Panel.location, Panel.url, Panel.max_clients,
+                 Panel.is_active, Panel.last_check,
+                 func.coalesce(counts.c.clients_count, 0))
+        .outerjoin(counts, counts.c.panel_id == Panel.id)
+        .order_by(Panel.id)
+        .all()
+    )
+    panels_stats = []
+    active_panels = 0
+    for panel_id, name, location, url, max_clients, is_active, last_check, clients_count in panel_rows:
+        online = last_check is not None and last_check > online_since
+        if is_active and online:
+            active_panels += 1
+        panels_stats.append({
+            'id': panel_id,
+            'name': name,
+            'location': location,
+            'status': 'online' if online else 'offline',
+            'clients_count': clients_count,
+            'max_clients': max_clients,
+            'url': url,
+            'last_check': last_check,
+        })
+
+    recent_payments = [{
+        'id': payment.id,
+        'amount': payment.amount,
+        'payment_method': payment.payment_method,
+        'completed_at': payment.completed_at,
+    } for payment in db.query(Payment).filter(Payment.status == 'completed')
+        .order_by(Payment.completed_at.desc()).limit(RECENT_PAYMENTS)]
+
+    recent_alerts = [{
+        'id': alert.id,
+        'alert_type': alert.alert_type,
+        'message': alert.message,
+        'created_at': alert.created_at,
+    } for alert in db.query(Alert).filter(Alert.is_resolved == False)
+        .order_by(Alert.created_at.desc()).limit(RECENT_ALERTS)]
+
+    return {
+        'generated_at': now,
+        'total_users': total_users,
+        'total_active_subs': total_active_subs,
+        'total_panels': len(panels_stats),
+        'active_panels': active_panels,
+        'total_revenue': float(total_revenue or 0),
+        'panels_stats': panels_stats,
+        'recent_payments': recent_payments,
+        'recent_alerts': recent_alerts,
+    }
+
+
+def restore_times(rows, field):
+    """Снимок из JSON: строки ISO в поле field обратно в datetime для шаблонов"""
+    return [
+        dict(row, **{field: datetime.fromisoformat(row[field]) if row.get(field) else None})
+        for row in rows
+    ]
+
+
+def stats_view(snapshot):
+    """Данные /api/stats - сводные счётчики дашборда"""
+    return {
+        'total_users': snapshot['total_users'],
+        'total_active_subs': snapshot['total_active_subs'],
+        'total_panels': snapshot['total_panels'],
+        'active_panels': snapshot['active_panels'],
+        'total_revenue': snapshot['total_revenue'],
+    }
+
+
+def panel_status_view(snapshot):
+    """Данные /api/panels/status - состояние и загрузка каждой панели"""
+    return {'panels': [{
+        'id': panel['id'],
+        'status': panel['status'],
+        'clients_count': panel['clients_count'],
+        'max_clients': panel['max_clients'],
+        'last_check': panel['last_check'],
+    } for panel in snapshot['panels_stats']]}
+
+
+# Представления снимка для API: имя -> функция(snapshot)
+SNAPSHOT_VIEWS = {
+    'stats': stats_view,
+    'panel_status': panel_status_view,
+}
+
+
+def content_etag(data):
+    """ETag по содержимому: одинаковые данные дают одинаковый тег в любом воркере"""
+    body = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+def attach_views(snapshot, previous=None):
+    """Добавить в снимок представления API с ETag и временем последнего изменения.
+
+    changed_at переносится из предыдущего снимка, если данные
+    представления не изменились, - тогда Last-Modified и ETag между
+    пересчётами стабильны и клиенты получают 304.
+    """
+    previous_views = (previous or {}).get('views', {})
+    views = {}
+    for name, view in SNAPSHOT_VIEWS.items():
+        data = view(snapshot)
+        etag = content_etag(data)
+        old = previous_views.get(name)
+        changed_at = old['changed_at'] if old and old['etag'] == etag else snapshot['generated_at']
+        views[name] = {'data': data, 'etag': etag, 'changed_at': changed_at}
+    snapshot['views'] = views
+    return snapshot
+
+
+def _panel_state(panel):
+    # last_check меняется при каждой проверке; событием считаем смену состояния и загрузки
+    return panel['status'], panel['clients_count'], panel['max_clients']
+
+
+class DashboardDeltas:
+    """Изменения дашборда между опросами - источник живых обновлений.
+
+    poll(db, snapshot) возвращает список (event, data):
+    stats - новые сводные счётчики, если они изменились; panel - панель,
+    у которой сменились статус или загрузка; payment - новый платёж;
+    alert - новый алерт мониторинга. Счётчики и панели сравниваются по
+    снимку дашборда; платежи выбираются после запомненного события
+    payment_outbox (как Database.get_settled_payments_since), алерты -
+    после запомненного id. Первый опрос после reset() только запоминает
+    текущее состояние.
+    """
+
+    def __init__(self, limit=RECENT_PAYMENTS):
+        self.limit = limit
+        self.reset()
+
+    def reset(self):
+        self._stats_etag = None
+        self._panels = None
+        self._payment_mark = None
+        self._alert_mark = None
+
+    def poll(self, db, snapshot):
+        if self._panels is None:
+            self._remember(db, snapshot)
+            return []
+
+        events = []
+        stats = snapshot['views']['stats']
+        if stats['etag'] != self._stats_etag:
+            self._stats_etag = stats['etag']
+            events.append(('stats', stats['data']))
+
+        for panel in snapshot['views']['panel_status']['data']['panels']:
+            state = _panel_state(panel)
+            if self._panels.get(panel['id']) != state:
+                self._panels[panel['id']] = state
+                events.append(('panel', panel))
+
+        settled = (
+            db.query(payment_outbox.c.id, Payment)
+            .select_from(payment_outbox)
+            .join(Payment, Payment.id == func.json_extract(payment_outbox.c.payload, '$.payment_id'))
+            .filter(payment_outbox.c.id > self._payment_mark,
+                    payment_outbox.c.event_type == OUTBOX_PAYMENT_SETTLED)
+            .order_by(payment_outbox.c.id)
+            .limit(self.limit)
+            .all()
+        )
+        for event_id, payment in settled:
+            self._payment_mark = event_id
+            events.append(('payment', {
+                'id': payment.id,
+                'amount': payment.amount,
+                'payment_method': payment.payment_method,
+                'completed_at': payment.completed_at,
+            }))
+
+        alerts = (
+            db.query(Alert)
+            .filter(Alert.id > self._alert_mark)
+            .order_by(Alert.id)
+            .limit(self.limit)
+            .all()
+        )
+        for alert in alerts:
+            self._alert_mark = alert.id
+            events.append(('alert', {
+                'id': alert.id,
+                'alert_type': alert.alert_type,
+                'message': alert.message,
+                'created_at': alert.created_at,
+            }))
+        return events
+
+    def _remember(self, db, snapshot):
+        self._stats_etag = snapshot['views']['stats']['etag']
+        self._panels = {panel['id']: _panel_state(panel)
+                        for panel in snapshot['views']['panel_status']['data']['panels']}
+        self._payment_mark = db.query(func.coalesce(func.max(payment_outbox.c.id), 0)).scalar()
+        self._alert_mark = db.query(func.coalesce(func.max(Alert.id), 0)).scalar()
@@ -1,8 +1,10 @@
 import os
 import sys
+import json
 import sqlite3
 import hashlib
 import secrets
+import time
 from contextlib import contextmanager
 
 # Добавляем текущую директорию в путь для импорта
@@ -19,6 +21,56 @@ except ImportError as e:
     spec.loader.exec_module(config_module)
     Config = config_module.Config
 
+# Traffic bucket tables by granularity (bucket size in seconds)
+TRAFFIC_TABLES = {
+    60: 'traffic_minute',
+    3600: 'traffic_hour',
+    86400: 'traffic_day',
+}
+
+# How long each granularity is kept, in seconds
+TRAFFIC_RETENTION = {
+    60: 2 * 86400,
+    3600: 31 * 86400,
+    86400: 400 * 86400,
+}
+
+# Counters of clients not seen on their panel for this long are dropped
+TRAFFIC_COUNTER_RETENTION = 31 * 86400
+
+# Payment states: a payment leaves 'pending' once, except that an expired
+# payment is still completed if the money arrives late
+PAYMENT_PENDING = 'pending'
+PAYMENT_COMPLETED = 'completed'
+PAYMENT_EXPIRED = 'expired'
+PAYMENT_FAILED = 'failed'
+
+# Target state -> states it may be entered from
+PAYMENT_TRANSITIONS = {
+    PAYMENT_COMPLETED: (PAYMENT_PENDING, PAYMENT_EXPIRED),
+    PAYMENT_EXPIRED: (PAYMENT_PENDING,),
+    PAYMENT_FAILED: (PAYMENT_PENDING,),
+}
+
+# Outbox event types and states: work that must follow a settled payment
+# is written in the settlement transaction and drained by OutboxWorkerPool
+OUTBOX_PAYMENT_SETTLED = 'payment_settled'
+OUTBOX_PENDING = 'pending'
+OUTBOX_PROCESSING = 'processing'
+OUTBOX_DONE = 'done'
+OUTBOX_DEAD = 'dead'
+
+# Provider amounts are floats: a payment is covered up to this rounding slack
+PAYMENT_AMOUNT_TOLERANCE = 0.005
+
+def payment_underpaid(paid_amount, amount):
+    """True if paid_amount does not cover the payment amount"""
+    return paid_amount + PAYMENT_AMOUNT_TOLERANCE < amount
+
+def _payment_sources(target):
+    """SQL condition for rows allowed to move into the target state"""
+    return 'status IN (' + ', '.join(f"'{state}'" for state in PAYMENT_TRANSITIONS[target]) + ')'
+
 class Database:
     def __init__(self):
         self.config = Config()
@@ -116,9 +168,22 @@ class Database:
                     payment_method TEXT,
                     status TEXT DEFAULT 'pending',
                     transaction_id TEXT UNIQUE,
+                    label TEXT,
+                    completed_at TIMESTAMP,
+                    expires_at TIMESTAMP,
                     FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
                 )
             ''')
+            self._add_missing_columns(cursor, 'payments', {
+                'label': 'TEXT',
+                'completed_at': 'TIMESTAMP',
+                'expires_at': 'TIMESTAMP',
+            })
+            # Deadline for pending payments created before expires_at existed
+            cursor.execute('''
+                UPDATE payments SET expires_at = datetime(payment_date, ?)
+                WHERE status = 'pending' AND expires_at IS NULL
+            ''', (f'+{self.config.get_payment_timeout_minutes()} minutes',))
             
             # Services table
             cursor.execute('''
@@ -161,6 +226,61 @@ class Database:
                 )
             ''')
             
+            # Transactional outbox: one row per unit of follow-up work.
+            # dedup_key makes enqueueing idempotent. next_attempt_at is the
+            # retry time of a pending event and the lease expiry of a
+            # processing one, so both become due by the same condition
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS payment_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    event_type TEXT NOT NULL,
+                    dedup_key TEXT NOT NULL UNIQUE,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    last_error TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    processed_at TIMESTAMP
+                )
+            ''')
+            
+            # Traffic time series: last seen panel counters plus per-user
+            # deltas in minute buckets, rolled up into hours and days
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS traffic_counters (
+                    panel_id INTEGER NOT NULL,
+                    email TEXT NOT NULL,
+                    up INTEGER NOT NULL DEFAULT 0,
+                    down INTEGER NOT NULL DEFAULT 0,
+                    seen_at INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (panel_id, email)
+                ) WITHOUT ROWID
+            ''')
+            self._add_missing_columns(cursor, 'traffic_counters', {
+                'seen_at': 'INTEGER NOT NULL DEFAULT 0',
+            })
+            
+            for table in TRAFFIC_TABLES.values():
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        bucket INTEGER NOT NULL,
+                        user_id INTEGER NOT NULL,
+                        bytes_up INTEGER NOT NULL DEFAULT 0,
+                        bytes_down INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (bucket, user_id)
+                    ) WITHOUT ROWID
+                ''')
+            
+            # Rollup watermarks: everything below last_bucket is already
+            # aggregated into the next coarser table
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS traffic_rollup_state (
+                    granularity TEXT PRIMARY KEY,
+                    last_bucket INTEGER NOT NULL
+                )
+            ''')
+            
             # Insert default services if they don't exist
             default_services = [
                 ('VPN Basic - 1 Month', 'Basic VPN service for 1 month', 5.0, 30),
@@ -179,7 +299,23 @@ class Database:
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_user_id ON users(user_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_admins_username ON admins(username)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_payments_status ON payments(status)')
+            cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_label ON payments(label)')
+            # Only pending rows are indexed, so the index stays small as history grows
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_payments_pending_deadline
+                ON payments(expires_at) WHERE status = 'pending'
+            ''')
+            # Recently expired payments can still be paid late; range-scanned by deadline
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_payments_expired_deadline
+                ON payments(expires_at) WHERE status = 'expired'
+            ''')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_orders_expiry ON orders(expiry_date)')
+            # Only unfinished events are indexed; done rows do not slow the claim query
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_outbox_due
+                ON payment_outbox(next_attempt_at) WHERE status IN ('pending', 'processing')
+            ''')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_audit_timestamp ON audit_log(timestamp)')
             
             print(f"✅ Database initialized at: {self.db_path}")
@@ -189,6 +325,14 @@ class Database:
                 os.chmod(self.db_path, 0o600)
                 print("✅ Secure permissions set for database file")
     
+    def _add_missing_columns(self, cursor, table, columns):
+        """Add columns introduced after the table was first created"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row[1] for row in cursor.fetchall()}
+        for name, definition in columns.items():
+            if name not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
+    
     def add_user(self, user_id, username, full_name):
         """Add a new user to the database"""
         with self.get_connection() as conn:
@@ -288,6 +432,520 @@ class Database:
                 VALUES (?, ?, ?, ?, ?)
             ''', (admin_id, action, description, ip_address, user_agent))
 
+    # Payment methods
+    def create_payment(self, user_id, amount, label, payment_method='yoomoney', timeout_minutes=None):
+        """Create a pending payment identified by its provider label.
+
+        The payment expires after timeout_minutes (payment_timeout_minutes
+        from the config by default) unless it is completed first.
+        """
+        if timeout_minutes is None:
+            timeout_minutes = self.config.get_payment_timeout_minutes()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO payments (user_id, amount, payment_method, label, expires_at)
+                VALUES (?, ?, ?, ?, datetime('now', ?))
+            ''', (user_id, amount, payment_method, label, f'+{timeout_minutes} minutes'))
+            return cursor.lastrowid
+    
+    def get_pending_payment_labels(self, payment_method='yoomoney', expired_within=0):
+        """Payments that may still be paid as {label: (payment id, amount)} and the oldest payment date.
+
+        Besides pending payments this includes those that expired less than
+        expired_within seconds ago: a late payment or a missed notification
+        must still be matched, and expired -> completed is a valid transition.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT id, label, amount, payment_date FROM payments
+                INDEXED BY idx_payments_pending_deadline
+                WHERE status = '{PAYMENT_PENDING}' AND payment_method = ? AND label IS NOT NULL
+                UNION ALL
+                SELECT id, label, amount, payment_date FROM payments
+                INDEXED BY idx_payments_expired_deadline
+                WHERE status = '{PAYMENT_EXPIRED}' AND expires_at >= datetime('now', ?)
+                  AND payment_method = ? AND label IS NOT NULL
+            ''', (payment_method, f'-{int(expired_within)} seconds', payment_method))
+            pending = {}
+            oldest = None
+            for row in cursor.fetchall():
+                pending[row['label']] = (row['id'], row['amount'])
+                if oldest is None or row['payment_date'] < oldest:
+                    oldest = row['payment_date']
+            return pending, oldest
+    
+    def complete_payments(self, completions):
+        """Mark payments completed in one transaction.
+
+        completions is a list of (payment_id, transaction_id, completed_at).
+        Only rows that may still be completed change; returns their ids.
+        Each completed payment gets its fulfilment event in the same transaction.
+        """
+        completed = []
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            for payment_id, transaction_id, completed_at in completions:
+                cursor.execute(f'''
+                    UPDATE payments
+                    SET status = '{PAYMENT_COMPLETED}', transaction_id = ?, completed_at = ?
+                    WHERE id = ? AND {_payment_sources(PAYMENT_COMPLETED)}
+                ''', (transaction_id, completed_at, payment_id))
+                if cursor.rowcount:
+                    self._enqueue_payment_settled(cursor, payment_id)
+                    completed.append(payment_id)
+        return completed
+    
+    def settle_payment(self, label, transaction_id, completed_at, paid_amount=None):
+        """Settle the payment with this label exactly once.
+
+        Returns (outcome, payment_id) where outcome is 'settled',
+        'duplicate' (transaction already applied or payment already
+        completed), 'unknown' (no such label), 'underpaid' or 'failed'.
+        A payment that expired meanwhile is still settled. The fulfilment
+        event is written to the outbox in the settlement transaction.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT id FROM payments WHERE transaction_id = ?', (transaction_id,))
+            row = cursor.fetchone()
+            if row:
+                return 'duplicate', row['id']
+
+            cursor.execute('SELECT id, amount, status FROM payments WHERE label = ?', (label,))
+            payment = cursor.fetchone()
+            if payment is None:
+                return 'unknown', None
+            if payment['status'] == PAYMENT_FAILED:
+                return 'failed', payment['id']
+            if payment['status'] not in PAYMENT_TRANSITIONS[PAYMENT_COMPLETED]:
+                return 'duplicate', payment['id']
+            if paid_amount is not None and payment_underpaid(paid_amount, payment['amount']):
+                return 'underpaid', payment['id']
+
+            # The status guard keeps concurrent notifications from settling twice
+            cursor.execute(f'''
+                UPDATE payments
+                SET status = '{PAYMENT_COMPLETED}', transaction_id = ?, completed_at = ?
+                WHERE id = ? AND {_payment_sources(PAYMENT_COMPLETED)}
+            ''', (transaction_id, completed_at, payment['id']))
+            if not cursor.rowcount:
+                return 'duplicate', payment['id']
+            self._enqueue_payment_settled(cursor, payment['id'])
+            return 'settled', payment['id']
+    
+    def fail_payment(self, payment_id):
+        """Mark a pending payment failed; returns False if it already left pending"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                UPDATE payments SET status = '{PAYMENT_FAILED}'
+                WHERE id = ? AND {_payment_sources(PAYMENT_FAILED)}
+            ''', (payment_id,))
+            return cursor.rowcount > 0
+    
+    def expire_payments(self, batch_size=500):
+        """Expire one bounded batch of pending payments past their deadline.
+
+        Reads only the partial deadline index (pinned with INDEXED BY, the
+        planner would otherwise pick idx_payments_status), so the cost
+        depends on the number of pending rows, not on payment history.
+        Returns the expired ids.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id FROM payments
+                INDEXED BY idx_payments_pending_deadline
+                WHERE status = 'pending' AND expires_at < datetime('now')
+                ORDER BY expires_at
+                LIMIT ?
+            ''', (batch_size,))
+            ids = [row['id'] for row in cursor.fetchall()]
+            cursor.executemany(f'''
+                UPDATE payments SET status = '{PAYMENT_EXPIRED}'
+                WHERE id = ? AND {_payment_sources(PAYMENT_EXPIRED)}
+            ''', [(payment_id,) for payment_id in ids])
+            return ids
+    
+    def get_payment(self, payment_id):
+        """Get payment by id"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM payments WHERE id = ?', (payment_id,))
+            return cursor.fetchone()
+    
+    def get_service_by_name(self, name):
+        """Get active service by name"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM services WHERE name = ? AND is_active = 1', (name,))
+            return cursor.fetchone()
+    
+    def create_order(self, user_id, service_id, duration_days):
+        """Create an active order for a paid service"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO orders (user_id, service_id, expiry_date)
+                VALUES (?, ?, datetime('now', ?))
+            ''', (user_id, service_id, f'+{duration_days} days'))
+            return cursor.lastrowid
+
+    # Outbox methods
+    def _enqueue_outbox(self, cursor, event_type, dedup_key, payload):
+        """Add an outbox event inside the caller's transaction; a repeated dedup_key is ignored"""
+        cursor.execute('''
+            INSERT OR IGNORE INTO payment_outbox (event_type, dedup_key, payload)
+            VALUES (?, ?, ?)
+        ''', (event_type, dedup_key, json.dumps(payload)))
+        return cursor.rowcount > 0
+    
+    def _enqueue_payment_settled(self, cursor, payment_id):
+        self._enqueue_outbox(cursor, OUTBOX_PAYMENT_SETTLED, f'payment:{payment_id}',
+                             {'payment_id': payment_id})
+    
+    def claim_outbox_events(self, limit, lease_seconds=300, event_types=None):
+        """Claim up to limit due events for processing.
+
+        Due events are pending ones whose retry time has come and
+        processing ones whose lease ran out (the worker died or the
+        process restarted). Claiming bumps attempts and sets a new lease.
+        event_types restricts the claim to the types the caller handles.
+        Returns the claimed rows with the payload decoded.
+        """
+        due = f"status IN ('{OUTBOX_PENDING}', '{OUTBOX_PROCESSING}') AND next_attempt_at <= datetime('now')"
+        params = []
+        if event_types:
+            due += f" AND event_type IN ({', '.join('?' * len(event_types))})"
+            params = list(event_types)
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT id FROM payment_outbox
+                WHERE {due}
+                ORDER BY next_attempt_at
+                LIMIT ?
+            ''', params + [limit])
+            ids = [row['id'] for row in cursor.fetchall()]
+            claimed = []
+            for event_id in ids:
+                # The condition is repeated so a concurrent claimer cannot take it twice
+                cursor.execute(f'''
+                    UPDATE payment_outbox
+                    SET status = '{OUTBOX_PROCESSING}', attempts = attempts + 1,
+                        next_attempt_at = datetime('now', ?)
+                    WHERE id = ? AND {due}
+                ''', [f'+{lease_seconds} seconds', event_id] + params)
+                if cursor.rowcount:
+                    claimed.append(event_id)
+            if not claimed:
+                return []
+            cursor.execute(f'''
+                SELECT * FROM payment_outbox
+                WHERE id IN ({', '.join('?' * len(claimed))})
+                ORDER BY next_attempt_at
+            ''', claimed)
+            events = []
+            for row in cursor.fetchall():
+                event = dict(row)
+                event['payload'] = json.loads(event['payload'])
+                events.append(event)
+            return events
+    
+    def complete_outbox_event(self, event_id):
+        """Mark a claimed event done"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            self._finish_outbox_event(cursor, event_id)
+            return cursor.rowcount > 0
+    
+    def _finish_outbox_event(self, cursor, event_id):
+        cursor.execute(f'''
+            UPDATE payment_outbox
+            SET status = '{OUTBOX_DONE}', processed_at = CURRENT_TIMESTAMP, last_error = NULL
+            WHERE id = ? AND status = '{OUTBOX_PROCESSING}'
+        ''', (event_id,))
+    
+    def retry_outbox_event(self, event_id, delay_seconds, error):
+        """Release a failed event for another attempt after delay_seconds"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                UPDATE payment_outbox
+                SET status = '{OUTBOX_PENDING}', next_attempt_at = datetime('now', ?),
+                    last_error = ?
+                WHERE id = ? AND status = '{OUTBOX_PROCESSING}'
+            ''', (f'+{delay_seconds:.3f} seconds', error, event_id))
+    
+    def dead_letter_outbox_event(self, event_id, error):
+        """Park an event that keeps failing until an admin requeues it"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                UPDATE payment_outbox
+                SET status = '{OUTBOX_DEAD}', processed_at = CURRENT_TIMESTAMP, last_error = ?
+                WHERE id = ? AND status = '{OUTBOX_PROCESSING}'
+            ''', (error, event_id))
+    
+    def requeue_dead_outbox_events(self, event_ids=None):
+        """Return dead-lettered events (all or the given ids) to the queue"""
+        query = f'''
+            UPDATE payment_outbox
+            SET status = '{OUTBOX_PENDING}', attempts = 0, next_attempt_at = CURRENT_TIMESTAMP,
+                processed_at = NULL
+            WHERE status = '{OUTBOX_DEAD}'
+        '''
+        params = []
+        if event_ids:
+            query += f" AND id IN ({', '.join('?' * len(event_ids))})"
+            params = list(event_ids)
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            return cursor.rowcount
+    
+    def get_dead_outbox_events(self, limit=50):
+        """Most recent dead-lettered events"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT id, event_type, payload, attempts, last_error, created_at, processed_at
+                FROM payment_outbox WHERE status = '{OUTBOX_DEAD}'
+                ORDER BY processed_at DESC LIMIT ?
+            ''', (limit,))
+            return cursor.fetchall()
+    
+    def get_outbox_stats(self):
+        """Event counts by status and the age in seconds of the oldest due event (lag)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT status, COUNT(*) FROM payment_outbox GROUP BY status')
+            counts = {status: 0 for status in (OUTBOX_PENDING, OUTBOX_PROCESSING, OUTBOX_DONE, OUTBOX_DEAD)}
+            counts.update({row[0]: row[1] for row in cursor.fetchall()})
+            cursor.execute(f'''
+                SELECT (julianday('now') - julianday(MIN(created_at))) * 86400
+                FROM payment_outbox
+                WHERE status IN ('{OUTBOX_PENDING}', '{OUTBOX_PROCESSING}')
+            ''')
+            lag = cursor.fetchone()[0]
+            return {'counts': counts, 'lag_seconds': round(lag, 1) if lag is not None else 0.0}
+    
+    def get_settled_payments_since(self, after_event_id=None, limit=50):
+        """Payments settled after the given payment_settled outbox event.
+
+        The outbox id grows in settlement order, unlike completed_at which
+        comes from the payment provider, so it works as a live-feed
+        watermark. With after_event_id=None only the current watermark is
+        returned. Returns (rows, last_event_id).
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            if after_event_id is None:
+                cursor.execute('SELECT COALESCE(MAX(id), 0) FROM payment_outbox')
+                return [], cursor.fetchone()[0]
+            cursor.execute(f'''
+                SELECT o.id AS event_id, p.id, p.user_id, p.amount, p.payment_method, p.completed_at
+                FROM payment_outbox o
+                JOIN payments p ON p.id = json_extract(o.payload, '$.payment_id')
+                WHERE o.id > ? AND o.event_type = '{OUTBOX_PAYMENT_SETTLED}'
+                ORDER BY o.id LIMIT ?
+            ''', (after_event_id, limit))
+            rows = cursor.fetchall()
+            return rows, rows[-1]['event_id'] if rows else after_event_id
+    
+    def fulfil_settled_payment(self, event_id, payment_id, service=None):
+        """Apply a settled payment exactly once.
+
+        A payment for a service creates the order, any other payment
+        credits the balance. The event is finished in the same transaction, so a
+        retried or double-claimed event cannot apply the payment twice.
+        Returns the order id, 0 for a balance credit, None if the event
+        was already finished or the payment is not completed.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            self._finish_outbox_event(cursor, event_id)
+            if not cursor.rowcount:
+                return None
+            cursor.execute('SELECT user_id, amount, status FROM payments WHERE id = ?', (payment_id,))
+            payment = cursor.fetchone()
+            if payment is None or payment['status'] != PAYMENT_COMPLETED:
+                return None
+            if service is None:
+                cursor.execute('''
+                    UPDATE users SET balance = balance + ? WHERE user_id = ?
+                ''', (payment['amount'], payment['user_id']))
+                return 0
+            cursor.execute('''
+                INSERT INTO orders (user_id, service_id, expiry_date)
+                VALUES (?, ?, datetime('now', ?))
+            ''', (payment['user_id'], service['id'], f"+{service['duration_days']} days"))
+            # Not provisioned on a panel: orders and users have no link to
+            # a panel or its client, so the order is only recorded here
+            return cursor.lastrowid
+
+    # Traffic statistics methods
+    def record_traffic(self, panel_id, counters, now):
+        """Store traffic deltas from cumulative panel counters.
+
+        counters is a list of (email, user_id, up, down) with the totals
+        reported by the panel. Deltas against the previous totals go into
+        the current minute bucket; a counter that went down is treated as
+        a panel-side reset. The first sample of a counter is only stored
+        as the baseline: its total covers unknown history, not this minute.
+        """
+        bucket = int(now) // 60 * 60
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                'SELECT email, up, down FROM traffic_counters WHERE panel_id = ?',
+                (panel_id,)
+            )
+            previous = {row['email']: (row['up'], row['down']) for row in cursor.fetchall()}
+            
+            deltas = {}
+            for email, user_id, up, down in counters:
+                if email not in previous:
+                    continue
+                prev_up, prev_down = previous[email]
+                delta_up = up - prev_up if up >= prev_up else up
+                delta_down = down - prev_down if down >= prev_down else down
+                if user_id is not None and (delta_up or delta_down):
+                    total = deltas.setdefault(user_id, [0, 0])
+                    total[0] += delta_up
+                    total[1] += delta_down
+            
+            cursor.executemany('''
+                INSERT INTO traffic_counters (panel_id, email, up, down, seen_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(panel_id, email) DO UPDATE SET
+                    up = excluded.up, down = excluded.down, seen_at = excluded.seen_at
+            ''', [(panel_id, email, up, down, int(now)) for email, user_id, up, down in counters])
+            
+            cursor.executemany('''
+                INSERT INTO traffic_minute (bucket, user_id, bytes_up, bytes_down)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(bucket, user_id) DO UPDATE SET
+                    bytes_up = bytes_up + excluded.bytes_up,
+                    bytes_down = bytes_down + excluded.bytes_down
+            ''', [(bucket, user_id, up, down) for user_id, (up, down) in deltas.items()])
+            return len(deltas)
+    
+    def _rollup_watermark(self, cursor, granularity):
+        cursor.execute(
+            'SELECT last_bucket FROM traffic_rollup_state WHERE granularity = ?',
+            (TRAFFIC_TABLES[granularity],)
+        )
+        row = cursor.fetchone()
+        return row[0] if row else 0
+    
+    def rollup_traffic(self, now):
+        """Aggregate closed minute buckets into hours and closed hours into days"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            sizes = sorted(TRAFFIC_TABLES)
+            for fine, coarse in zip(sizes, sizes[1:]):
+                # Only buckets of fully finished coarse periods are rolled up
+                upper = int(now) // coarse * coarse
+                if fine != sizes[0]:
+                    upper = min(upper, self._rollup_watermark(cursor, sizes[sizes.index(fine) - 1]))
+                lower = self._rollup_watermark(cursor, fine)
+                if upper <= lower:
+                    continue
+                
+                cursor.execute(f'''
+                    INSERT INTO {TRAFFIC_TABLES[coarse]} (bucket, user_id, bytes_up, bytes_down)
+                    SELECT bucket / {coarse} * {coarse}, user_id, SUM(bytes_up), SUM(bytes_down)
+                    FROM {TRAFFIC_TABLES[fine]}
+                    WHERE bucket >= ? AND bucket < ?
+                    GROUP BY bucket / {coarse}, user_id
+                    ON CONFLICT(bucket, user_id) DO UPDATE SET
+                        bytes_up = bytes_up + excluded.bytes_up,
+                        bytes_down = bytes_down + excluded.bytes_down
+                ''', (lower, upper))
+                cursor.execute('''
+                    INSERT INTO traffic_rollup_state (granularity, last_bucket) VALUES (?, ?)
+                    ON CONFLICT(granularity) DO UPDATE SET last_bucket = excluded.last_bucket
+                ''', (TRAFFIC_TABLES[fine], upper))
+    
+    def _traffic_cutoff(self, cursor, size, now):
+        """Buckets below this may be pruned from the table of this size"""
+        cutoff = int(now) - TRAFFIC_RETENTION[size]
+        if size != max(TRAFFIC_TABLES):
+            cutoff = min(cutoff, self._rollup_watermark(cursor, size))
+        return cutoff
+    
+    def prune_traffic(self, now):
+        """Delete traffic buckets past their retention (only already rolled-up ones)
+        and counters of clients that have not been seen for a long time"""
+        deleted = 0
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            for size in sorted(TRAFFIC_TABLES):
+                cursor.execute(
+                    f'DELETE FROM {TRAFFIC_TABLES[size]} WHERE bucket < ?',
+                    (self._traffic_cutoff(cursor, size, now),)
+                )
+                deleted += cursor.rowcount
+            cursor.execute(
+                'DELETE FROM traffic_counters WHERE seen_at < ?',
+                (int(now) - TRAFFIC_COUNTER_RETENTION,)
+            )
+            deleted += cursor.rowcount
+        return deleted
+    
+    def get_top_traffic_users(self, start, end, limit=10, now=None):
+        """Top users by traffic for [start, end) given as unix timestamps.
+
+        The timeline is split into segments served by one table each:
+        minutes where minute rows are still kept, hours before that and
+        days before the hour rows. Segment borders are aligned to the
+        coarser table, so every bucket is counted once. Where the range
+        starts or ends inside a coarse bucket (its finer rows are pruned),
+        the whole overlapping bucket is counted.
+        """
+        if now is None:
+            now = time.time()
+        sizes = sorted(TRAFFIC_TABLES)
+        
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            parts = []
+            params = []
+            upper = end
+            for size, coarse in zip(sizes, sizes[1:] + [None]):
+                if coarse is None:
+                    lower = start
+                else:
+                    # Rows of this size below the cutoff may be gone, but the
+                    # coarse table has them rolled up
+                    cutoff = self._traffic_cutoff(cursor, size, now)
+                    lower = min(max(start, -(-cutoff // coarse) * coarse), upper)
+                if upper > lower:
+                    parts.append(
+                        f'SELECT user_id, bytes_up, bytes_down FROM {TRAFFIC_TABLES[size]} '
+                        f'WHERE bucket > ? AND bucket < ?'
+                    )
+                    params.extend([lower - size, upper])
+                upper = lower
+            
+            if not parts:
+                return []
+            params.append(limit)
+            cursor.execute(f'''
+                SELECT t.user_id, u.username, SUM(t.bytes_up) AS bytes_up,
+                       SUM(t.bytes_down) AS bytes_down,
+                       SUM(t.bytes_up + t.bytes_down) AS bytes_total
+                FROM ({' UNION ALL '.join(parts)}) t
+                LEFT JOIN users u ON u.user_id = t.user_id
+                GROUP BY t.user_id
+                ORDER BY bytes_total DESC
+                LIMIT ?
+            ''', params)
+            return cursor.fetchall()
+
     # Security methods
     def cleanup_expired_data(self):
         """Clean up expired VPN configs and orders"""
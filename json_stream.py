@@ -0,0 +1,128 @@
+import codecs
+import json
+
+_WHITESPACE = ' \t\n\r'
+
+
+class JSONArrayStream:
+    """Инкрементальный разбор JSON-массива по частям ответа.
+
+    Ответ может быть самим массивом или объектом, в котором массив лежит
+    под одним из ключей array_keys ({"success": true, "obj": [...]}).
+    feed() принимает очередной кусок байтов и возвращает элементы массива,
+    которые в нём уже целиком пришли; в памяти держится только
+    недочитанный хвост, а не весь ответ. Остальные поля объекта
+    ("success", "msg") собираются в fields. close() проверяет, что ответ
+    дочитан до конца: обрезанный ответ - ошибка, а не короткий список.
+    """
+
+    def __init__(self, array_keys=('obj', 'clients')):
+        self.array_keys = array_keys
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._state = 'start'
+        self._nested = False
+        self.fields = {}
+
+    def _skip(self, chars=_WHITESPACE):
+        buffer, pos = self._buffer, self._pos
+        while pos < len(buffer) and buffer[pos] in chars:
+            pos += 1
+        self._pos = pos
+        return pos < len(buffer)
+
+    def _decode_value(self, final):
+        """Следующее значение из буфера или None, если оно пришло не полностью"""
+        try:
+            value, end = self._json.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return None
+        # Число в самом конце буфера может быть обрезано - ждём продолжения
+        if end == len(self._buffer) and not final:
+            return None
+        self._pos = end
+        return (value,)
+
+    def feed(self, chunk, final=False):
+        if isinstance(chunk, bytes):
+            chunk = self._decoder.decode(chunk, final)
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+
+        items = []
+        while self._state != 'done':
+            if not self._skip():
+                break
+
+            if self._state == 'start':
+                char = self._buffer[self._pos]
+                self._pos += 1
+                if char == '[':
+                    self._state = 'array'
+                    self._nested = False
+                elif char == '{':
+                    self._state = 'object'
+                else:
+                    raise ValueError(f"Unexpected JSON start: {char!r}")
+
+            elif self._state == 'object':
+                if not self._skip(_WHITESPACE + ','):
+                    break
+                if self._buffer[self._pos] == '}':
+                    self._pos += 1
+                    self._state = 'done'
+                    break
+                start = self._pos
+                key = self._decode_value(final)
+                if key is None or not self._skip() or self._buffer[self._pos] != ':':
+                    self._pos = start
+                    break
+                self._pos += 1
+                if not self._skip():
+                    self._pos = start
+                    break
+                if key[0] in self.array_keys and self._buffer[self._pos] == '[':
+                    self._pos += 1
+                    self._state = 'array'
+                    self._nested = True
+                    continue
+                value = self._decode_value(final)
+                if value is None:
+                    # Значение другого ключа пока не пришло целиком
+                    self._pos = start
+                    break
+                self.fields[key[0]] = value[0]
+
+            elif self._state == 'array':
+                if not self._skip(_WHITESPACE + ','):
+                    break
+                if self._buffer[self._pos] == ']':
+                    self._pos += 1
+                    # Массив внутри объекта: дочитываем остальные поля до '}'
+                    self._state = 'object' if self._nested else 'done'
+                    continue
+                value = self._decode_value(final)
+                if value is None:
+                    break
+                items.append(value[0])
+
+        return items
+
+    def close(self):
+        """Конец ответа: разобрать остаток и проверить, что ответ закрыт"""
+        items = self.feed(b'', final=True)
+        if self._state != 'done':
+            raise ValueError("Truncated JSON in response")
+        return items
+
+
+def iter_json_array(chunks, array_keys=('obj', 'clients')):
+    """Элементы JSON-массива из итератора кусков ответа"""
+    stream = JSONArrayStream(array_keys)
+    for chunk in chunks:
+        yield from stream.feed(chunk)
+    yield from stream.close()
@@ -0,0 +1,204 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Как часто публикатор опрашивает источник изменений (секунды)
+LIVE_POLL_INTERVAL = 2.0
+# Комментарий-пинг, чтобы прокси не закрывали молчащее соединение
+LIVE_HEARTBEAT = 15.0
+# Через сколько миллисекунд браузер переподключается после обрыва
+LIVE_RETRY_MS = 5000
+# Очередь одного подключения; переполнилась - клиент получает resync
+LIVE_QUEUE_SIZE = 256
+# Сколько последних событий хранить для догона по Last-Event-ID
+LIVE_REPLAY_SIZE = 500
+# Сколько ещё опрашивать после ухода последнего подписчика, чтобы
+# переподключившиеся вкладки догнали пропущенное по Last-Event-ID
+LIVE_IDLE_GRACE = 60.0
+# Сколько новых платежей отдавать за один опрос
+LIVE_BATCH_SIZE = 50
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def format_sse(event, data, event_id=None):
+    """Сообщение text/event-stream: data - JSON в одну строку"""
+    message = f"event: {event}\n"
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    return message + f"data: {json.dumps(data, default=_json_default, separators=(',', ':'))}\n\n"
+
+
+class LiveSubscriber:
+    """Очередь сообщений одного подключения"""
+
+    def __init__(self, size=LIVE_QUEUE_SIZE):
+        self.queue = queue.Queue(size)
+        self.lagging = False
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            # Медленный клиент не тормозит остальных: его очередь сбрасывается
+            self.lagging = True
+
+    def messages(self, heartbeat=LIVE_HEARTBEAT):
+        """Бесконечный поток строк для ответа; пинг, если событий нет"""
+        while True:
+            if self.lagging:
+                self._drain()
+                self.lagging = False
+                yield format_sse('resync', {})
+            try:
+                yield self.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ': keepalive\n\n'
+
+    def _drain(self):
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+
+class EventPublisher:
+    """Один опрос изменений на процесс, раздача всем подключённым админам.
+
+    poll() возвращает список (event, data) - только то, что изменилось с
+    прошлого вызова. Поток публикатора вызывает poll раз в interval, пока
+    есть подписчики (и ещё LIVE_IDLE_GRACE секунд после ухода последнего),
+    так что N открытых вкладок стоят одного опроса. Каждое событие
+    сериализуется один раз. reset() источника вызывается перед первым
+    опросом после простоя, чтобы не присылать накопленное за это время -
+    оно уже есть на только что открытой странице. Если догнать клиента по
+    Last-Event-ID нельзя (простой, другой воркер, вытесненный буфер), он
+    получает resync и перечитывает данные сам.
+    """
+
+    def __init__(self, poll, reset=None, interval=LIVE_POLL_INTERVAL,
+                 queue_size=LIVE_QUEUE_SIZE, replay_size=LIVE_REPLAY_SIZE):
+        self.poll = poll
+        self.reset = reset
+        self.interval = interval
+        self.queue_size = queue_size
+        self._instance = f"{os.getpid():x}{int(time.time()):x}"
+        self._sequence = 0
+        self._replay = deque(maxlen=replay_size)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._last_unsubscribe = 0.0
+        self._thread = None
+        self._stats = {'polls': 0, 'events': 0, 'errors': 0}
+
+    def subscribe(self, last_event_id=None):
+        """Новое подключение; с last_event_id сначала догоняет пропущенное"""
+        subscriber = LiveSubscriber(self.queue_size)
+        with self._lock:
+            if last_event_id:
+                missed = None if not self._active.is_set() else self._missed_since(last_event_id)
+                if missed is None:
+                    subscriber.put(format_sse('resync', {}))
+                else:
+                    for message in missed:
+                        subscriber.put(message)
+            self._subscribers.add(subscriber)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='live-events', daemon=True)
+                self._thread.start()
+            self._active.set()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+            self._last_unsubscribe = time.monotonic()
+
+    def _missed_since(self, last_event_id):
+        """Сообщения после last_event_id или None, если догнать нельзя"""
+        instance, _, number = last_event_id.partition('-')
+        if instance != self._instance or not number.isdigit():
+            return None
+        number = int(number)
+        if number == self._sequence:
+            return []
+        if not self._replay or self._replay[0][0] > number + 1:
+            return None
+        return [message for sequence, message in self._replay if sequence > number]
+
+    def publish(self, event, data):
+        """Разослать событие всем подписчикам (сериализуется один раз)"""
+        with self._lock:
+            self._sequence += 1
+            message = format_sse(event, data, f"{self._instance}-{self._sequence}")
+            self._replay.append((self._sequence, message))
+            self._stats['events'] += 1
+            for subscriber in self._subscribers:
+                subscriber.put(message)
+
+    def _run(self):
+        idle = True
+        while True:
+            with self._lock:
+                if (not self._subscribers
+                        and time.monotonic() - self._last_unsubscribe > LIVE_IDLE_GRACE):
+                    self._active.clear()
+            if not self._active.is_set():
+                idle = True
+                self._active.wait()
+            started = time.monotonic()
+            try:
+                if idle and self.reset is not None:
+                    self.reset()
+                idle = False
+                events = self.poll()
+                with self._lock:
+                    self._stats['polls'] += 1
+                for event, data in events:
+                    self.publish(event, data)
+            except Exception as e:
+                with self._lock:
+                    self._stats['errors'] += 1
+                logger.error(f"Live events poll failed: {str(e)}")
+            time.sleep(max(self.interval - (time.monotonic() - started), 0))
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['subscribers'] = len(self._subscribers)
+        return stats
+
+
+class SettledPaymentFeed:
+    """Источник для EventPublisher: новые оплаты из outbox базы Database"""
+
+    def __init__(self, db, limit=LIVE_BATCH_SIZE):
+        self.db = db
+        self.limit = limit
+        self._last_event_id = None
+
+    def reset(self):
+        self._last_event_id = None
+
+    def poll(self):
+        rows, self._last_event_id = self.db.get_settled_payments_since(self._last_event_id, self.limit)
+        return [('payment', {
+            'id': row['id'],
+            'user_id': row['user_id'],
+            'amount': row['amount'],
+            'payment_method': row['payment_method'],
+            'completed_at': row['completed_at'],
+        }) for row in rows]
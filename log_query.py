@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Поиск и просмотр JSON-логов бота (формат logger.JSONFormatter).
+
+Читает текущий файл и ротированные архивы (.1.gz, .2.gz ...) от старых
+к новым. Строки сначала отбираются по подстроке и только потом
+разбираются как JSON, поэтому поиск по user_id/action в больших
+логах быстрый.
+
+Запуск: python log_query.py [--file logs/vpn_bot.log] [--user-id ID]
+        [--action NAME] [--level LEVEL] [--logger NAME] [--since ISO]
+        [--grep TEXT] [-n N] [--rotated] [-f] [--raw]
+"""
+
+import argparse
+import glob
+import gzip
+import json
+import os
+import re
+import sys
+import time
+from collections import deque
+
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+FOLLOW_INTERVAL = 0.5
+
+
+def log_files(path, rotated):
+    """Файлы лога от самого старого к текущему"""
+    files = []
+    if rotated:
+        backups = glob.glob(path + '.[0-9]*')
+        number = re.compile(re.escape(path) + r'\.(\d+)(\.gz)?$')
+        # Во время сжатия рядом с file.N.gz может лежать несжатый file.N
+        numbered = {}
+        for name in backups:
+            match = number.match(name)
+            if match:
+                numbered.setdefault(int(match.group(1)), name)
+        files = [numbered[n] for n in sorted(numbered, reverse=True)]
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def open_log(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+
+class LogFilter:
+    """Условия отбора: быстрые подстроки для сырой строки и точная проверка записи"""
+
+    def __init__(self, user_id=None, action=None, level=None, logger=None, since=None, text=None):
+        self.user_id = user_id
+        self.action = action
+        self.min_level = LEVELS.index(level) if level else 0
+        self.logger = logger
+        self.since = since
+        self.text = text
+        # Компактный JSON: "user_id":123 и "action":"buy" встречаются в строке как есть
+        self.needles = []
+        if user_id is not None:
+            self.needles.append(f'"user_id":{user_id}')
+        if action is not None:
+            self.needles.append('"action":' + json.dumps(action, ensure_ascii=False))
+        if text:
+            self.needles.append(text)
+
+    def match_line(self, line):
+        for needle in self.needles:
+            if needle not in line:
+                return None
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            return None
+        return entry if self.match(entry) else None
+
+    def match(self, entry):
+        if self.user_id is not None and entry.get('user_id') != self.user_id:
+            return False
+        if self.action is not None and entry.get('action') != self.action:
+            return False
+        if self.min_level:
+            level = entry.get('level')
+            if level not in LEVELS or LEVELS.index(level) < self.min_level:
+                return False
+        if self.logger and not (entry.get('logger') == self.logger
+                                or str(entry.get('logger', '')).startswith(self.logger + '.')):
+            return False
+        if self.since and entry.get('ts', '') < self.since:
+            return False
+        return True
+
+
+def query(files, log_filter):
+    for path in files:
+        try:
+            with open_log(path) as f:
+                for line in f:
+                    entry = log_filter.match_line(line)
+                    if entry is not None:
+                        yield entry
+        except (OSError, EOFError) as e:
+            print(f"⚠️ {path}: {e}", file=sys.stderr)
+
+
+def follow(path, log_filter):
+    """Новые записи текущего файла, как tail -f; ротацию переживает"""
+    f = open_log(path)
+    f.seek(0, os.SEEK_END)
+    inode = os.fstat(f.fileno()).st_ino
+    buffer = ''
+    try:
+        while True:
+            chunk = f.readline()
+            if chunk:
+                buffer += chunk
+                if buffer.endswith('\n'):
+                    entry = log_filter.match_line(buffer)
+                    buffer = ''
+                    if entry is not None:
+                        yield entry
+                continue
+            time.sleep(FOLLOW_INTERVAL)
+            try:
+                if os.stat(path).st_ino != inode:
+                    # Файл ротирован - продолжаем с начала нового
+                    f.close()
+                    f = open_log(path)
+                    inode = os.fstat(f.fileno()).st_ino
+            except FileNotFoundError:
+                pass
+    finally:
+        f.close()
+
+
+def format_entry(entry, raw):
+    if raw:
+        return json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+    extra = {k: v for k, v in entry.items() if k not in ('ts', 'level', 'logger', 'message', 'exc')}
+    line = f"{entry.get('ts', '')} {entry.get('level', ''):<8} {entry.get('logger', '')}: {entry.get('message', '')}"
+    if extra:
+        line += ' ' + ' '.join(f'{k}={v}' for k, v in extra.items())
+    if entry.get('exc'):
+        line += '\n' + entry['exc']
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--file', default='logs/vpn_bot.log', help='текущий файл лога')
+    parser.add_argument('--user-id', type=int)
+    parser.add_argument('--action')
+    parser.add_argument('--level', type=str.upper, choices=LEVELS, help='минимальный уровень')
+    parser.add_argument('--logger', help='имя логгера (вместе с дочерними)')
+    parser.add_argument('--since', help='не раньше, ISO-время UTC, например 2024-05-01T12:00')
+    parser.add_argument('--grep', help='подстрока в строке лога')
+    parser.add_argument('-n', '--lines', type=int, default=None, help='только последние N записей')
+    parser.add_argument('--rotated', action='store_true', help='искать и в ротированных архивах')
+    parser.add_argument('-f', '--follow', action='store_true', help='ждать новых записей')
+    parser.add_argument('--raw', action='store_true', help='выводить JSON как есть')
+    args = parser.parse_args()
+
+    log_filter = LogFilter(args.user_id, args.action, args.level, args.logger, args.since, args.grep)
+    files = log_files(args.file, args.rotated)
+    if not files and not args.follow:
+        parser.error(f"log file not found: {args.file}")
+
+    if args.follow and args.lines is None:
+        args.lines = 10
+
+    try:
+        entries = query(files, log_filter)
+        if args.lines is not None:
+            entries = deque(entries, maxlen=args.lines)
+        for entry in entries:
+            print(format_entry(entry, args.raw))
+        if args.follow:
+            sys.stdout.flush()
+            for entry in follow(args.file, log_filter):
+                print(format_entry(entry, args.raw), flush=True)
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+
+
+if __name__ == '__main__':
+    main()
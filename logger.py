@@ -1,40 +1,473 @@
+import gzip
+import json
 import logging
 import logging.handlers
+import os
+import queue
+import random
+import shutil
+import threading
+import time
+from collections import defaultdict
 from database import BotLog, SessionLocal
-from datetime import datetime
+from datetime import datetime, timedelta
+from sqlalchemy import Index, and_, or_
 import config
 
+# Очередь записей для базы: размер, максимум строк в одном INSERT и период опроса
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 500
+LOG_FLUSH_INTERVAL = 1.0
+# Сколько ждать записи остатка очереди при остановке (секунды)
+LOG_SHUTDOWN_TIMEOUT = 5.0
+
+# Записей ниже WARNING в секунду на логгер и запас для всплесков
+LOG_RATE_PER_LOGGER = 20
+LOG_BURST = 100
+# Доля сохраняемых записей ниже WARNING по логгерам (имя или префикс)
+LOG_SAMPLE_RATES = {'monitoring': 0.1}
+# Сжатие ротированных файлов
+LOG_COMPRESS_LEVEL = 6
+LOG_COMPRESS_CHUNK = 1024 * 1024
+
+# Хранение bot_logs: сколько дней, как часто чистить и сколько строк за транзакцию
+LOG_RETENTION_DAYS = 30
+LOG_RETENTION_INTERVAL = 3600
+LOG_RETENTION_BATCH_SIZE = 1000
+LOG_RETENTION_MAX_BATCHES = 100
+# Размер страницы API логов по умолчанию и максимум
+LOG_PAGE_SIZE = 50
+LOG_MAX_PAGE_SIZE = 200
+
+# Индексы bot_logs под выборки по пользователю и по действию за период;
+# created_at - для ленты без фильтров и для удаления старых записей
+BOT_LOG_INDEXES = (
+    Index('idx_bot_logs_user_created', BotLog.user_id, BotLog.created_at),
+    Index('idx_bot_logs_action_created', BotLog.action, BotLog.created_at),
+    Index('idx_bot_logs_created', BotLog.created_at),
+)
+
+_STOP = object()
+
+
 class DatabaseHandler(logging.Handler):
+    """Запись логов в bot_logs пакетами из фонового потока.
+
+    emit() только кладёт готовую строку в ограниченную очередь и не ждёт
+    базу. Поток-писатель забирает всё, что накопилось (до batch_size
+    записей), и вставляет одним executemany: чем выше нагрузка, тем
+    крупнее пакеты.
+    Если очередь полна, записи ниже WARNING отбрасываются, а WARNING и
+    выше вытесняют самую старую запись; отброшенное считается по уровням.
+    close() (его вызывает logging.shutdown при выходе) дописывает очередь.
+    """
+
+    def __init__(self, queue_size=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL, level=logging.NOTSET):
+        super().__init__(level)
+        self.queue = queue.Queue(queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = defaultdict(int)
+        self.stats = {'written': 0, 'batches': 0, 'failed': 0}
+        self._thread = threading.Thread(target=self._run, name='log-db-writer', daemon=True)
+        self._thread.start()
+
     def emit(self, record):
         try:
-            db = SessionLocal()
-            log_entry = BotLog(
-                level=record.levelname,
-                message=self.format(record),
-                user_id=getattr(record, 'user_id', None),
-                action=getattr(record, 'action', None),
-                created_at=datetime.utcnow()
-            )
-            db.add(log_entry)
+            entry = {
+                'level': record.levelname,
+                'message': self.format(record),
+                'user_id': getattr(record, 'user_id', None),
+                'action': getattr(record, 'action', None),
+                'created_at': datetime.utcfromtimestamp(record.created),
+            }
+        except Exception:
+            self.handleError(record)
+            return
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            self._drop(entry, record.levelno)
+
+    def _drop(self, entry, levelno):
+        """Очередь полна: теряем новую запись или, для WARNING и выше, самую старую"""
+        if levelno < logging.WARNING:
+            self.dropped[entry['level']] += 1
+            return
+        try:
+            oldest = self.queue.get_nowait()
+        except queue.Empty:
+            oldest = None
+        if isinstance(oldest, dict):
+            self.dropped[oldest['level']] += 1
+            oldest = entry
+        elif oldest is None:
+            oldest = entry
+        else:
+            # Служебный маркер flush/close возвращаем, теряем новую запись
+            self.dropped[entry['level']] += 1
+        try:
+            self.queue.put_nowait(oldest)
+        except queue.Full:
+            if isinstance(oldest, dict):
+                self.dropped[oldest['level']] += 1
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            markers = []
+            stop = False
+            while True:
+                if item is _STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    markers.append(item)
+                else:
+                    batch.append(item)
+                if stop or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+            for marker in markers:
+                marker.set()
+            if stop:
+                return
+
+    def _write(self, rows):
+        db = SessionLocal()
+        try:
+            # Список словарей в execute - один executemany на весь пакет
+            db.execute(BotLog.__table__.insert(), rows)
             db.commit()
-            db.close()
+            self.stats['written'] += len(rows)
+            self.stats['batches'] += 1
         except Exception:
-            pass  # Avoid recursion if database is down
+            # Не логируем ошибку записи логов, чтобы не зациклиться
+            db.rollback()
+            self.stats['failed'] += len(rows)
+        finally:
+            db.close()
+
+    def flush(self, timeout=LOG_SHUTDOWN_TIMEOUT):
+        """Дождаться записи всего, что было в очереди на момент вызова"""
+        if not self._thread.is_alive():
+            return
+        marker = threading.Event()
+        try:
+            self.queue.put(marker, timeout=timeout)
+        except queue.Full:
+            return
+        marker.wait(timeout)
+
+    def close(self):
+        if self._thread.is_alive():
+            try:
+                self.queue.put(_STOP, timeout=LOG_SHUTDOWN_TIMEOUT)
+            except queue.Full:
+                pass
+            self._thread.join(LOG_SHUTDOWN_TIMEOUT)
+        super().close()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['queued'] = self.queue.qsize()
+        stats['dropped'] = dict(self.dropped)
+        stats['dropped_total'] = sum(self.dropped.values())
+        return stats
+
+# Атрибуты LogRecord, которые не попадают в JSON как дополнительные поля
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON: ts, level, logger, message, user_id,
+    action и все поля из extra. Компактные разделители позволяют
+    log_query.py отбирать строки подстрокой до разбора JSON."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Ограничение частоты и выборка записей по логгерам.
+
+    Записи ниже WARNING проходят через token bucket логгера (rate в
+    секунду, запас burst), а для логгеров из sample_rates (имя или
+    префикс, 'monitoring' -> 0.1) сохраняется только указанная доля.
+    WARNING и выше и действия пользователей (поле action) проходят
+    всегда. Следующая пропущенная запись
+    логгера несёт поле suppressed - сколько до неё было отброшено.
+    Решение запоминается в записи, поэтому один фильтр на нескольких
+    handler'ах отбрасывает и пропускает одни и те же записи.
+    """
+
+    def __init__(self, rate=LOG_RATE_PER_LOGGER, burst=LOG_BURST, sample_rates=None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.sample_rates = dict(LOG_SAMPLE_RATES if sample_rates is None else sample_rates)
+        self._buckets = {}
+        self._suppressed = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def _sample_rate(self, name):
+        while name:
+            if name in self.sample_rates:
+                return self.sample_rates[name]
+            name = name.rpartition('.')[0]
+        return 1.0
+
+    def _decide(self, record):
+        if record.levelno >= logging.WARNING or getattr(record, 'action', None) is not None:
+            return True
+        name = record.name
+        with self._lock:
+            keep = random.random() < self._sample_rate(name)
+            if keep and self.rate:
+                now = time.monotonic()
+                tokens, last = self._buckets.get(name, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - last) * self.rate)
+                keep = tokens >= 1
+                self._buckets[name] = (tokens - 1 if keep else tokens, now)
+            if not keep:
+                self._suppressed[name] += 1
+                return False
+            suppressed = self._suppressed.pop(name, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
 
-def setup_logging():
+    def filter(self, record):
+        keep = getattr(record, '_rate_limit_keep', None)
+        if keep is None:
+            keep = self._decide(record)
+            record._rate_limit_keep = keep
+        return keep
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._suppressed)
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler, который сжимает ротированные файлы в gzip.
+
+    При ротации файл только переименовывается, а сжатие идёт в фоновом
+    потоке, так что запись в лог не ждёт gzip. Архивы называются
+    file.1.gz, file.2.gz ...; следующая ротация сначала дожидается
+    сжатия предыдущего файла. Если сжать не удалось, ошибка идёт в
+    handleError, а несжатый файл переименовывается в file.N.<время>,
+    чтобы следующая ротация его не затёрла.
+    """
+
+    def __init__(self, filename, maxBytes=0, backupCount=0, encoding=None,
+                 compresslevel=LOG_COMPRESS_LEVEL):
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount, encoding=encoding)
+        self.compresslevel = compresslevel
+        self._compressor = None
+
+    def rotation_filename(self, default_name):
+        return default_name + '.gz'
+
+    def rotate(self, source, dest):
+        if not os.path.exists(source):
+            return
+        pending = dest[:-len('.gz')]
+        if os.path.exists(pending):
+            # Несжатый остаток прошлой ротации не затираем
+            self._keep_uncompressed(pending)
+        os.replace(source, pending)
+        self._compressor = threading.Thread(target=self._compress, args=(pending, dest),
+                                            name='log-compress', daemon=True)
+        self._compressor.start()
+
+    def _compress(self, source, dest):
+        try:
+            with open(source, 'rb') as src, gzip.open(dest + '.tmp', 'wb', self.compresslevel) as dst:
+                shutil.copyfileobj(src, dst, LOG_COMPRESS_CHUNK)
+            os.replace(dest + '.tmp', dest)
+            os.remove(source)
+        except OSError:
+            self._report(f"Log compression of {source} failed")
+            if os.path.exists(dest + '.tmp'):
+                try:
+                    os.remove(dest + '.tmp')
+                except OSError:
+                    pass
+            if os.path.exists(source):
+                self._keep_uncompressed(source)
+
+    def _keep_uncompressed(self, source):
+        """Убрать несжатый файл из цепочки ротации под уникальным именем"""
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        target = f"{source}.{stamp}"
+        number = 1
+        while os.path.exists(target):
+            target = f"{source}.{stamp}.{number}"
+            number += 1
+        try:
+            os.replace(source, target)
+        except OSError:
+            self._report(f"Uncompressed log {source} not preserved")
+
+    def _report(self, message):
+        self.handleError(logging.makeLogRecord({
+            'name': __name__, 'msg': message, 'levelno': logging.ERROR, 'levelname': 'ERROR',
+        }))
+
+    def wait_compression(self, timeout=None):
+        if self._compressor is not None:
+            self._compressor.join(timeout)
+
+    def doRollover(self):
+        self.wait_compression()
+        super().doRollover()
+
+    def close(self):
+        self.wait_compression(LOG_SHUTDOWN_TIMEOUT)
+        super().close()
+
+def ensure_log_indexes():
+    """Создать индексы bot_logs, если их ещё нет"""
+    db = SessionLocal()
+    try:
+        bind = db.get_bind()
+        for index in BOT_LOG_INDEXES:
+            index.create(bind=bind, checkfirst=True)
+    finally:
+        db.close()
+
+
+def encode_log_cursor(entry):
+    return f"{entry.created_at.isoformat()},{entry.id}"
+
+
+def decode_log_cursor(cursor):
+    created_at, _, entry_id = cursor.rpartition(',')
+    return datetime.fromisoformat(created_at), int(entry_id)
+
+
+def query_bot_logs(db, user_id=None, action=None, level=None, since=None, until=None,
+                   cursor=None, limit=LOG_PAGE_SIZE):
+    """Страница записей bot_logs от новых к старым.
+
+    Пагинация по ключу (created_at, id): cursor - значение next_cursor
+    предыдущей страницы, так что глубокие страницы стоят столько же,
+    сколько первая. С фильтром user_id или action выборка идёт по
+    индексу (user_id, created_at) или (action, created_at).
+    Возвращает (записи, next_cursor или None).
+    """
+    query = db.query(BotLog)
+    if user_id is not None:
+        query = query.filter(BotLog.user_id == user_id)
+    if action is not None:
+        query = query.filter(BotLog.action == action)
+    if level is not None:
+        query = query.filter(BotLog.level == level)
+    if since is not None:
+        query = query.filter(BotLog.created_at >= since)
+    if until is not None:
+        query = query.filter(BotLog.created_at < until)
+    if cursor is not None:
+        created_at, entry_id = decode_log_cursor(cursor)
+        query = query.filter(or_(
+            BotLog.created_at < created_at,
+            and_(BotLog.created_at == created_at, BotLog.id < entry_id)
+        ))
+    entries = query.order_by(BotLog.created_at.desc(), BotLog.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_log_cursor(entries[limit - 1]) if len(entries) > limit else None
+    return entries[:limit], next_cursor
+
+
+class BotLogRetention:
+    """Удаление записей bot_logs старше retention_days.
+
+    Строки удаляются пакетами по batch_size в отдельных транзакциях от
+    самых старых (по индексу created_at), чтобы не держать долгую
+    блокировку таблицы, в которую параллельно пишет DatabaseHandler.
+    """
+
+    def __init__(self, retention_days=LOG_RETENTION_DAYS, interval=LOG_RETENTION_INTERVAL,
+                 batch_size=LOG_RETENTION_BATCH_SIZE, max_batches=LOG_RETENTION_MAX_BATCHES):
+        self.retention_days = retention_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.last_run_at = None
+        self.last_run = None
+
+    def is_due(self):
+        return self.last_run_at is None or time.monotonic() - self.last_run_at >= self.interval
+
+    def prune(self):
+        """Один проход, возвращает число удалённых записей"""
+        started = time.monotonic()
+        self.last_run_at = started
+        cutoff = datetime.utcnow() - timedelta(days=self.retention_days)
+        deleted = 0
+        batches = 0
+        while batches < self.max_batches:
+            db = SessionLocal()
+            try:
+                ids = [row[0] for row in db.query(BotLog.id)
+                       .filter(BotLog.created_at < cutoff)
+                       .order_by(BotLog.created_at)
+                       .limit(self.batch_size)]
+                if ids:
+                    db.query(BotLog).filter(BotLog.id.in_(ids)).delete(synchronize_session=False)
+                    db.commit()
+            finally:
+                db.close()
+            batches += 1
+            deleted += len(ids)
+            if len(ids) < self.batch_size:
+                break
+        self.last_run = {'deleted': deleted, 'batches': batches,
+                         'wall_time': time.monotonic() - started}
+        if deleted:
+            logging.getLogger(__name__).info(f"Deleted {deleted} bot log entries older than "
+                                             f"{self.retention_days} days in {batches} batches")
+        return deleted
+
+
+def setup_logging(rate=LOG_RATE_PER_LOGGER, burst=LOG_BURST, sample_rates=None):
     logger = logging.getLogger()
     logger.setLevel(getattr(logging, config.LOG_LEVEL))
     
-    # Форматтер
+    # Форматтеры: в файл - JSON для log_query.py, в консоль и базу - текст
     formatter = logging.Formatter(
         '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
+    json_formatter = JSONFormatter()
     
-    # Файловый handler
-    file_handler = logging.handlers.RotatingFileHandler(
-        config.LOG_FILE, maxBytes=10*1024*1024, backupCount=5
+    # Общий фильтр частоты и выборки для всех handler'ов
+    rate_filter = RateLimitFilter(rate, burst, sample_rates)
+    
+    # Файловый handler, ротированные файлы сжимаются в фоне
+    file_handler = CompressingRotatingFileHandler(
+        config.LOG_FILE, maxBytes=10*1024*1024, backupCount=5, encoding='utf-8'
     )
-    file_handler.setFormatter(formatter)
+    file_handler.setFormatter(json_formatter)
     
     # Консольный handler
     console_handler = logging.StreamHandler()
@@ -44,9 +477,15 @@ def setup_logging():
     db_handler = DatabaseHandler()
     db_handler.setFormatter(formatter)
     
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    logger.addHandler(db_handler)
+    for handler in (file_handler, console_handler, db_handler):
+        handler.addFilter(rate_filter)
+        logger.addHandler(handler)
+    
+    try:
+        ensure_log_indexes()
+    except Exception as e:
+        logger.warning(f"Bot log indexes not created: {str(e)}")
+    return rate_filter
 
 def log_user_action(user_id, action, message, level='INFO'):
     logger = logging.getLogger('user_actions')
@@ -1,49 +1,157 @@
 import asyncio
 import logging
+import time
+from collections import defaultdict
 from datetime import datetime, timedelta
-from database import SessionLocal, Panel, Alert
-from xui_api import XUIAPI
+from database import Database, SessionLocal, Panel, Alert
+from xui_api import get_async_xui_api, close_async_clients, panel_config
+from circuit_breaker import get_breaker, STATE_CLOSED
+from placement import get_placement_engine
+from traffic import TrafficCollector
+from logger import BotLogRetention, setup_logging
+from panel_resources import PanelResourceCache
+from payment import YooMoneyPoller, PaymentExpirySweeper
+from yoomoney import Client
 from telegram import Bot
 import config
 
 logger = logging.getLogger(__name__)
 
+# Параметры параллельной проверки панелей по умолчанию
+PANEL_CHECK_CONCURRENCY = 10
+PANEL_CHECK_TIMEOUT = 15
+CYCLE_TIMEOUT = 60
+SLOWEST_PANELS_REPORTED = 5
+# Одновременных выключений клиентов на одной панели
+EXPIRY_CONCURRENCY_PER_PANEL = 5
+
 class MonitoringService:
-    def __init__(self, bot_token, admin_ids):
+    def __init__(self, bot_token, admin_ids, max_concurrency=PANEL_CHECK_CONCURRENCY,
+                 panel_timeout=PANEL_CHECK_TIMEOUT, cycle_timeout=CYCLE_TIMEOUT,
+                 expiry_concurrency=EXPIRY_CONCURRENCY_PER_PANEL, traffic_collector=None,
+                 payment_poller=None, payment_sweeper=None, log_retention=None,
+                 resource_cache=None):
         self.bot_token = bot_token
         self.admin_ids = admin_ids
         self.last_alert_time = {}
+        self.max_concurrency = max_concurrency
+        self.panel_timeout = panel_timeout
+        self.cycle_timeout = cycle_timeout
+        self.expiry_concurrency = expiry_concurrency
+        self.traffic_collector = traffic_collector
+        self.payment_poller = payment_poller
+        self.payment_sweeper = payment_sweeper
+        self.log_retention = log_retention
+        # PanelResourceCache: ресурсы панелей для веб-панели из ответов проверки
+        self.resource_cache = resource_cache
+        self.last_cycle = None
+        self.last_expiry_run = None
+
+    async def _check_panel(self, panel, semaphore):
+        """Проверка одной панели с ограничением по времени"""
+        async with semaphore:
+            started = time.monotonic()
+            error = None
+            try:
+                xui = get_async_xui_api(panel_config(panel))
+                status = await asyncio.wait_for(
+                    xui.get_panel_status(timeout=self.panel_timeout),
+                    self.panel_timeout
+                )
+                panel.last_check = datetime.utcnow()
+                
+                if status is None:
+                    # Панель недоступна
+                    error = "Панель недоступна"
+                    if xui.breaker.state != STATE_CLOSED:
+                        error += f" (circuit {xui.breaker.state})"
+                    await self.send_panel_alert(panel, error)
+                else:
+                    # Панель работает нормально
+                    logger.info(f"Panel {panel.name} is online")
+                    if self.resource_cache is not None:
+                        self.resource_cache.store(panel.id, status)
+                    
+            except asyncio.TimeoutError:
+                error = f"Таймаут проверки ({self.panel_timeout} с)"
+                logger.error(f"Panel {panel.name} check timed out")
+                await self.send_panel_alert(panel, error)
+            except Exception as e:
+                error = f"Ошибка проверки: {str(e)}"
+                logger.error(f"Panel {panel.name} check failed: {str(e)}")
+                await self.send_panel_alert(panel, error)
+            
+            duration = time.monotonic() - started
+            get_placement_engine().set_health(panel.id, error is None,
+                                              duration if error is None else None)
+            return {
+                'panel_id': panel.id,
+                'name': panel.name,
+                'duration': duration,
+                'online': error is None,
+                'error': error,
+                'circuit': get_breaker(panel.url).state,
+            }
 
     async def check_panels_status(self):
-        """Проверка статуса всех панелей"""
+        """Параллельная проверка статуса всех панелей.
+
+        Одновременно проверяется не больше max_concurrency панелей, каждая
+        ограничена panel_timeout, а весь цикл - cycle_timeout.
+        """
         db = SessionLocal()
+        started_at = datetime.utcnow()
+        cycle_started = time.monotonic()
         try:
             panels = db.query(Panel).filter(Panel.is_active == True).all()
+            # Сверяем нагрузку движка размещения с базой раз в цикл
+            get_placement_engine().load_from_db(db)
             
-            for panel in panels:
-                try:
-                    xui = XUIAPI({
-                        'url': panel.url,
-                        'username': panel.username,
-                        'password': panel.password
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            tasks = {
+                asyncio.ensure_future(self._check_panel(panel, semaphore)): panel
+                for panel in panels
+            }
+            
+            results = []
+            pending = set()
+            if tasks:
+                done, pending = await asyncio.wait(tasks, timeout=self.cycle_timeout)
+                for task in done:
+                    if task.exception() is None:
+                        results.append(task.result())
+                for task in pending:
+                    task.cancel()
+                    panel = tasks[task]
+                    logger.error(f"Panel {panel.name} check cancelled by cycle timeout")
+                    results.append({
+                        'panel_id': panel.id,
+                        'name': panel.name,
+                        'duration': time.monotonic() - cycle_started,
+                        'online': False,
+                        'error': "Превышено время цикла проверки",
+                        'circuit': get_breaker(panel.url).state,
                     })
-                    
-                    status = xui.get_panel_status()
-                    panel.last_check = datetime.utcnow()
-                    
-                    if status is None:
-                        # Панель недоступна
-                        await self.send_panel_alert(panel, "Панель недоступна")
-                    else:
-                        # Панель работает нормально
-                        logger.info(f"Panel {panel.name} is online")
-                        
-                except Exception as e:
-                    logger.error(f"Panel {panel.name} check failed: {str(e)}")
-                    await self.send_panel_alert(panel, f"Ошибка проверки: {str(e)}")
+                if pending:
+                    await asyncio.gather(*pending, return_exceptions=True)
             
             db.commit()
             
+            results.sort(key=lambda r: r['duration'], reverse=True)
+            self.last_cycle = {
+                'started_at': started_at,
+                'wall_time': time.monotonic() - cycle_started,
+                'panels_checked': len(results),
+                'panels_online': sum(1 for r in results if r['online']),
+                'timed_out': len(pending),
+                'slowest': results[:SLOWEST_PANELS_REPORTED],
+                'open_circuits': [r['name'] for r in results if r['circuit'] != STATE_CLOSED],
+            }
+            logger.info(
+                f"Panels check: {self.last_cycle['panels_online']}/{len(results)} online "
+                f"in {self.last_cycle['wall_time']:.2f}s"
+            )
+            
         except Exception as e:
             logger.error(f"Panels status check failed: {str(e)}")
         finally:
@@ -89,9 +197,78 @@ class MonitoringService:
             except Exception as e:
                 logger.error(f"Failed to send alert to admin {admin_id}: {str(e)}")
 
+    async def _expire_panel_clients(self, panel, subs, semaphore):
+        """Отключение клиентов истекших подписок одной панели.
+
+        Индекс клиентов панели обновляется один раз, затем выключения идут
+        параллельно, не больше expiry_concurrency одновременно. Подписка
+        закрывается, только если клиент выключен или успешно прочитанный
+        полный список панели (пусть и пустой) подтвердил, что клиента на
+        ней нет; иначе она остаётся активной до следующего цикла.
+        """
+        counts = {'panel_id': panel.id, 'name': panel.name, 'disabled': 0, 'not_found': 0, 'failed': 0}
+        xui = get_async_xui_api(panel_config(panel))
+        panel_semaphore = asyncio.Semaphore(self.expiry_concurrency)
+
+        async with semaphore:
+            try:
+                await xui.refresh_client_index()
+            except Exception as e:
+                logger.error(f"Client index refresh failed for panel {panel.name}: {str(e)}")
+                counts['failed'] = len(subs)
+                return counts
+
+            async def expire(sub, missing):
+                async with panel_semaphore:
+                    try:
+                        client_id = await xui.find_client_id(sub.email)
+                        if client_id is None:
+                            missing.append(sub)
+                            return
+                        await xui.disable_client(client_id)
+                        counts['disabled'] += 1
+                        sub.is_active = False
+                    except Exception as e:
+                        counts['failed'] += 1
+                        logger.error(f"Failed to disable client for expired sub {sub.id}: {str(e)}")
+
+            missing = []
+            await asyncio.gather(*(expire(sub, missing) for sub in subs))
+            if not missing:
+                return counts
+
+            # Индекс мог отстать от панели (клиента создал другой процесс):
+            # перечитываем список целиком и проверяем ненайденных ещё раз
+            try:
+                await xui.refresh_client_index(force=True)
+                confirmed = xui.client_index.has_confirmed_listing()
+            except Exception as e:
+                logger.error(f"Client index refresh failed for panel {panel.name}: {str(e)}")
+                confirmed = False
+            if not confirmed:
+                counts['failed'] += len(missing)
+                logger.warning(f"{len(missing)} expired clients not found on panel {panel.name}, "
+                               f"listing not confirmed; retry next cycle")
+                return counts
+
+            still_missing = []
+            await asyncio.gather(*(expire(sub, still_missing) for sub in missing))
+            # Полный список подтвердил, что клиента на панели нет - закрываем подписку
+            for sub in still_missing:
+                counts['not_found'] += 1
+                sub.is_active = False
+        return counts
+
     async def check_subscriptions(self):
-        """Проверка истекших подписок"""
+        """Проверка истекших подписок.
+
+        Подписки группируются по панелям: панели читаются одним запросом,
+        на каждую панель используется один клиент. Подписка остаётся
+        активной, если клиента не удалось выключить, и повторяется в
+        следующем цикле.
+        """
         db = SessionLocal()
+        started = time.monotonic()
         try:
             from database import Subscription
             expired_subs = db.query(Subscription).filter(
@@ -99,39 +276,130 @@ class MonitoringService:
                 Subscription.expires_at < datetime.utcnow()
             ).all()
             
+            by_panel = defaultdict(list)
             for sub in expired_subs:
-                # Отключаем подписку
-                sub.is_active = False
-                
-                # Находим панель и отключаем клиента
-                panel = db.query(Panel).filter(Panel.id == sub.panel_id).first()
-                if panel:
-                    try:
-                        xui = XUIAPI({
-                            'url': panel.url,
-                            'username': panel.username,
-                            'password': panel.password
-                        })
-                        # Здесь нужно найти client_id по email и отключить
-                        # xui.disable_client(client_id)
-                    except Exception as e:
-                        logger.error(f"Failed to disable client for expired sub {sub.id}: {str(e)}")
+                by_panel[sub.panel_id].append(sub)
+            
+            panels = {}
+            if by_panel:
+                panels = {
+                    panel.id: panel
+                    for panel in db.query(Panel).filter(Panel.id.in_(list(by_panel))).all()
+                }
+            
+            # Подписки без панели отключаем только в базе
+            for panel_id in set(by_panel) - set(panels):
+                for sub in by_panel.pop(panel_id):
+                    sub.is_active = False
+            
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            per_panel = await asyncio.gather(*(
+                self._expire_panel_clients(panels[panel_id], subs, semaphore)
+                for panel_id, subs in by_panel.items()
+            ))
             
             db.commit()
-            logger.info(f"Disabled {len(expired_subs)} expired subscriptions")
+            
+            self.last_expiry_run = {
+                'expired': len(expired_subs),
+                'disabled': sum(c['disabled'] for c in per_panel),
+                'not_found': sum(c['not_found'] for c in per_panel),
+                'failed': sum(c['failed'] for c in per_panel),
+                'wall_time': time.monotonic() - started,
+                'panels': per_panel,
+            }
+            logger.info(
+                f"Expired subscriptions: {len(expired_subs)}, "
+                f"disabled {self.last_expiry_run['disabled']}, "
+                f"failed {self.last_expiry_run['failed']} "
+                f"in {self.last_expiry_run['wall_time']:.2f}s"
+            )
             
         except Exception as e:
             logger.error(f"Subscriptions check failed: {str(e)}")
         finally:
             db.close()
 
+    async def collect_traffic(self):
+        """Сбор статистики трафика клиентов, если подошло время"""
+        if self.traffic_collector is None or not self.traffic_collector.is_due():
+            return
+        db = SessionLocal()
+        try:
+            panels = [
+                (panel.id, get_async_xui_api(panel_config(panel)))
+                for panel in db.query(Panel).filter(Panel.is_active == True).all()
+            ]
+        finally:
+            db.close()
+        
+        result = await self.traffic_collector.collect(panels)
+        logger.info(f"Traffic collected from {result['panels']} panels, "
+                    f"{result['users_updated']} users updated")
+
+    async def poll_payments(self):
+        """Проверка оплат YooMoney одним чтением истории, если подошло время"""
+        if self.payment_poller is None or not self.payment_poller.is_due():
+            return
+        loop = asyncio.get_running_loop()
+        # Клиент YooMoney синхронный - не блокируем event loop
+        await loop.run_in_executor(None, self.payment_poller.poll)
+
+    async def expire_payments(self):
+        """Закрытие просроченных ожидающих платежей, если подошло время"""
+        if self.payment_sweeper is None or not self.payment_sweeper.is_due():
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.payment_sweeper.sweep)
+
+    async def prune_logs(self):
+        """Удаление старых записей bot_logs, если подошло время"""
+        if self.log_retention is None or not self.log_retention.is_due():
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.log_retention.prune)
+
     async def start_monitoring(self):
         """Запуск мониторинга"""
-        while True:
-            try:
-                await self.check_panels_status()
-                await self.check_subscriptions()
-            except Exception as e:
-                logger.error(f"Monitoring cycle failed: {str(e)}")
-            
-            await asyncio.sleep(config.CHECK_INTERVAL)
+        try:
+            while True:
+                try:
+                    await self.check_panels_status()
+                    await self.check_subscriptions()
+                    await self.collect_traffic()
+                    await self.poll_payments()
+                    await self.expire_payments()
+                    await self.prune_logs()
+                except Exception as e:
+                    logger.error(f"Monitoring cycle failed: {str(e)}")
+                
+                await asyncio.sleep(config.CHECK_INTERVAL)
+        finally:
+            await close_async_clients()
+
+
+def build_monitoring_service(settings=None):
+    """MonitoringService по config.ini вместе со сборщиками трафика, чисткой
+    логов, кэшем ресурсов панелей для веб-панели и обработкой платежей"""
+    db = Database()
+    settings = settings or config.Config()
+    admin_ids = [int(admin_id) for admin_id in str(settings.get_admin_id()).split(',')
+                 if admin_id.strip().isdigit()]
+    # Без токена история операций недоступна: платежи закрывают только уведомления
+    yoomoney_token = settings.get_yoomoney_token()
+    if not yoomoney_token:
+        logger.warning("YooMoney token is not set, payment history is not polled")
+    return MonitoringService(
+        settings.get_bot_token(), admin_ids,
+        traffic_collector=TrafficCollector(db),
+        payment_poller=YooMoneyPoller(db, Client(yoomoney_token)) if yoomoney_token else None,
+        payment_sweeper=PaymentExpirySweeper(db),
+        log_retention=BotLogRetention(),
+        resource_cache=PanelResourceCache(),
+        **settings.get_monitoring_settings()
+    )
+
+
+if __name__ == '__main__':
+    setup_logging()
+    asyncio.run(build_monitoring_service().start_monitoring())
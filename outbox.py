@@ -0,0 +1,197 @@
+import calendar
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Параметры пула по умолчанию
+OUTBOX_WORKERS = 4
+# Как часто проверять outbox, если никто не разбудил (секунды)
+OUTBOX_POLL_INTERVAL = 2.0
+# Сколько секунд событие закреплено за обработчиком; потом его заберут снова
+OUTBOX_LEASE = 300
+# Попыток до dead letter и экспоненциальная задержка между ними
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_RETRY_DELAY = 2.0
+OUTBOX_MAX_RETRY_DELAY = 600.0
+# Окно для расчёта пропускной способности (секунды)
+THROUGHPUT_WINDOW = 60
+LATENCY_SAMPLES = 1000
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class OutboxWorkerPool:
+    """Разбор таблицы payment_outbox пулом потоков.
+
+    Диспетчер забирает из базы не больше событий, чем свободных
+    обработчиков, так что одновременно выполняется не более workers
+    событий. handlers - словарь event_type -> функция(event); события
+    других типов пул не берёт, их разбирают другие процессы. Успешное
+    событие отмечается done (если обработчик не сделал этого сам в своей
+    транзакции), ошибка откладывает его с экспоненциальной задержкой,
+    после max_attempts попыток событие уходит в dead letter.
+    Всё состояние в базе: после перезапуска работа продолжается с места
+    остановки, зависшие события возвращаются по истечении lease.
+    """
+
+    def __init__(self, db, handlers, workers=OUTBOX_WORKERS, poll_interval=OUTBOX_POLL_INTERVAL,
+                 lease=OUTBOX_LEASE, max_attempts=OUTBOX_MAX_ATTEMPTS,
+                 retry_delay=OUTBOX_RETRY_DELAY, max_retry_delay=OUTBOX_MAX_RETRY_DELAY):
+        self.db = db
+        self.handlers = handlers
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+        self._executor = None
+        self._dispatcher = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._slots = threading.Semaphore(workers)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._finished = deque()
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._stats = {'claimed': 0, 'processed': 0, 'retried': 0, 'dead_lettered': 0}
+
+    def start(self):
+        """Запуск диспетчера и обработчиков (повторный вызов ничего не делает)"""
+        with self._lock:
+            if self._dispatcher is not None and self._dispatcher.is_alive():
+                return
+            self._stopping.clear()
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='outbox-worker')
+            self._dispatcher = threading.Thread(target=self._run, name='outbox-dispatcher',
+                                                daemon=True)
+            self._dispatcher.start()
+
+    def stop(self, timeout=None):
+        """Остановка: новые события не берутся, начатые дорабатываются"""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._dispatcher is not None:
+            self._dispatcher.join(timeout)
+            self._dispatcher = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def notify(self, *args):
+        """Разбудить диспетчер: в outbox появилась работа (подходит как on_settled)"""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            # Ждём свободный обработчик, прежде чем забирать события из базы
+            self._slots.acquire()
+            self._slots.release()
+            free = self._free_slots()
+            events = []
+            try:
+                events = self.db.claim_outbox_events(free, self.lease, list(self.handlers))
+            except Exception as e:
+                logger.error(f"Outbox claim failed: {str(e)}")
+
+            for event in events:
+                self._slots.acquire()
+                with self._lock:
+                    self._in_flight += 1
+                    self._stats['claimed'] += 1
+                self._executor.submit(self._process, event)
+
+            # Забрали полную порцию - возможно, в очереди есть ещё
+            if events and len(events) == free:
+                continue
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _free_slots(self):
+        with self._lock:
+            return max(self.workers - self._in_flight, 1)
+
+    def _process(self, event):
+        try:
+            handler = self.handlers.get(event['event_type'])
+            if handler is None:
+                raise Exception(f"No handler for outbox event type {event['event_type']}")
+            handler(event)
+            self.db.complete_outbox_event(event['id'])
+            self._record_done(event)
+        except Exception as e:
+            self._record_failure(event, e)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+    def retry_delay_for(self, attempts):
+        """Экспоненциальная задержка перед попыткой attempts + 1, со случайным разбросом"""
+        delay = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+        return delay * random.uniform(0.5, 1.0)
+
+    def _record_failure(self, event, error):
+        message = f"{type(error).__name__}: {error}"
+        try:
+            if event['attempts'] >= self.max_attempts:
+                self.db.dead_letter_outbox_event(event['id'], message)
+                with self._lock:
+                    self._stats['dead_lettered'] += 1
+                logger.error(f"Outbox event {event['id']} ({event['event_type']}) dead-lettered "
+                             f"after {event['attempts']} attempts: {message}")
+            else:
+                delay = self.retry_delay_for(event['attempts'])
+                self.db.retry_outbox_event(event['id'], delay, message)
+                with self._lock:
+                    self._stats['retried'] += 1
+                logger.warning(f"Outbox event {event['id']} ({event['event_type']}) failed, "
+                               f"retry in {delay:.1f} s: {message}")
+        except Exception as e:
+            # Событие останется processing и вернётся в работу по истечении lease
+            logger.error(f"Outbox event {event['id']} failure not recorded: {str(e)}")
+
+    def _record_done(self, event):
+        now = time.time()
+        created = event.get('created_at')
+        with self._lock:
+            self._stats['processed'] += 1
+            self._finished.append(now)
+            if created:
+                try:
+                    # created_at записан в UTC (CURRENT_TIMESTAMP)
+                    created_ts = calendar.timegm(time.strptime(str(created)[:19], '%Y-%m-%d %H:%M:%S'))
+                    self._latencies.append(now - created_ts)
+                except ValueError:
+                    pass
+
+    def get_stats(self):
+        """Счётчики пула, пропускная способность и отставание очереди"""
+        now = time.time()
+        with self._lock:
+            while self._finished and self._finished[0] < now - THROUGHPUT_WINDOW:
+                self._finished.popleft()
+            stats = dict(self._stats)
+            stats['in_flight'] = self._in_flight
+            stats['throughput_per_min'] = len(self._finished) * 60 / THROUGHPUT_WINDOW
+            latencies = sorted(self._latencies)
+        stats['workers'] = self.workers
+        stats['running'] = self._dispatcher is not None and self._dispatcher.is_alive()
+        stats['latency_p50'] = _percentile(latencies, 0.5)
+        stats['latency_p95'] = _percentile(latencies, 0.95)
+        try:
+            stats.update(self.db.get_outbox_stats())
+        except Exception as e:
+            logger.error(f"Outbox stats query failed: {str(e)}")
+        return stats
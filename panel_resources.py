@@ -0,0 +1,104 @@
+import logging
+import threading
+import time
+
+from snapshot_cache import SnapshotCache
+from xui_api import get_xui_api
+
+logger = logging.getLogger(__name__)
+
+# Старше этого (секунды) данные о ресурсах считаются устаревшими
+PANEL_RESOURCES_MAX_AGE = 600
+
+
+def resources_from_status(status):
+    """CPU, память, диск и трафик из ответа /api/status панели 3x-ui"""
+    data = status.get('obj', status) if isinstance(status, dict) else None
+    if not isinstance(data, dict):
+        return None
+    mem = data.get('mem') or {}
+    disk = data.get('disk') or {}
+    traffic = data.get('netTraffic') or {}
+    io = data.get('netIO') or {}
+    return {
+        'cpu': data.get('cpu'),
+        'mem_used': mem.get('current'),
+        'mem_total': mem.get('total'),
+        'disk_used': disk.get('current'),
+        'disk_total': disk.get('total'),
+        'traffic_sent': traffic.get('sent'),
+        'traffic_recv': traffic.get('recv'),
+        'speed_up': io.get('up'),
+        'speed_down': io.get('down'),
+        'uptime': data.get('uptime'),
+        'xray_state': (data.get('xray') or {}).get('state'),
+    }
+
+
+class PanelResourceCache:
+    """Последние данные о ресурсах панелей со временем сбора.
+
+    Пишет цикл мониторинга (store после каждой успешной проверки), читает
+    веб-панель (get) - без обращения к самой панели. Данные лежат в
+    SnapshotCache, отдельный файл на панель, поэтому кэш общий для
+    процесса бота и воркеров веб-панели; время сбора - время записи
+    файла. refresh_async обновляет одну панель в фоновом потоке, не больше
+    одного обновления панели одновременно.
+    """
+
+    def __init__(self, max_age=PANEL_RESOURCES_MAX_AGE, cache=None):
+        self.max_age = max_age
+        self.cache = cache or SnapshotCache(max_age)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(panel_id):
+        return f'panel_resources_{panel_id}'
+
+    def store(self, panel_id, status):
+        """Сохранить ресурсы из ответа панели; False, если ответ не разобран"""
+        resources = resources_from_status(status)
+        if resources is None:
+            return False
+        try:
+            self.cache.put(self._key(panel_id), resources)
+            return True
+        except OSError as e:
+            logger.warning(f"Panel {panel_id} resources not cached: {str(e)}")
+            return False
+
+    def get(self, panel_id):
+        """(ресурсы, возраст в секундах) или (None, None), если данных ещё нет"""
+        resources, mtime = self.cache.peek(self._key(panel_id))
+        if resources is None:
+            return None, None
+        return resources, max(time.time() - mtime, 0)
+
+    def is_stale(self, age):
+        return age is None or age > self.max_age
+
+    def is_refreshing(self, panel_id):
+        with self._lock:
+            return panel_id in self._refreshing
+
+    def refresh_async(self, panel_id, config):
+        """Запросить ресурсы панели в фоне; False, если обновление уже идёт"""
+        with self._lock:
+            if panel_id in self._refreshing:
+                return False
+            self._refreshing.add(panel_id)
+        threading.Thread(target=self._refresh, args=(panel_id, config),
+                         name=f'panel-resources-{panel_id}', daemon=True).start()
+        return True
+
+    def _refresh(self, panel_id, config):
+        try:
+            status = get_xui_api(config).get_panel_status()
+            if status is not None:
+                self.store(panel_id, status)
+        except Exception as e:
+            logger.error(f"Panel {panel_id} resources refresh failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(panel_id)
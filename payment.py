@@ -1,16 +1,61 @@
 from yoomoney import Quickpay, Client
+import hashlib
+import hmac
 import logging
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
+
+from database import OUTBOX_PAYMENT_SETTLED, payment_underpaid
 
 logger = logging.getLogger(__name__)
 
+# Как часто читать историю операций YooMoney (секунды)
+POLL_INTERVAL = 60
+# Запас при чтении истории от курсора: операции могут появиться с опозданием
+POLL_OVERLAP = timedelta(minutes=10)
+# Сколько ещё сверять с историей уже просроченные платежи: оплата могла
+# прийти к самому сроку, а уведомление о ней - потеряться
+POLL_EXPIRED_GRACE = timedelta(hours=1)
+# Операций на одной странице истории (максимум API)
+HISTORY_PAGE_SIZE = 100
+# Как часто искать просроченные платежи (секунды) и сколько закрывать за транзакцию
+EXPIRY_INTERVAL = 60
+EXPIRY_BATCH_SIZE = 500
+# Потолок пакетов за один проход, чтобы проход не затягивался
+EXPIRY_MAX_BATCHES = 20
+# Поля HTTP-уведомления YooMoney в порядке строки для sha1_hash
+NOTIFICATION_HASH_FIELDS = ('notification_type', 'operation_id', 'amount', 'currency',
+                            'datetime', 'sender', 'codepro')
+
+
+def parse_payment_label(label):
+    """(user_id, tariff_name) из метки платежа вида user_id_YYYYmmddHHMMSS_tariff"""
+    parts = (label or '').split('_', 2)
+    if len(parts) < 3 or not parts[0].isdigit():
+        return None, None
+    return int(parts[0]), parts[2]
+
 class PaymentProcessor:
-    def __init__(self, yoomoney_token, yoomoney_receiver):
+    def __init__(self, db, yoomoney_token, yoomoney_receiver, client=None):
+        self.db = db
         self.yoomoney_token = yoomoney_token
         self.yoomoney_receiver = yoomoney_receiver
+        self._client = client
+
+    @property
+    def client(self):
+        """Клиент YooMoney API, один на процессор"""
+        if self._client is None:
+            self._client = Client(self.yoomoney_token)
+        return self._client
+
+    def create_yoomoney_payment(self, user_id, amount, tariff_name, timeout_minutes=None):
+        """Создание платежа YooMoney.
 
-    def create_yoomoney_payment(self, user_id, amount, tariff_name):
-        """Создание платежа YooMoney"""
+        Платёж сохраняется в базе как pending с меткой и сроком оплаты
+        (payment_timeout_minutes из конфигурации по умолчанию) - по этой
+        метке его закрывают уведомление и YooMoneyPoller.
+        """
         try:
             label = f"{user_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}_{tariff_name}"
             
@@ -22,11 +67,13 @@ class PaymentProcessor:
                 sum=amount,
                 label=label
             )
+            record_id = self.db.create_payment(user_id, amount, label, 'yoomoney', timeout_minutes)
             
             return {
                 'success': True,
                 'payment_url': quickpay.redirected_url,
-                'payment_id': label
+                'payment_id': label,
+                'record_id': record_id
             }
         except Exception as e:
             logger.error(f"YooMoney payment creation failed: {str(e)}")
@@ -38,8 +85,7 @@ class PaymentProcessor:
     def check_yoomoney_payment(self, payment_id):
         """Проверка статуса платежа YooMoney"""
         try:
-            client = Client(self.yoomoney_token)
-            history = client.operation_history(label=payment_id)
+            history = self.client.operation_history(label=payment_id)
             
             for operation in history.operations:
                 if operation.status == 'success':
@@ -69,3 +115,248 @@ class PaymentProcessor:
             'success': False,
             'error': 'Telegram Stars payment not implemented yet'
         }
+
+
+class YooMoneyPoller:
+    """Пакетная проверка оплат YooMoney по истории операций.
+
+    Вместо запроса истории на каждый платёж входящие операции читаются
+    один раз за интервал, начиная с курсора (время последней увиденной
+    операции минус overlap), и сопоставляются со всеми ожидающими
+    метками из словаря label -> (id, сумма платежа). Операция на сумму
+    меньше платежа его не закрывает. Найденные оплаты отмечаются
+    в базе одной транзакцией вместе с событиями outbox на их выдачу.
+    Метки просроченных платежей сверяются ещё expired_grace (не меньше
+    окна чтения истории), иначе поздняя оплата после работы
+    PaymentExpirySweeper уже не нашлась бы.
+    """
+
+    def __init__(self, db, client, interval=POLL_INTERVAL, overlap=POLL_OVERLAP,
+                 on_completed=None, expired_grace=POLL_EXPIRED_GRACE):
+        self.db = db
+        self.client = client
+        self.on_completed = on_completed
+        self.interval = interval
+        self.overlap = overlap
+        self.expired_grace = max(expired_grace, overlap + timedelta(seconds=interval))
+        self.cursor = None
+        self.last_poll = None
+        self.last_run = None
+        self.stats = {'polls': 0, 'api_calls': 0, 'operations': 0, 'completed': 0, 'underpaid': 0}
+
+    def is_due(self):
+        return self.last_poll is None or time.monotonic() - self.last_poll >= self.interval
+
+    def _operations(self, from_date):
+        """Входящие операции с from_date, все страницы истории"""
+        start_record = None
+        while True:
+            history = self.client.operation_history(
+                type='deposition', from_date=from_date,
+                start_record=start_record, records=HISTORY_PAGE_SIZE
+            )
+            self.stats['api_calls'] += 1
+            yield from history.operations
+            start_record = getattr(history, 'next_record', None)
+            if not start_record:
+                break
+
+    def poll(self):
+        """Один проход: возвращает id платежей, отмеченных оплаченными"""
+        started = time.monotonic()
+        self.last_poll = started
+        self.stats['polls'] += 1
+
+        pending, oldest = self.db.get_pending_payment_labels(
+            expired_within=self.expired_grace.total_seconds())
+        if not pending:
+            self.last_run = {'pending': 0, 'operations': 0, 'completed': 0, 'underpaid': 0,
+                             'api_calls': 0, 'wall_time': time.monotonic() - started}
+            return []
+
+        if self.cursor is not None:
+            from_date = self.cursor - self.overlap
+        else:
+            # После запуска читаем историю с самого старого ожидающего платежа
+            from_date = datetime.strptime(str(oldest)[:19], '%Y-%m-%d %H:%M:%S') - self.overlap
+
+        api_calls = self.stats['api_calls']
+        matches = []
+        underpaid = 0
+        operations = 0
+        newest = self.cursor
+        for operation in self._operations(from_date):
+            operations += 1
+            if newest is None or operation.datetime > newest:
+                newest = operation.datetime
+            if operation.status != 'success':
+                continue
+            expected = pending.pop(operation.label, None)
+            if expected is None:
+                continue
+            payment_id, amount = expected
+            if payment_underpaid(operation.amount, amount):
+                # Как и для уведомлений: недоплата не закрывает платёж
+                underpaid += 1
+                logger.warning(f"YooMoney payment {payment_id}: paid {operation.amount} of {amount}")
+                continue
+            matches.append((payment_id, str(operation.operation_id), operation.datetime))
+
+        completed = self.db.complete_payments(matches) if matches else []
+        self.cursor = newest
+
+        self.stats['operations'] += operations
+        self.stats['completed'] += len(completed)
+        self.stats['underpaid'] += underpaid
+        self.last_run = {
+            'pending': len(pending) + len(matches) + underpaid,
+            'operations': operations,
+            'completed': len(completed),
+            'underpaid': underpaid,
+            'api_calls': self.stats['api_calls'] - api_calls,
+            'wall_time': time.monotonic() - started,
+        }
+        if completed:
+            logger.info(f"YooMoney: {len(completed)} payments completed "
+                        f"({operations} operations checked)")
+            if self.on_completed is not None:
+                for payment_id in completed:
+                    self.on_completed(payment_id)
+        return completed
+
+
+class PaymentExpirySweeper:
+    """Перевод просроченных ожидающих платежей в expired.
+
+    Платежи закрываются пакетами по batch_size в отдельных транзакциях,
+    так что блокировки базы короткие, а набор pending остаётся маленьким.
+    """
+
+    def __init__(self, db, interval=EXPIRY_INTERVAL, batch_size=EXPIRY_BATCH_SIZE,
+                 max_batches=EXPIRY_MAX_BATCHES):
+        self.db = db
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.last_sweep = None
+        self.last_run = None
+
+    def is_due(self):
+        return self.last_sweep is None or time.monotonic() - self.last_sweep >= self.interval
+
+    def sweep(self):
+        """Один проход, возвращает число просроченных платежей"""
+        started = time.monotonic()
+        self.last_sweep = started
+        expired = 0
+        batches = 0
+        while batches < self.max_batches:
+            ids = self.db.expire_payments(self.batch_size)
+            batches += 1
+            expired += len(ids)
+            if len(ids) < self.batch_size:
+                break
+        self.last_run = {'expired': expired, 'batches': batches,
+                         'wall_time': time.monotonic() - started}
+        if expired:
+            logger.info(f"Expired {expired} pending payments in {batches} batches")
+        return expired
+
+
+def verify_yoomoney_notification(params, secret):
+    """Проверка подписи sha1_hash HTTP-уведомления YooMoney"""
+    values = [params.get(field, '') for field in NOTIFICATION_HASH_FIELDS]
+    values += [secret, params.get('label', '')]
+    expected = hashlib.sha1('&'.join(values).encode('utf-8')).hexdigest()
+    return hmac.compare_digest(expected, params.get('sha1_hash', '').lower())
+
+
+class YooMoneyNotificationReceiver:
+    """Приём HTTP-уведомлений YooMoney о входящих переводах.
+
+    Платёж закрывается сразу по уведомлению, ровно один раз: повторные
+    уведомления с тем же operation_id (transaction_id) ничего не меняют.
+    Выдача доступа ставится в outbox в той же транзакции; on_settled
+    (обычно OutboxWorkerPool.notify) лишь будит обработчиков.
+    YooMoneyPoller остаётся запасным путём для пропущенных уведомлений.
+    """
+
+    def __init__(self, db, secret, on_settled=None):
+        self.db = db
+        self.secret = secret
+        self.on_settled = on_settled
+        self.stats = {'received': 0, 'settled': 0, 'duplicate': 0, 'rejected': 0, 'ignored': 0}
+
+    def handle(self, params):
+        """Обработка уведомления, возвращает (HTTP-статус, текст ответа)"""
+        self.stats['received'] += 1
+        if not self.secret:
+            logger.error("YooMoney notification received but notification secret is not set")
+            return 503, 'not configured'
+        if not verify_yoomoney_notification(params, self.secret):
+            self.stats['rejected'] += 1
+            logger.warning(f"YooMoney notification {params.get('operation_id')} has invalid signature")
+            return 400, 'invalid signature'
+
+        # Перевод с кодом протекции или замороженный ещё не зачислен
+        if params.get('codepro') == 'true' or params.get('unaccepted') == 'true':
+            self.stats['ignored'] += 1
+            return 200, 'not accepted yet'
+
+        label = params.get('label')
+        if not label:
+            self.stats['ignored'] += 1
+            return 200, 'no label'
+
+        try:
+            paid_amount = float(params['withdraw_amount']) if params.get('withdraw_amount') else None
+        except ValueError:
+            paid_amount = None
+
+        outcome, payment_id = self.db.settle_payment(
+            label, params.get('operation_id'), datetime.utcnow(), paid_amount
+        )
+        if outcome == 'settled':
+            self.stats['settled'] += 1
+            logger.info(f"YooMoney payment {payment_id} settled by notification")
+            if self.on_settled is not None:
+                self.on_settled(payment_id)
+        elif outcome == 'duplicate':
+            self.stats['duplicate'] += 1
+        else:
+            self.stats['ignored'] += 1
+            logger.warning(f"YooMoney notification for label {label}: {outcome}")
+        return 200, outcome
+
+
+class PaymentFulfilment:
+    """Обработчики outbox-событий оплаты для OutboxWorkerPool.
+
+    payment_settled: оплата тарифа (метка с именем услуги) создаёт заказ,
+    любая другая оплата зачисляется на баланс; это делается в одной
+    транзакции с закрытием события, поэтому повтор ничего не удвоит.
+
+    Клиент на панели после оплаты не включается: в базе нет связи
+    заказа или пользователя с панелью и клиентом на ней, поэтому
+    событий order_provision нет, и клиента включают отдельно.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    @property
+    def handlers(self):
+        return {OUTBOX_PAYMENT_SETTLED: self.fulfil}
+
+    def fulfil(self, event):
+        payment_id = event['payload']['payment_id']
+        payment = self.db.get_payment(payment_id)
+        if payment is None:
+            raise Exception(f"Payment {payment_id} not found")
+        tariff_name = parse_payment_label(payment['label'])[1]
+        service = self.db.get_service_by_name(tariff_name) if tariff_name else None
+        result = self.db.fulfil_settled_payment(event['id'], payment_id, service)
+        if result:
+            logger.info(f"Payment {payment_id}: order {result} for {tariff_name} created")
+        elif result == 0:
+            logger.info(f"Payment {payment_id}: balance of {payment['user_id']} credited")
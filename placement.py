@@ -0,0 +1,175 @@
+import heapq
+import logging
+import threading
+from sqlalchemy import func
+
+logger = logging.getLogger(__name__)
+
+# Задержка, при которой оценка панели ухудшается вдвое (секунды)
+LATENCY_REFERENCE = 1.0
+# Коэффициент сглаживания задержки (EWMA)
+LATENCY_ALPHA = 0.2
+
+
+class NoPanelAvailableError(Exception):
+    """Нет здоровой панели со свободным местом"""
+
+
+class PanelLoad:
+    """Текущая нагрузка панели"""
+    __slots__ = ('panel_id', 'active_clients', 'max_clients', 'weight',
+                 'healthy', 'latency', 'version')
+
+    def __init__(self, panel_id, max_clients, active_clients=0, weight=1.0, healthy=True):
+        self.panel_id = panel_id
+        self.max_clients = max_clients
+        self.active_clients = active_clients
+        self.weight = weight
+        self.healthy = healthy
+        self.latency = 0.0
+        self.version = 0
+
+    def has_capacity(self):
+        return not self.max_clients or self.active_clients < self.max_clients
+
+    def score(self):
+        """Чем меньше, тем лучше: заполненность с поправкой на вес и задержку"""
+        capacity = (self.max_clients or 1000) * self.weight
+        return (self.active_clients + 1) / capacity * (1 + self.latency / LATENCY_REFERENCE)
+
+
+class PlacementEngine:
+    """Выбор панели для нового клиента по наименьшей взвешенной нагрузке.
+
+    Панели лежат в куче по score(); при изменении нагрузки в кучу
+    добавляется новая запись, а устаревшие (по version) отбрасываются при
+    извлечении. Выбор и обновление стоят O(log n). Нездоровые и
+    заполненные панели в кучу не попадают.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._panels = {}
+        self._heap = []
+
+    def _push(self, load):
+        load.version += 1
+        if load.healthy and load.has_capacity():
+            heapq.heappush(self._heap, (load.score(), load.version, load.panel_id))
+        # Ленивое удаление: не даём куче разрастаться из устаревших записей
+        if len(self._heap) > 4 * len(self._panels) + 64:
+            self._rebuild()
+
+    def _rebuild(self):
+        self._heap = [
+            (load.score(), load.version, load.panel_id)
+            for load in self._panels.values()
+            if load.healthy and load.has_capacity()
+        ]
+        heapq.heapify(self._heap)
+
+    def upsert_panel(self, panel_id, max_clients, active_clients=None, weight=1.0, healthy=None):
+        """Добавить панель или обновить её параметры"""
+        with self._lock:
+            load = self._panels.get(panel_id)
+            if load is None:
+                load = PanelLoad(panel_id, max_clients, active_clients or 0, weight,
+                                 True if healthy is None else healthy)
+                self._panels[panel_id] = load
+            else:
+                load.max_clients = max_clients
+                load.weight = weight
+                if active_clients is not None:
+                    load.active_clients = active_clients
+                if healthy is not None:
+                    load.healthy = healthy
+            self._push(load)
+
+    def remove_panel(self, panel_id):
+        with self._lock:
+            self._panels.pop(panel_id, None)
+
+    def set_health(self, panel_id, healthy, latency=None):
+        """Результат проверки панели из мониторинга"""
+        with self._lock:
+            load = self._panels.get(panel_id)
+            if load is None:
+                return
+            if latency is not None:
+                load.latency = (LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * load.latency
+                                if load.latency else latency)
+            if load.healthy != healthy:
+                logger.info(f"Panel {panel_id} {'included in' if healthy else 'excluded from'} placement")
+            load.healthy = healthy
+            self._push(load)
+
+    def place(self):
+        """Выбрать панель для нового клиента и учесть его в нагрузке"""
+        with self._lock:
+            while self._heap:
+                score, version, panel_id = self._heap[0]
+                load = self._panels.get(panel_id)
+                if load is None or load.version != version:
+                    heapq.heappop(self._heap)
+                    continue
+                heapq.heappop(self._heap)
+                load.active_clients += 1
+                self._push(load)
+                return panel_id
+        raise NoPanelAvailableError("No healthy panel with free capacity")
+
+    def release(self, panel_id):
+        """Клиент панели отключён или удалён"""
+        with self._lock:
+            load = self._panels.get(panel_id)
+            if load is None or load.active_clients == 0:
+                return
+            load.active_clients -= 1
+            self._push(load)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                panel_id: {
+                    'active_clients': load.active_clients,
+                    'max_clients': load.max_clients,
+                    'healthy': load.healthy,
+                    'latency': round(load.latency, 3),
+                    'score': load.score(),
+                }
+                for panel_id, load in self._panels.items()
+            }
+
+    def load_from_db(self, db):
+        """Заполнить нагрузку из базы: один GROUP BY по активным подпискам"""
+        from database import Panel, Subscription
+
+        counts = dict(
+            db.query(Subscription.panel_id, func.count(Subscription.id))
+            .filter(Subscription.is_active == True)
+            .group_by(Subscription.panel_id)
+            .all()
+        )
+        panels = db.query(Panel).filter(Panel.is_active == True).all()
+
+        with self._lock:
+            active_ids = {panel.id for panel in panels}
+            for panel_id in list(self._panels):
+                if panel_id not in active_ids:
+                    del self._panels[panel_id]
+            for panel in panels:
+                load = self._panels.get(panel.id)
+                if load is None:
+                    load = PanelLoad(panel.id, panel.max_clients)
+                    self._panels[panel.id] = load
+                load.max_clients = panel.max_clients
+                load.active_clients = counts.get(panel.id, 0)
+                load.version += 1
+            self._rebuild()
+
+
+_engine = PlacementEngine()
+
+def get_placement_engine():
+    """Движок размещения, общий для процесса"""
+    return _engine
@@ -0,0 +1,330 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict, deque
+
+from circuit_breaker import CircuitOpenError
+from xui_api import get_async_xui_api, client_payload, BatchNotSupportedError
+
+logger = logging.getLogger(__name__)
+
+OP_CREATE = 'create'
+OP_ENABLE = 'enable'
+OP_DISABLE = 'disable'
+
+# Параметры очереди по умолчанию
+MAX_BATCH = 100
+FLUSH_INTERVAL = 0.2
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 1.0
+PANEL_CONCURRENCY = 10
+# Сколько элемент может ждать замыкания цепи панели, прежде чем считаться неудачным
+MAX_CIRCUIT_WAIT = 300
+LATENCY_SAMPLES = 1000
+
+
+class ProvisioningItem:
+    """Одна операция с клиентом панели в очереди"""
+    __slots__ = ('panel', 'op', 'params', 'future', 'enqueued_at', 'attempts',
+                 'not_before', 'deferred_at', 'sent_at')
+
+    def __init__(self, panel, op, params, future):
+        self.panel = panel
+        self.op = op
+        self.params = params
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        # Неудачные запросы к панели; отказы разомкнутой цепи не считаются
+        self.attempts = 0
+        # Отложен до этого времени (monotonic), пока цепь панели разомкнута
+        self.not_before = 0
+        self.deferred_at = None
+        # Когда не удался запрос на создание, который панель могла выполнить
+        self.sent_at = None
+
+
+class ProvisioningQueue:
+    """Очередь create/enable/disable операций с пакетной отправкой по панелям.
+
+    Операции копятся до max_batch штук или flush_interval секунд, затем
+    для каждой панели отправляются пакетными запросами. Если пакет не
+    прошёл или панель не поддерживает пакетный API, элементы повторяются
+    по одному с экспоненциальной задержкой.
+
+    Отказ разомкнутой цепи панели (CircuitOpenError) не расходует попытку:
+    элемент возвращается в очередь до пробного запроса цепи и ждёт так
+    не дольше max_circuit_wait. Создание, ответ на которое не дошёл,
+    перед повтором ищется в перечитанном списке клиентов по email, чтобы
+    не создать клиента дважды.
+    """
+
+    def __init__(self, max_batch=MAX_BATCH, flush_interval=FLUSH_INTERVAL,
+                 max_attempts=MAX_ATTEMPTS, retry_delay=RETRY_DELAY,
+                 panel_concurrency=PANEL_CONCURRENCY, max_circuit_wait=MAX_CIRCUIT_WAIT):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.panel_concurrency = panel_concurrency
+        self.max_circuit_wait = max_circuit_wait
+
+        self._pending = []
+        self._wakeup = None
+        self._worker = None
+        self._stopping = False
+        self._index_locks = defaultdict(asyncio.Lock)
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._stats = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'batches': 0,
+            'batched_items': 0,
+            'single_requests': 0,
+            'retries': 0,
+            'deferred': 0,
+        }
+
+    async def start(self):
+        """Запуск фоновой отправки очереди"""
+        if self._worker is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        """Остановка с отправкой всего, что осталось в очереди.
+
+        Фоновая отправка не прерывается посреди пакета: она дорабатывает
+        текущий flush и выходит, затем отправляется остаток очереди,
+        включая отложенное из-за разомкнутой цепи (drain).
+        """
+        self._stopping = True
+        if self._worker is not None:
+            self._wakeup.set()
+            await self._worker
+            self._worker = None
+        await self.drain()
+
+    def submit(self, panel, op, **params):
+        """Поставить операцию в очередь, результат - asyncio.Future"""
+        future = asyncio.get_running_loop().create_future()
+        if self._stopping and self._worker is None:
+            future.set_exception(RuntimeError("Provisioning queue is stopped"))
+            return future
+        self._pending.append(ProvisioningItem(panel, op, params, future))
+        self._stats['submitted'] += 1
+        if self._wakeup is not None and len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+        return future
+
+    async def create_client(self, panel, email, telegram_id, expiry_days=30, enable=False):
+        """Создание клиента через очередь, возвращает client_id"""
+        return await self.submit(panel, OP_CREATE, email=email, telegram_id=telegram_id,
+                                 expiry_days=expiry_days, enable=enable)
+
+    async def enable_client(self, panel, client_id):
+        return await self.submit(panel, OP_ENABLE, client_id=client_id)
+
+    async def disable_client(self, panel, client_id):
+        return await self.submit(panel, OP_DISABLE, client_id=client_id)
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Provisioning flush failed: {str(e)}")
+
+    async def drain(self):
+        """Отправлять, пока очередь не опустеет: отложенные элементы ждут
+        пробного запроса своей цепи (каждый не дольше max_circuit_wait)"""
+        await self.flush()
+        while self._pending:
+            wait = min(item.not_before for item in self._pending) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self.flush()
+
+    async def flush(self):
+        """Отправить всё накопленное, панели обрабатываются параллельно.
+
+        Элементы, отложенные до замыкания цепи, остаются в очереди.
+        """
+        now = time.monotonic()
+        items = [item for item in self._pending if item.not_before <= now]
+        if not items:
+            return
+        self._pending = [item for item in self._pending if item.not_before > now]
+
+        by_panel = defaultdict(list)
+        panels = {}
+        for item in items:
+            by_panel[item.panel['url']].append(item)
+            panels[item.panel['url']] = item.panel
+
+        semaphore = asyncio.Semaphore(self.panel_concurrency)
+
+        async def flush_panel(url):
+            async with semaphore:
+                await self._flush_panel(panels[url], by_panel[url])
+
+        try:
+            await asyncio.gather(*(flush_panel(url) for url in by_panel))
+        except BaseException as e:
+            # Элементы уже сняты с очереди: без результата вызывающие ждали бы вечно
+            for item in items:
+                if not item.future.done():
+                    item.future.set_exception(
+                        e if isinstance(e, Exception) else RuntimeError("Provisioning flush cancelled"))
+            raise
+
+    async def _flush_panel(self, panel, items):
+        xui = get_async_xui_api(panel)
+        by_op = defaultdict(list)
+        for item in items:
+            by_op[item.op].append(item)
+
+        # Создание раньше включения: enable может ссылаться на нового клиента
+        for op in (OP_CREATE, OP_ENABLE, OP_DISABLE):
+            op_items = by_op.get(op, [])
+            for start in range(0, len(op_items), self.max_batch):
+                batch = op_items[start:start + self.max_batch]
+                failed = await self._send_batch(xui, op, batch)
+                if failed:
+                    await asyncio.gather(*(self._send_single(xui, item) for item in failed))
+
+    async def _send_batch(self, xui, op, batch):
+        """Пакетная отправка, возвращает элементы для повтора по одному"""
+        if xui.supports_batch is False or len(batch) == 1:
+            return batch
+        try:
+            if op == OP_CREATE:
+                clients = [client_payload(item.params['email'], item.params['telegram_id'],
+                                          item.params['expiry_days'], item.params['enable'])
+                           for item in batch]
+                results = await xui.create_clients(clients)
+            else:
+                client_ids = [item.params['client_id'] for item in batch]
+                result = await xui.set_clients_enabled(client_ids, op == OP_ENABLE)
+                results = [result] * len(batch)
+        except (BatchNotSupportedError, CircuitOpenError):
+            return batch
+        except Exception as e:
+            if op == OP_CREATE:
+                # Панель могла создать часть клиентов, ответ не дошёл
+                sent_at = time.monotonic()
+                for item in batch:
+                    item.sent_at = sent_at
+            logger.warning(f"Batch {op} of {len(batch)} on {xui.panel_url} failed, "
+                           f"retrying one by one: {str(e)}")
+            return batch
+
+        self._stats['batches'] += 1
+        self._stats['batched_items'] += len(batch)
+        for item, result in zip(batch, results):
+            self._complete(item, result)
+        return []
+
+    async def _send_single(self, xui, item):
+        while True:
+            try:
+                self._stats['single_requests'] += 1
+                result = await self._apply_single(xui, item)
+            except CircuitOpenError as e:
+                self._defer(xui, item, e)
+                return
+            except Exception as e:
+                item.attempts += 1
+                if item.attempts >= self.max_attempts:
+                    self._fail(item, f"failed after {item.attempts} attempts", e)
+                    return
+                self._stats['retries'] += 1
+                await asyncio.sleep(self.retry_delay * 2 ** (item.attempts - 1))
+                continue
+            self._complete(item, result)
+            return
+
+    async def _apply_single(self, xui, item):
+        if item.op == OP_ENABLE:
+            return await xui.enable_client(item.params['client_id'])
+        if item.op == OP_DISABLE:
+            return await xui.disable_client(item.params['client_id'])
+
+        # Повтор после неудачного enable не должен создавать клиента ещё раз
+        client_id = item.params.get('client_id')
+        if client_id is None and item.sent_at is not None:
+            client_id = await self._find_created(xui, item)
+        if client_id is None:
+            try:
+                client_id = await xui.create_client(item.params['email'],
+                                                    item.params['telegram_id'],
+                                                    item.params['expiry_days'])
+            except CircuitOpenError:
+                raise
+            except Exception:
+                # Панель могла создать клиента, хотя ответ не дошёл
+                item.sent_at = time.monotonic()
+                raise
+        item.params['client_id'] = client_id
+        if item.params['enable']:
+            await xui.enable_client(client_id)
+        return client_id
+
+    async def _find_created(self, xui, item):
+        """client_id клиента, созданного запросом без ответа, или None.
+
+        Список панели перечитывается, только если он прочитан раньше, чем
+        запрос не удался: повторы на одной панели разделяют одно чтение.
+        """
+        async with self._index_locks[xui.panel_url]:
+            index = xui.client_index
+            if index.refreshed_at is None or index.refreshed_at < item.sent_at:
+                await xui.refresh_client_index(force=True)
+        record = xui.client_index.find_by_email(item.params['email'])
+        return record.client_id if record is not None else None
+
+    def _defer(self, xui, item, error):
+        """Вернуть элемент в очередь до пробного запроса цепи панели"""
+        now = time.monotonic()
+        if item.deferred_at is None:
+            item.deferred_at = now
+        if now - item.deferred_at >= self.max_circuit_wait:
+            self._fail(item, f"circuit open for {self.max_circuit_wait} s", error)
+            return
+        item.not_before = now + max(xui.breaker.retry_after(), self.flush_interval)
+        self._stats['deferred'] += 1
+        self._pending.append(item)
+
+    def _fail(self, item, reason, error):
+        self._stats['failed'] += 1
+        logger.error(f"Provisioning {item.op} on {item.panel['url']} {reason}: {str(error)}")
+        if not item.future.done():
+            item.future.set_exception(error)
+
+    def _complete(self, item, result):
+        self._stats['completed'] += 1
+        self._latencies.append(time.monotonic() - item.enqueued_at)
+        if not item.future.done():
+            item.future.set_result(result)
+
+    def get_stats(self):
+        """Счётчики очереди и задержка от постановки до выполнения"""
+        stats = dict(self._stats)
+        latencies = sorted(self._latencies)
+        stats['queued'] = len(self._pending)
+        stats['oldest_queued_age'] = (time.monotonic() - self._pending[0].enqueued_at
+                                      if self._pending else 0)
+        if latencies:
+            stats['latency_p50'] = latencies[len(latencies) // 2]
+            stats['latency_p95'] = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+        else:
+            stats['latency_p50'] = stats['latency_p95'] = None
+        stats['avg_batch_size'] = (stats['batched_items'] / stats['batches']
+                                   if stats['batches'] else 0)
+        return stats
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Сверка подписок в базе с клиентами на X-UI панелях
+"""
+
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+
+from database import SessionLocal, Panel, Subscription
+from provisioning import ProvisioningQueue, OP_DISABLE, OP_ENABLE
+from xui_api import get_async_xui_api, close_async_clients, panel_config
+
+logger = logging.getLogger(__name__)
+
+# Сколько записей каждого вида расхождений попадает в отчёт
+SAMPLE_LIMIT = 100
+# Размер пачки при чтении подписок из базы
+DB_BATCH_SIZE = 1000
+
+DRIFT_MISSING = 'missing'
+DRIFT_ORPHANED = 'orphaned'
+DRIFT_ENABLED_EXPIRED = 'enabled_but_expired'
+DRIFT_DISABLED_ACTIVE = 'disabled_but_active'
+DRIFT_KINDS = (DRIFT_MISSING, DRIFT_ORPHANED, DRIFT_ENABLED_EXPIRED, DRIFT_DISABLED_ACTIVE)
+
+
+class DriftReport:
+    """Расхождения базы и одной панели: счётчики и ограниченные выборки"""
+
+    def __init__(self, panel_id, panel_name, sample_limit=SAMPLE_LIMIT):
+        self.panel_id = panel_id
+        self.panel_name = panel_name
+        self.sample_limit = sample_limit
+        self.counts = {kind: 0 for kind in DRIFT_KINDS}
+        self.samples = {kind: [] for kind in DRIFT_KINDS}
+        self.subscriptions = 0
+        self.clients = 0
+        self.fixed = 0
+        self.fix_failed = 0
+        self.error = None
+        self.duration = 0.0
+
+    def add(self, kind, email):
+        self.counts[kind] += 1
+        if len(self.samples[kind]) < self.sample_limit:
+            self.samples[kind].append(email)
+
+    @property
+    def has_drift(self):
+        return any(self.counts.values())
+
+    def to_dict(self):
+        return {
+            'panel_id': self.panel_id,
+            'panel': self.panel_name,
+            'subscriptions': self.subscriptions,
+            'clients': self.clients,
+            'drift': dict(self.counts),
+            'samples': {kind: list(emails) for kind, emails in self.samples.items() if emails},
+            'fixed': self.fixed,
+            'fix_failed': self.fix_failed,
+            'error': self.error,
+            'duration': round(self.duration, 3),
+        }
+
+
+class Reconciler:
+    """Сверка за O(n): ожидаемое состояние из базы в словаре email -> enabled,
+    клиенты панели проходятся один раз и вычёркиваются из словаря.
+
+    В памяти держится только этот словарь и id клиентов, которые нужно
+    исправить; сами строки базы и записи панели не накапливаются, ответ
+    панели разбирается по частям (AsyncXUIAPI.iter_clients).
+    """
+
+    def __init__(self, queue=None, sample_limit=SAMPLE_LIMIT):
+        self.queue = queue
+        self.sample_limit = sample_limit
+
+    def _expected_state(self, db, panel_id, now):
+        expected = {}
+        rows = db.query(Subscription.email, Subscription.is_active, Subscription.expires_at) \
+            .filter(Subscription.panel_id == panel_id) \
+            .yield_per(DB_BATCH_SIZE)
+        for email, is_active, expires_at in rows:
+            should_enable = bool(is_active) and (expires_at is None or expires_at > now)
+            # У email может быть несколько подписок: активная важнее
+            expected[email] = expected.get(email, False) or should_enable
+        return expected
+
+    async def reconcile_panel(self, db, panel, apply=False):
+        report = DriftReport(panel.id, panel.name, self.sample_limit)
+        started = time.monotonic()
+        try:
+            expected = self._expected_state(db, panel.id, datetime.utcnow())
+            report.subscriptions = len(expected)
+
+            xui = get_async_xui_api(panel_config(panel))
+            to_disable = []
+            to_enable = []
+            # Список клиентов читается потоком, без разбора всего ответа в память
+            async for client in xui.iter_clients():
+                report.clients += 1
+                should_enable = expected.pop(client.email, None)
+                if should_enable is None:
+                    report.add(DRIFT_ORPHANED, client.email)
+                elif client.enabled and not should_enable:
+                    report.add(DRIFT_ENABLED_EXPIRED, client.email)
+                    to_disable.append(client.client_id)
+                elif not client.enabled and should_enable:
+                    report.add(DRIFT_DISABLED_ACTIVE, client.email)
+                    to_enable.append(client.client_id)
+
+            # Оставшиеся в словаре активные подписки на панели отсутствуют
+            for email, should_enable in expected.items():
+                if should_enable:
+                    report.add(DRIFT_MISSING, email)
+            expected.clear()
+
+            if apply and (to_disable or to_enable):
+                await self._apply(panel, to_disable, to_enable, report)
+        except Exception as e:
+            report.error = str(e)
+            logger.error(f"Reconciliation failed for panel {panel.name}: {str(e)}")
+
+        report.duration = time.monotonic() - started
+        return report
+
+    async def _apply(self, panel, to_disable, to_enable, report):
+        """Исправить состояние клиентов пакетами через очередь провижининга.
+
+        Отсутствующих и лишних клиентов только показываем в отчёте: их
+        создание или удаление требует решения администратора.
+        """
+        queue = self.queue or ProvisioningQueue()
+        config = panel_config(panel)
+        futures = [queue.submit(config, OP_DISABLE, client_id=client_id) for client_id in to_disable]
+        futures += [queue.submit(config, OP_ENABLE, client_id=client_id) for client_id in to_enable]
+        if self.queue is None:
+            # Не flush: отложенные из-за разомкнутой цепи элементы иначе
+            # остались бы в очереди, и их результатов никто бы не дождался
+            await queue.drain()
+        for result in await asyncio.gather(*futures, return_exceptions=True):
+            if isinstance(result, Exception):
+                report.fix_failed += 1
+            else:
+                report.fixed += 1
+
+    async def reconcile(self, apply=False):
+        """Сверка всех активных панелей, возвращает список DriftReport"""
+        db = SessionLocal()
+        try:
+            panels = db.query(Panel).filter(Panel.is_active == True).all()
+            reports = []
+            # Панели по очереди: в памяти одновременно состояние одной панели
+            for panel in panels:
+                report = await self.reconcile_panel(db, panel, apply)
+                if report.has_drift:
+                    logger.warning(f"Panel {panel.name} drift: {report.counts}")
+                reports.append(report)
+            return reports
+        finally:
+            db.close()
+
+
+async def main(apply):
+    try:
+        reports = await Reconciler().reconcile(apply=apply)
+        print(json.dumps([report.to_dict() for report in reports], ensure_ascii=False, indent=2))
+    finally:
+        await close_async_clients()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Сверка базы и X-UI панелей")
+    parser.add_argument('--apply', action='store_true',
+                        help='включить/выключить клиентов, чьё состояние расходится с базой')
+    args = parser.parse_args()
+    asyncio.run(main(args.apply))
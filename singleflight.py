@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Объединение одинаковых одновременных вызовов в один.
+
+    Пока по ключу выполняется вызов, остальные потоки ждут и получают его
+    результат (или исключение). Успешный результат дополнительно живёт
+    ttl секунд. Результат общий для всех вызывающих - его нельзя менять.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._results = {}
+        self.stats = {'executed': 0, 'shared': 0, 'cached': 0}
+
+    def do(self, key, fn, ttl=0):
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                self.stats['cached'] += 1
+                return cached[1]
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.stats['executed'] += 1
+            else:
+                self.stats['shared'] += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                if call.error is None and ttl:
+                    self._results[key] = (time.monotonic() + ttl, call.result)
+            call.event.set()
+
+    def forget(self, key):
+        """Сбросить сохранённый результат (данные на панели изменились)"""
+        with self._lock:
+            self._results.pop(key, None)
+
+
+class AsyncSingleFlight:
+    """То же для корутин одного event loop"""
+
+    def __init__(self):
+        self._calls = {}
+        self._results = {}
+        self.stats = {'executed': 0, 'shared': 0, 'cached': 0}
+
+    async def do(self, key, fn, ttl=0):
+        cached = self._results.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            self.stats['cached'] += 1
+            return cached[1]
+
+        future = self._calls.get(key)
+        if future is not None and future.get_loop() is asyncio.get_running_loop():
+            self.stats['shared'] += 1
+            # shield: отмена одного ожидающего не отменяет общий запрос
+            return await asyncio.shield(future)
+
+        self.stats['executed'] += 1
+        future = asyncio.ensure_future(fn())
+        # Исключение забирается здесь, даже если все ожидающие отменены
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = future
+        try:
+            result = await asyncio.shield(future)
+            if ttl:
+                self._results[key] = (time.monotonic() + ttl, result)
+            return result
+        finally:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+    def forget(self, key):
+        self._results.pop(key, None)
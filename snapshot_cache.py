@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import stat
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from config import Config
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: без межпроцессной блокировки каждый процесс пересчитывает сам
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _secure_directory(directory):
+    """Создать каталог снимков (0700) и убедиться, что он наш"""
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode):
+        raise Exception(f"Snapshot directory {directory} is not a directory")
+    if hasattr(os, 'getuid') and info.st_uid != os.getuid():
+        raise Exception(f"Snapshot directory {directory} belongs to another user")
+    if stat.S_IMODE(info.st_mode) & 0o077:
+        os.chmod(directory, 0o700)
+
+
+class SnapshotCache:
+    """Кэш готовых снимков (JSON) в файлах, общий для процессов-воркеров.
+
+    get(key, compute) отдаёт снимок, если файл моложе ttl. Иначе снимок
+    пересчитывает ровно один процесс под flock: остальные в это время
+    получают предыдущую версию, а если её нет - ждут результат. Запись
+    атомарная (временный файл + os.replace), разобранный снимок
+    держится в памяти процесса, пока файл не изменится.
+    """
+
+    def __init__(self, ttl, directory=None):
+        self.ttl = ttl
+        # По умолчанию - каталог из конфигурации рядом с базой, не общий /tmp
+        self.directory = os.path.normpath(directory or Config().get_snapshot_path())
+        self._memory = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'stale': 0, 'computed': 0}
+        _secure_directory(self.directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def _read(self, key):
+        """(снимок, время записи) из файла или (None, None)"""
+        path = self._path(key)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None, None
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None and cached[1] == mtime:
+                return cached
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return None, None
+        with self._lock:
+            self._memory[key] = (snapshot, mtime)
+        return snapshot, mtime
+
+    def _write(self, key, snapshot):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f'.{key}.')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, default=_json_default, separators=(',', ':'))
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _fresh(self, mtime):
+        return mtime is not None and time.time() - mtime < self.ttl
+
+    def get(self, key, compute):
+        """Снимок по ключу; compute() вызывается, только если снимок устарел"""
+        snapshot, mtime = self._read(key)
+        if self._fresh(mtime):
+            self.stats['hits'] += 1
+            return snapshot, mtime
+
+        if fcntl is None:
+            return self._compute(key, compute)
+
+        with open(os.path.join(self.directory, f'{key}.lock'), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if snapshot is not None:
+                    # Пересчёт уже идёт в другом процессе - отдаём прежний снимок
+                    self.stats['stale'] += 1
+                    return snapshot, mtime
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Пока ждали блокировку, снимок мог обновить другой процесс
+                snapshot, mtime = self._read(key)
+                if self._fresh(mtime):
+                    self.stats['hits'] += 1
+                    return snapshot, mtime
+                return self._compute(key, compute)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _compute(self, key, compute):
+        snapshot = compute()
+        self.stats['computed'] += 1
+        try:
+            self._write(key, snapshot)
+            stored = self._read(key)
+            if stored[0] is not None:
+                return stored
+        except OSError as e:
+            logger.warning(f"Snapshot {key} not saved: {str(e)}")
+        # Отдаём то же, что получили бы из файла
+        return json.loads(json.dumps(snapshot, default=_json_default)), time.time()
+
+    def put(self, key, snapshot):
+        """Записать готовый снимок (его считает другой процесс); возвращает время записи"""
+        self._write(key, snapshot)
+        return self._read(key)[1]
+
+    def peek(self, key):
+        """Последний сохранённый снимок без пересчёта: (снимок, время) или (None, None)"""
+        return self._read(key)
+
+    def invalidate(self, key):
+        """Сбросить снимок, чтобы следующий get пересчитал его"""
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,86 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from circuit_breaker import CircuitBreaker
+from client_index import ClientIndex, ClientRecord
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Database with a fresh config.ini and SQLite file in a temp directory"""
+    from database import Database
+
+    monkeypatch.chdir(tmp_path)
+    database = Database()
+    database.init_db()
+    return database
+
+
+class FakePanel:
+    """AsyncXUIAPI в памяти: ошибки панели идут через настоящий CircuitBreaker"""
+
+    def __init__(self, open_duration=0.2):
+        self.panel_url = 'http://panel.test'
+        self.breaker = CircuitBreaker(self.panel_url, min_calls=2, open_duration=open_duration)
+        self.client_index = ClientIndex(self.panel_url)
+        self.supports_batch = False
+        self.clients = {}
+        self.enabled = set()
+        # Сколько запросов пройдёт успешно, прежде чем начнутся ошибки
+        self.errors_after = 0
+        # Сколько следующих запросов завершится ошибкой панели
+        self.errors = 0
+        # Сколько следующих созданий выполнится, но ответ не дойдёт
+        self.lost_creates = 0
+
+    async def _call(self):
+        self.breaker.before_call()
+        await asyncio.sleep(0)
+        if self.errors_after:
+            self.errors_after -= 1
+        elif self.errors:
+            self.errors -= 1
+            self.breaker.record_failure('HTTP 500')
+            raise Exception('HTTP 500')
+        self.breaker.record_success(0.001)
+
+    async def create_client(self, email, telegram_id, expiry_days=30):
+        await self._call()
+        client_id = f'id{len(self.clients)}'
+        self.clients[client_id] = email
+        if self.lost_creates:
+            self.lost_creates -= 1
+            raise Exception('Request failed for create_client: TimeoutError')
+        self.client_index.add(client_id, email, telegram_id, enabled=False)
+        return client_id
+
+    async def enable_client(self, client_id):
+        await self._call()
+        self.enabled.add(client_id)
+        return {'success': True}
+
+    async def disable_client(self, client_id):
+        await self._call()
+        self.enabled.discard(client_id)
+        return {'success': True}
+
+    async def refresh_client_index(self, force=False):
+        await self._call()
+        self.client_index.apply_listing(
+            ClientRecord(client_id, email) for client_id, email in self.clients.items())
+        return self.client_index
+
+
+@pytest.fixture
+def panel(monkeypatch):
+    """FakePanel вместо клиента любой панели для очереди провижининга"""
+    import provisioning
+
+    fake = FakePanel()
+    monkeypatch.setattr(provisioning, 'get_async_xui_api', lambda config: fake)
+    return fake
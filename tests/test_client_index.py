@@ -0,0 +1,19 @@
+import pytest
+
+from client_index import ClientIndex, client_records
+
+
+def test_successful_empty_listing_confirms_absence():
+    index = ClientIndex('http://panel')
+    index.apply_listing(client_records({'success': True, 'obj': []}))
+
+    assert index.has_confirmed_listing()
+    assert index.find_by_email('gone@example.com') is None
+
+
+def test_refused_listing_is_not_confirmed():
+    index = ClientIndex('http://panel')
+    with pytest.raises(Exception):
+        index.apply_listing(client_records({'success': False, 'msg': 'session expired'}))
+
+    assert not index.has_confirmed_listing()
@@ -0,0 +1,107 @@
+import hashlib
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('yoomoney')
+
+import payment
+from outbox import OutboxWorkerPool
+from payment import (NOTIFICATION_HASH_FIELDS, PaymentFulfilment, PaymentProcessor,
+                     YooMoneyNotificationReceiver, YooMoneyPoller)
+
+
+class FakeQuickpay:
+    """Quickpay без запроса к YooMoney"""
+
+    def __init__(self, receiver, quickpay_form, targets, paymentType, sum, label):
+        self.redirected_url = f'https://yoomoney.example/pay?label={label}&sum={sum}'
+
+
+class HistoryStub:
+    """operation_history с заранее заданными входящими операциями"""
+
+    def __init__(self):
+        self.operations = []
+
+    def pay(self, label, amount):
+        self.operations.append(SimpleNamespace(
+            operation_id=f'op{len(self.operations)}', label=label, amount=amount,
+            status='success', datetime=datetime.utcnow(),
+        ))
+
+    def operation_history(self, **kwargs):
+        return SimpleNamespace(operations=list(self.operations), next_record=None)
+
+
+@pytest.fixture
+def processor(db, monkeypatch):
+    monkeypatch.setattr(payment, 'Quickpay', FakeQuickpay)
+    db.add_user(42, 'user42', 'User 42')
+    return PaymentProcessor(db, 'token', 'receiver', client=HistoryStub())
+
+
+def test_created_payment_is_stored_pending(db, processor):
+    result = processor.create_yoomoney_payment(42, 100.0, 'VPN Basic - 1 Month')
+
+    assert result['success']
+    row = db.get_payment(result['record_id'])
+    assert row['status'] == 'pending'
+    assert row['label'] == result['payment_id']
+    assert row['amount'] == 100.0
+    assert row['expires_at'] is not None
+    pending, _ = db.get_pending_payment_labels()
+    assert pending == {result['payment_id']: (result['record_id'], 100.0)}
+
+
+def test_poller_does_not_complete_underpaid_payment(db, processor):
+    full = processor.create_yoomoney_payment(42, 100.0, 'full')
+    short = processor.create_yoomoney_payment(42, 100.0, 'short')
+    history = processor.client
+    history.pay(full['payment_id'], 100.0)
+    history.pay(short['payment_id'], 97.0)
+
+    poller = YooMoneyPoller(db, history)
+    assert poller.poll() == [full['record_id']]
+    assert poller.last_run['underpaid'] == 1
+    assert db.get_payment(short['record_id'])['status'] == 'pending'
+
+
+def signed_notification(label, amount, operation_id, secret):
+    params = {
+        'notification_type': 'p2p-incoming', 'operation_id': operation_id,
+        'amount': f'{amount * 0.97:.2f}', 'withdraw_amount': f'{amount:.2f}',
+        'currency': '643', 'datetime': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'sender': '41001000040', 'codepro': 'false', 'label': label,
+    }
+    values = [params[field] for field in NOTIFICATION_HASH_FIELDS] + [secret, label]
+    params['sha1_hash'] = hashlib.sha1('&'.join(values).encode('utf-8')).hexdigest()
+    return params
+
+
+def test_created_payment_is_settled_by_notification(db, processor):
+    created = processor.create_yoomoney_payment(42, 5.0, 'VPN Basic - 1 Month')
+    fulfilment = PaymentFulfilment(db)
+    pool = OutboxWorkerPool(db, fulfilment.handlers, workers=1, poll_interval=0.05)
+    receiver = YooMoneyNotificationReceiver(db, 'secret', on_settled=pool.notify)
+    pool.start()
+    try:
+        params = signed_notification(created['payment_id'], 5.0, 'op-1', 'secret')
+        assert receiver.handle(params) == (200, 'settled')
+        assert receiver.handle(params) == (200, 'duplicate')
+
+        deadline = time.monotonic() + 5
+        while pool.get_stats()['processed'] < 1 and time.monotonic() < deadline:
+            time.sleep(0.02)
+    finally:
+        pool.stop()
+
+    payment_row = db.get_payment(created['record_id'])
+    assert payment_row['status'] == 'completed'
+    assert payment_row['transaction_id'] == 'op-1'
+    with db.get_connection() as conn:
+        orders = conn.execute('SELECT user_id, service_id FROM orders').fetchall()
+    service = db.get_service_by_name('VPN Basic - 1 Month')
+    assert [tuple(order) for order in orders] == [(42, service['id'])]
@@ -0,0 +1,54 @@
+import asyncio
+
+from circuit_breaker import CircuitOpenError
+from provisioning import OP_CREATE, OP_ENABLE, ProvisioningQueue
+
+PANEL = {'url': 'http://panel.test', 'username': 'u', 'password': 'p'}
+
+
+def test_open_circuit_defers_items_instead_of_failing_them(panel):
+    panel.errors = 2
+
+    async def scenario():
+        queue = ProvisioningQueue(max_attempts=3, retry_delay=0.01, flush_interval=0.01)
+        futures = [queue.submit(PANEL, OP_ENABLE, client_id=f'id{i}') for i in range(5)]
+        await queue.drain()
+        return queue, await asyncio.gather(*futures, return_exceptions=True)
+
+    queue, results = asyncio.run(scenario())
+    assert not [r for r in results if isinstance(r, Exception)]
+    assert panel.enabled == {f'id{i}' for i in range(5)}
+    stats = queue.get_stats()
+    assert stats['deferred'] > 0
+    assert stats['failed'] == 0
+
+
+def test_circuit_wait_is_bounded(panel):
+    panel.breaker.open_duration = 60
+    panel.errors = 2
+
+    async def scenario():
+        queue = ProvisioningQueue(max_attempts=3, retry_delay=0.01, max_circuit_wait=0)
+        futures = [queue.submit(PANEL, OP_ENABLE, client_id=f'id{i}') for i in range(3)]
+        await queue.drain()
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    # Два элемента получили ошибки панели и разомкнули цепь, их повторы
+    # упираются в разомкнутую цепь дольше max_circuit_wait
+    assert [type(r) for r in results] == [CircuitOpenError, CircuitOpenError, dict]
+
+
+def test_retried_create_reuses_client_created_without_response(panel):
+    panel.lost_creates = 1
+
+    async def scenario():
+        queue = ProvisioningQueue(retry_delay=0.01)
+        future = queue.submit(PANEL, OP_CREATE, email='user@example.com', telegram_id='1',
+                              expiry_days=30, enable=True)
+        await queue.drain()
+        return await future
+
+    client_id = asyncio.run(scenario())
+    assert panel.clients == {client_id: 'user@example.com'}
+    assert panel.enabled == {client_id}
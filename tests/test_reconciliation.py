@@ -0,0 +1,54 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+# Нужны SQLAlchemy-модели database (SessionLocal, Panel, Subscription)
+reconciliation = pytest.importorskip('reconciliation', exc_type=ImportError)
+
+from provisioning import ProvisioningQueue
+
+PANEL = SimpleNamespace(id=1, name='panel', url='http://panel.test', username='u', password='p')
+TO_DISABLE = [f'id{i}' for i in range(4)]
+TO_ENABLE = [f'id{i}' for i in range(4, 8)]
+
+
+def apply(reconciler):
+    report = reconciliation.DriftReport(PANEL.id, PANEL.name)
+    # Пока очередь не дожидалась отложенных элементов, apply зависал
+    return asyncio.wait_for(reconciler._apply(PANEL, TO_DISABLE, TO_ENABLE, report), 10), report
+
+
+def test_apply_survives_panel_failing_part_way(panel):
+    panel.enabled = set(TO_DISABLE)
+    # Первые два исправления проходят, следующие два размыкают цепь
+    panel.errors_after = 2
+    panel.errors = 2
+
+    async def scenario():
+        call, report = apply(reconciliation.Reconciler())
+        await call
+        return report
+
+    report = asyncio.run(scenario())
+    assert panel.breaker.state == 'closed'
+    assert (report.fixed, report.fix_failed) == (8, 0)
+    assert panel.enabled == set(TO_ENABLE)
+
+
+def test_apply_counts_fixes_lost_to_a_panel_that_stays_down(panel):
+    panel.errors_after = 2
+    panel.errors = 1000
+
+    async def scenario():
+        queue = ProvisioningQueue(retry_delay=0.01, flush_interval=0.01, max_circuit_wait=0.3)
+        await queue.start()
+        try:
+            call, report = apply(reconciliation.Reconciler(queue=queue))
+            await call
+        finally:
+            await queue.stop()
+        return report
+
+    report = asyncio.run(scenario())
+    assert (report.fixed, report.fix_failed) == (2, 6)
@@ -0,0 +1,59 @@
+from database import TRAFFIC_COUNTER_RETENTION
+
+DAY = 86400
+HOUR = 3600
+DAY0 = 19675 * DAY
+
+
+def record(db, at, total, email='a@example.com', user_id=1):
+    """Cumulative counter sample; the first one is only a baseline"""
+    db.record_traffic(1, [(email, user_id, total, 0)], at)
+
+
+def totals(rows):
+    return {row['user_id']: row['bytes_total'] for row in rows}
+
+
+def test_first_sample_is_baseline(db):
+    record(db, DAY0, 5000)
+    record(db, DAY0 + 60, 5300)
+
+    assert totals(db.get_top_traffic_users(DAY0, DAY0 + HOUR, now=DAY0 + HOUR)) == {1: 300}
+
+
+def test_unaligned_start_is_not_floored_to_the_day(db):
+    record(db, DAY0, 0)
+    record(db, DAY0 + 30 * 60, 1000)             # day0 00:30, outside the window
+    record(db, DAY0 + 23 * HOUR + 30 * 60, 1010)  # day0 23:30
+    record(db, DAY0 + DAY + 12 * HOUR, 1020)      # day1 12:00
+    now = DAY0 + 2 * DAY + 30 * 60
+    db.rollup_traffic(now)
+
+    start = DAY0 + 23 * HOUR
+    rows = db.get_top_traffic_users(start, start + 48 * HOUR, now=now)
+    assert totals(rows) == {1: 20}
+
+
+def test_old_narrow_window_falls_back_to_hours(db):
+    record(db, DAY0 + 10 * HOUR, 0)
+    record(db, DAY0 + 10 * HOUR + 10 * 60, 100)  # day0 10:10
+    record(db, DAY0 + 11 * HOUR + 10 * 60, 150)  # day0 11:10, outside the window
+    now = DAY0 + 10 * DAY
+    db.rollup_traffic(now)
+    db.prune_traffic(now)
+    with db.get_connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM traffic_minute').fetchone()[0] == 0
+
+    start = DAY0 + 10 * HOUR
+    rows = db.get_top_traffic_users(start, start + 30 * 60, now=now)
+    assert totals(rows) == {1: 100}
+
+
+def test_prune_drops_counters_of_vanished_clients(db):
+    record(db, DAY0, 100, email='gone@example.com', user_id=2)
+    record(db, DAY0 + TRAFFIC_COUNTER_RETENTION, 100)
+    db.prune_traffic(DAY0 + TRAFFIC_COUNTER_RETENTION + 60)
+
+    with db.get_connection() as conn:
+        emails = [row[0] for row in conn.execute('SELECT email FROM traffic_counters')]
+    assert emails == ['a@example.com']
@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from circuit_breaker import MIN_CALLS, STATE_CLOSED, CircuitBreaker
+from xui_api import AsyncXUIAPI
+
+
+def test_cancelled_requests_do_not_open_the_circuit():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def hang(request):
+            await release.wait()
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_get('/slow', hang)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = runner.addresses[0][:2]
+        api = AsyncXUIAPI({'url': f'http://{host}:{port}', 'username': 'u', 'password': 'p'})
+        try:
+            for _ in range(MIN_CALLS + 1):
+                task = asyncio.ensure_future(api._send('GET', f'{api.panel_url}/slow', 'slow', 10))
+                await asyncio.sleep(0.05)
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+            return api.breaker.snapshot()
+        finally:
+            release.set()
+            await api.close()
+            await runner.cleanup()
+
+    snapshot = asyncio.run(scenario())
+    assert snapshot['state'] == STATE_CLOSED
+    assert snapshot['calls_in_window'] == 0
+
+
+def test_cancelled_probe_frees_the_half_open_slot():
+    breaker = CircuitBreaker('panel', min_calls=1, open_duration=0)
+    breaker.record_failure('boom')
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+    breaker.record_cancelled()
+    assert breaker.allow_request()
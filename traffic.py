@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# Как часто снимать счётчики трафика с панелей (секунды)
+COLLECT_INTERVAL = 300
+# Как часто сворачивать минутные данные в часы/дни и чистить старые
+ROLLUP_INTERVAL = 3600
+
+
+def traffic_counter(record):
+    """(email, user_id, up, down) из ClientRecord или None для клиента без email"""
+    if not record.email:
+        return None
+    try:
+        user_id = int(record.telegram_id) if record.telegram_id else None
+    except ValueError:
+        user_id = None
+    return record.email, user_id, record.up, record.down
+
+
+class TrafficCollector:
+    """Сбор счётчиков трафика клиентов с панелей в таблицы traffic_*.
+
+    Панель отдаёт накопленные up/down по каждому клиенту; в базу пишутся
+    только приращения с прошлого сбора, в минутные бакеты по user_id.
+    """
+
+    def __init__(self, db, interval=COLLECT_INTERVAL, rollup_interval=ROLLUP_INTERVAL):
+        self.db = db
+        self.interval = interval
+        self.rollup_interval = rollup_interval
+        self.last_collect = None
+        self.last_rollup = None
+        self.last_run = None
+
+    def is_due(self):
+        return self.last_collect is None or time.monotonic() - self.last_collect >= self.interval
+
+    async def collect(self, panels):
+        """Снять счётчики со всех панелей; panels - список (panel_id, xui)"""
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        self.last_collect = started
+        now = time.time()
+
+        async def collect_panel(panel_id, xui):
+            try:
+                counters = []
+                async for record in xui.iter_clients():
+                    counter = traffic_counter(record)
+                    if counter is not None:
+                        counters.append(counter)
+                users = await loop.run_in_executor(
+                    None, self.db.record_traffic, panel_id, counters, now
+                )
+                return panel_id, users, None
+            except Exception as e:
+                logger.error(f"Traffic collection failed for panel {panel_id}: {str(e)}")
+                return panel_id, 0, str(e)
+
+        results = await asyncio.gather(*(collect_panel(pid, xui) for pid, xui in panels))
+
+        if self.last_rollup is None or time.monotonic() - self.last_rollup >= self.rollup_interval:
+            self.last_rollup = time.monotonic()
+            await loop.run_in_executor(None, self.db.rollup_traffic, now)
+            await loop.run_in_executor(None, self.db.prune_traffic, now)
+
+        self.last_run = {
+            'panels': len(results),
+            'failed': sum(1 for r in results if r[2]),
+            'users_updated': sum(r[1] for r in results),
+            'wall_time': time.monotonic() - started,
+        }
+        return self.last_run
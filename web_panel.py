@@ -1,7 +1,8 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
+from flask import (Flask, Response, render_template, request, redirect, url_for, session, jsonify, flash,
+                   stream_with_context)
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 import sqlite3
-from datetime import datetime, timedelta
+from datetime import datetime
 import json
 import logging
 import subprocess
@@ -9,18 +10,31 @@ import requests
 from requests.auth import HTTPBasicAuth
 import os
 import sys
+import time
 
 # Добавляем путь к проекту для импорта модулей
 sys.path.append('/opt/vpnbot')
 
-from database import SessionLocal, Panel, Subscription, User, Payment, Alert
+from database import SessionLocal, Panel, Subscription, User, Payment
 import config
 from languages import get_web_text
+from circuit_breaker import get_breaker, get_breaker_states
+from logger import query_bot_logs, LOG_PAGE_SIZE, LOG_MAX_PAGE_SIZE
+from dashboard_stats import build_dashboard_snapshot, restore_times, attach_views, DashboardDeltas
+from snapshot_cache import SnapshotCache
+from live_events import EventPublisher, LIVE_RETRY_MS
+from panel_resources import PanelResourceCache
+from xui_api import panel_config
 
 app = Flask(__name__)
 app.secret_key = config.WEB_SECRET_KEY
 app.config['TEMPLATES_AUTO_RELOAD'] = True
 
+# Сколько секунд снимок дашборда считается свежим
+DASHBOARD_CACHE_TTL = 10
+# Сколько секунд администратор из сессии принимается без запроса к базе
+PRINCIPAL_TTL = 300
+
 # Настройка логирования
 logging.basicConfig(level=config.LOG_LEVEL)
 logger = logging.getLogger(__name__)
@@ -30,22 +44,80 @@ class WebUser(UserMixin):
         self.id = id
         self.username = username
 
+# Снимки дашборда, общие для всех воркеров веб-панели
+snapshot_cache = SnapshotCache(DASHBOARD_CACHE_TTL)
+# Ресурсы панелей собирает мониторинг; страницы читают их из кэша
+panel_resource_cache = PanelResourceCache()
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message = 'Please log in to access this page.'
 
+def remember_principal(user):
+    """Сохранить администратора в подписанной сессии, чтобы не искать его в базе на каждый запрос"""
+    session['principal'] = {
+        'id': user.id,
+        'username': user.username,
+        'telegram_id': user.user_id,
+        'verified_at': time.time()
+    }
+
+def forget_principal():
+    session.pop('principal', None)
+
 @login_manager.user_loader
 def load_user(user_id):
+    """Администратор из сессии; база проверяется не чаще раза в PRINCIPAL_TTL.
+
+    Роль сверяется с config.ADMIN_IDS на каждом запросе (без обращения
+    к базе), поэтому снятый администратор теряет доступ сразу, а
+    удалённый пользователь - не позже чем через PRINCIPAL_TTL.
+    """
+    principal = session.get('principal')
+    if (principal and str(principal['id']) == str(user_id)
+            and time.time() - principal['verified_at'] < PRINCIPAL_TTL):
+        if principal['telegram_id'] in config.ADMIN_IDS:
+            return WebUser(principal['id'], principal['username'])
+        forget_principal()
+        return None
+    
     db = SessionLocal()
     try:
         user = db.query(User).filter(User.id == user_id).first()
         if user and user.user_id in config.ADMIN_IDS:
+            remember_principal(user)
             return WebUser(user.id, user.username)
+        forget_principal()
         return None
     finally:
         db.close()
 
+def _compute_dashboard_snapshot():
+    previous, _ = snapshot_cache.peek('dashboard')
+    db = SessionLocal()
+    try:
+        return attach_views(build_dashboard_snapshot(db), previous)
+    finally:
+        db.close()
+
+def get_dashboard_snapshot():
+    """Снимок дашборда из общего кэша: (данные, время снимка)"""
+    return snapshot_cache.get('dashboard', _compute_dashboard_snapshot)
+
+dashboard_deltas = DashboardDeltas()
+
+def _poll_dashboard_events():
+    snapshot, _ = get_dashboard_snapshot()
+    db = SessionLocal()
+    try:
+        return dashboard_deltas.poll(db, snapshot)
+    finally:
+        db.close()
+
+# Один опрос изменений на процесс для всех открытых вкладок
+live_publisher = EventPublisher(_poll_dashboard_events, reset=dashboard_deltas.reset)
+
 def get_language():
     """Получить текущий язык из сессии или браузера"""
     if 'language' in session:
@@ -90,6 +162,7 @@ def login():
                 if admin_user:
                     user = WebUser(admin_user.id, admin_user.username)
                     login_user(user)
+                    remember_principal(admin_user)
                     logger.info(f"Web user {username} logged in successfully")
                     return redirect(url_for('dashboard'))
                 else:
@@ -106,6 +179,7 @@ def login():
 def logout():
     """Выход из системы"""
     logout_user()
+    forget_principal()
     flash('You have been logged out successfully', 'success')
     return redirect(url_for('login'))
 
@@ -120,69 +194,16 @@ def set_language(lang):
 @login_required
 def dashboard():
     """Дашборд администратора"""
-    db = SessionLocal()
-    try:
-        language = get_language()
-        
-        # Общая статистика
-        total_users = db.query(User).count()
-        total_active_subs = db.query(Subscription).filter(Subscription.is_active == True).count()
-        total_panels = db.query(Panel).count()
-        
-        # Доходы
-        total_revenue = db.query(Payment).filter(Payment.status == 'completed').with_entities(
-            db.func.sum(Payment.amount)
-        ).scalar() or 0
-        
-        # Активные панели
-        active_panels = db.query(Panel).filter(
-            Panel.is_active == True,
-            Panel.last_check > datetime.utcnow() - timedelta(minutes=10)
-        ).count()
-        
-        # Последние платежи
-        recent_payments = db.query(Payment).filter(Payment.status == 'completed').order_by(
-            Payment.completed_at.desc()
-        ).limit(10).all()
-        
-        # Последние алерты
-        recent_alerts = db.query(Alert).filter(Alert.is_resolved == False).order_by(
-            Alert.created_at.desc()
-        ).limit(10).all()
-        
-        # Статистика по панелям
-        panels_stats = []
-        panels = db.query(Panel).all()
-        for panel in panels:
-            clients_count = db.query(Subscription).filter(
-                Subscription.panel_id == panel.id, 
-                Subscription.is_active == True
-            ).count()
-            
-            status = "online" if panel.last_check and panel.last_check > datetime.utcnow() - timedelta(minutes=10) else "offline"
-            
-            panels_stats.append({
-                'id': panel.id,
-                'name': panel.name,
-                'location': panel.location,
-                'status': status,
-                'clients_count': clients_count,
-                'max_clients': panel.max_clients,
-                'url': panel.url
-            })
-        
-        return render_template('dashboard.html',
-                            total_users=total_users,
-                            total_active_subs=total_active_subs,
-                            total_panels=total_panels,
-                            active_panels=active_panels,
-                            total_revenue=total_revenue,
-                            recent_payments=recent_payments,
-                            recent_alerts=recent_alerts,
-                            panels_stats=panels_stats)
-    
-    finally:
-        db.close()
+    snapshot, _ = get_dashboard_snapshot()
+    return render_template('dashboard.html',
+                        total_users=snapshot['total_users'],
+                        total_active_subs=snapshot['total_active_subs'],
+                        total_panels=snapshot['total_panels'],
+                        active_panels=snapshot['active_panels'],
+                        total_revenue=snapshot['total_revenue'],
+                        recent_payments=restore_times(snapshot['recent_payments'], 'completed_at'),
+                        recent_alerts=restore_times(snapshot['recent_alerts'], 'created_at'),
+                        panels_stats=snapshot['panels_stats'])
 
 @app.route('/panels')
 @login_required
@@ -206,8 +227,8 @@ def panel_detail(panel_id):
             flash('Panel not found', 'error')
             return redirect(url_for('panels'))
         
-        # Получение информации о ресурсах панели
-        panel_resources = get_panel_resources(panel)
+        # Ресурсы панели из кэша мониторинга - сама панель не опрашивается
+        panel_resources, resources_age = panel_resource_cache.get(panel.id)
         
         # Подключения на этой панели
         subscriptions = db.query(Subscription).filter(
@@ -217,7 +238,10 @@ def panel_detail(panel_id):
         return render_template('panel_detail.html', 
                              panel=panel, 
                              subscriptions=subscriptions,
-                             resources=panel_resources)
+                             resources=panel_resources,
+                             resources_age=resources_age,
+                             resources_stale=panel_resource_cache.is_stale(resources_age),
+                             circuit=get_breaker(panel.url).snapshot())
     finally:
         db.close()
 
@@ -269,3 +293,118 @@ def payments():
         return render_template('payments.html', 
                              payments=payments_list,
                              status_filter=status_filter)
+    finally:
+        db.close()
+
+def snapshot_view_response(name):
+    """Представление снимка дашборда с ETag/Last-Modified; 304, если у клиента та же версия"""
+    snapshot, _ = get_dashboard_snapshot()
+    view = snapshot['views'][name]
+    response = jsonify(view['data'])
+    response.set_etag(view['etag'])
+    response.last_modified = datetime.fromisoformat(view['changed_at'])
+    # Браузер хранит ответ, но перед использованием всегда сверяется с сервером
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/api/stats')
+@login_required
+def api_stats():
+    """Сводные счётчики дашборда"""
+    return snapshot_view_response('stats')
+
+@app.route('/api/panels/status')
+@login_required
+def api_panels_status():
+    """Состояние и загрузка панелей для автообновления страницы панелей"""
+    return snapshot_view_response('panel_status')
+
+@app.route('/api/panel/<int:panel_id>/resources')
+@login_required
+def api_panel_resources(panel_id):
+    """Ресурсы панели из кэша; refresh=1 запускает фоновое обновление устаревших данных"""
+    resources, age = panel_resource_cache.get(panel_id)
+    stale = panel_resource_cache.is_stale(age)
+    if stale and request.args.get('refresh', type=int):
+        db = SessionLocal()
+        try:
+            panel = db.query(Panel).filter(Panel.id == panel_id).first()
+            if not panel:
+                return jsonify({'error': 'Panel not found'}), 404
+            panel_resource_cache.refresh_async(panel.id, panel_config(panel))
+        finally:
+            db.close()
+    return jsonify({
+        'resources': resources,
+        'age': age,
+        'stale': stale,
+        'refreshing': panel_resource_cache.is_refreshing(panel_id)
+    })
+
+@app.route('/api/events')
+@login_required
+def api_events():
+    """Поток живых обновлений (SSE): stats, panel, payment, alert, resync"""
+    subscriber = live_publisher.subscribe(request.headers.get('Last-Event-ID'))
+
+    def stream():
+        try:
+            yield f"retry: {LIVE_RETRY_MS}\n\n"
+            yield from subscriber.messages()
+        finally:
+            live_publisher.unsubscribe(subscriber)
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/circuits')
+@login_required
+def api_circuits():
+    """Состояние circuit breaker по панелям"""
+    return jsonify(get_breaker_states())
+
+def _parse_time_arg(name):
+    value = request.args.get(name)
+    return datetime.fromisoformat(value) if value else None
+
+@app.route('/api/logs')
+@login_required
+def api_logs():
+    """Журнал бота с фильтрами user_id, action, level, since, until и пагинацией по cursor"""
+    try:
+        limit = min(max(request.args.get('limit', LOG_PAGE_SIZE, type=int), 1), LOG_MAX_PAGE_SIZE)
+        since = _parse_time_arg('since')
+        until = _parse_time_arg('until')
+        level = request.args.get('level')
+        cursor = request.args.get('cursor')
+    except ValueError as e:
+        return jsonify({'error': f'Invalid parameter: {str(e)}'}), 400
+    
+    db = SessionLocal()
+    try:
+        entries, next_cursor = query_bot_logs(
+            db,
+            user_id=request.args.get('user_id', type=int),
+            action=request.args.get('action'),
+            level=level.upper() if level else None,
+            since=since,
+            until=until,
+            cursor=cursor,
+            limit=limit
+        )
+        return jsonify({
+            'logs': [{
+                'id': entry.id,
+                'created_at': entry.created_at.isoformat(),
+                'level': entry.level,
+                'user_id': entry.user_id,
+                'action': entry.action,
+                'message': entry.message
+            } for entry in entries],
+            'next_cursor': next_cursor
+        })
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    finally:
+        db.close()
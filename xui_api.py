@@ -1,36 +1,96 @@
 import requests
+import asyncio
+import aiohttp
 import logging
+import threading
+import time
+import weakref
 from requests.auth import HTTPBasicAuth
 from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
 import json
+from circuit_breaker import get_breaker
+from client_index import get_client_index, client_record, client_records, check_listing
+from json_stream import JSONArrayStream
+from singleflight import SingleFlight, AsyncSingleFlight
 
 logger = logging.getLogger(__name__)
 
+
+class BatchNotSupportedError(Exception):
+    """Панель не поддерживает пакетные операции с клиентами"""
+
+
+# Время жизни cookie авторизации панели (секунды)
+SESSION_TTL = 3600
+# Размер пула keep-alive соединений на одну панель
+POOL_MAXSIZE = 10
+# Общий лимит соединений асинхронного пула на все панели
+ASYNC_POOL_LIMIT = 100
+# Таймаут одного запроса к панели по умолчанию (секунды)
+REQUEST_TIMEOUT = 10
+# Сколько секунд результат get_panel_status/get_clients отдаётся без запроса
+RESULT_TTL = 2
+# Размер куска при потоковом чтении списка клиентов (байты)
+STREAM_CHUNK_SIZE = 64 * 1024
+
+def client_payload(email, telegram_id, expiry_days=30, enable=False):
+    """Тело запроса на создание клиента панели"""
+    return {
+        "email": email,
+        "enable": enable,  # По умолчанию выключено, включится после оплаты
+        "expiryTime": expiry_days * 86400 * 1000,  # в миллисекундах
+        "flow": "xtls-rprx-direct",
+        "limitIp": 0,
+        "totalGB": 0,
+        "telegramId": str(telegram_id),
+        "subId": ""
+    }
+
 class XUIAPI:
     def __init__(self, panel_config):
         self.panel_url = panel_config['url']
         self.username = panel_config['username']
         self.password = panel_config['password']
         self.auth = HTTPBasicAuth(self.username, self.password)
-        
+
         # Настройка сессии с повторными попытками
         self.session = requests.Session()
+        # Один быстрый повтор: дальше решает circuit breaker панели
         retry_strategy = Retry(
-            total=3,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504],
+            total=1,
+            backoff_factor=0.3,
+            status_forcelist=[429, 502, 503, 504],
+        )
+        adapter = HTTPAdapter(
+            max_retries=retry_strategy,
+            pool_connections=1,
+            pool_maxsize=POOL_MAXSIZE,
         )
-        adapter = HTTPAdapter(max_retries=retry_strategy)
         self.session.mount("http://", adapter)
         self.session.mount("https://", adapter)
-        
+        self._adapter = adapter
+
         # Настройка заголовков для CORS
         self.session.headers.update({
             'Content-Type': 'application/json',
             'Accept': 'application/json',
         })
 
+        self.breaker = get_breaker(self.panel_url)
+        self.client_index = get_client_index(self.panel_url)
+        self.result_ttl = RESULT_TTL
+
+        # Состояние авторизации: cookie живёт в self.session
+        self._login_lock = threading.Lock()
+        self._logged_in_at = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'logins': 0,
+            'relogins': 0,
+        }
+
     def _handle_response(self, response, operation):
         try:
             if response.status_code == 200:
@@ -46,6 +106,78 @@ class XUIAPI:
         except requests.exceptions.RequestException as e:
             raise Exception(f"Request failed for {operation}: {str(e)}")
 
+    def _count(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _session_valid(self):
+        return (self._logged_in_at is not None
+                and time.monotonic() - self._logged_in_at < SESSION_TTL)
+
+    def invalidate_session(self):
+        """Сброс cookie авторизации, следующий запрос выполнит login заново"""
+        with self._login_lock:
+            self._logged_in_at = None
+            self.session.cookies.clear()
+
+    def _ensure_login(self):
+        """Авторизация только если cookie отсутствует или устарел"""
+        if self._session_valid():
+            return
+        with self._login_lock:
+            if self._session_valid():
+                return
+            self.login()
+
+    def _request_response(self, method, path, operation, **kwargs):
+        """HTTP-запрос к панели с переиспользованием авторизации.
+
+        При ответе 401 cookie считается протухшим: выполняется повторный
+        login и запрос повторяется один раз.
+        """
+        self._ensure_login()
+        url = f"{self.panel_url}{path}"
+        if method != 'GET':
+            # Изменение на панели: общий закэшированный список клиентов устарел
+            _flight.forget((self.panel_url, 'get_clients'))
+
+        response = self._send(method, url, operation, **kwargs)
+        if response.status_code == 401:
+            logger.info(f"Session expired for {self.panel_url}, re-login")
+            response.close()
+            self._count('relogins')
+            self.invalidate_session()
+            self._ensure_login()
+            response = self._send(method, url, operation, **kwargs)
+        return response
+
+    def _request(self, method, path, operation, **kwargs):
+        response = self._request_response(method, path, operation, **kwargs)
+        return self._handle_response(response, operation)
+
+    def _send(self, method, url, operation, **kwargs):
+        """Один HTTP-запрос через circuit breaker панели.
+
+        Если цепь разомкнута, запрос не выполняется (CircuitOpenError);
+        таймаут берётся из наблюдаемой задержки панели.
+        """
+        self.breaker.before_call()
+        kwargs.setdefault('timeout', self.breaker.timeout())
+
+        self._count('requests')
+        started = time.monotonic()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            self.breaker.record_failure(e)
+            raise Exception(f"Request failed for {operation}: {str(e)}")
+
+        if response.status_code >= 500:
+            self.breaker.record_failure(f"HTTP {response.status_code}")
+        else:
+            self.breaker.record_success(time.monotonic() - started)
+        return response
+
     def login(self):
         """Авторизация в панели"""
         try:
@@ -54,40 +186,30 @@ class XUIAPI:
                 "username": self.username,
                 "password": self.password
             }
-            
-            response = self.session.post(login_url, json=login_data, timeout=10)
-            return self._handle_response(response, "login")
+
+            self._count('logins')
+            response = self._send('POST', login_url, "login", json=login_data)
+            result = self._handle_response(response, "login")
+            self._logged_in_at = time.monotonic()
+            return result
         except Exception as e:
+            self._logged_in_at = None
             logger.error(f"Login failed: {str(e)}")
             raise
 
     def create_client(self, email, telegram_id, expiry_days=30):
         """Создание клиента в панели"""
         try:
-            # Сначала авторизуемся
-            self.login()
-            
-            # Создаем клиента
-            client_url = f"{self.panel_url}/api/client"
-            client_data = {
-                "email": email,
-                "enable": False,  # Изначально выключено, включится после оплаты
-                "expiryTime": expiry_days * 86400 * 1000,  # в миллисекундах
-                "flow": "xtls-rprx-direct",
-                "limitIp": 0,
-                "totalGB": 0,
-                "telegramId": str(telegram_id),
-                "subId": ""
-            }
-            
-            response = self.session.post(client_url, json=client_data, timeout=10)
-            result = self._handle_response(response, "create_client")
-            
+            client_data = client_payload(email, telegram_id, expiry_days)
+
+            result = self._request('POST', "/api/client", "create_client", json=client_data)
+
             if result and result.get('success'):
+                self.client_index.add(result.get('id'), email, telegram_id, enabled=False)
                 return result.get('id')
             else:
                 raise Exception(f"Client creation failed: {result}")
-                
+
         except Exception as e:
             logger.error(f"Create client failed: {str(e)}")
             raise
@@ -95,9 +217,9 @@ class XUIAPI:
     def enable_client(self, client_id):
         """Включение клиента"""
         try:
-            enable_url = f"{self.panel_url}/api/client/{client_id}/enable"
-            response = self.session.post(enable_url, timeout=10)
-            return self._handle_response(response, "enable_client")
+            result = self._request('POST', f"/api/client/{client_id}/enable", "enable_client")
+            self.client_index.set_enabled(client_id, True)
+            return result
         except Exception as e:
             logger.error(f"Enable client failed: {str(e)}")
             raise
@@ -105,30 +227,106 @@ class XUIAPI:
     def disable_client(self, client_id):
         """Выключение клиента"""
         try:
-            disable_url = f"{self.panel_url}/api/client/{client_id}/disable"
-            response = self.session.post(disable_url, timeout=10)
-            return self._handle_response(response, "disable_client")
+            result = self._request('POST', f"/api/client/{client_id}/disable", "disable_client")
+            if isinstance(result, dict) and result.get('success') is False:
+                raise Exception(f"Panel refused disable_client: {result.get('msg')}")
+            self.client_index.set_enabled(client_id, False)
+            return result
         except Exception as e:
             logger.error(f"Disable client failed: {str(e)}")
             raise
 
     def get_clients(self):
-        """Получение списка клиентов"""
+        """Получение списка клиентов.
+
+        Одновременные вызовы для одной панели объединяются в один запрос,
+        результат общий и переиспользуется result_ttl секунд.
+        """
+        def fetch():
+            result = self._request('GET', "/api/clients", "get_clients")
+            self.client_index.apply_listing(client_records(result))
+            return result
+
         try:
-            self.login()
-            clients_url = f"{self.panel_url}/api/clients"
-            response = self.session.get(clients_url, timeout=10)
-            return self._handle_response(response, "get_clients")
+            return _flight.do((self.panel_url, 'get_clients'), fetch, self.result_ttl)
         except Exception as e:
             logger.error(f"Get clients failed: {str(e)}")
             raise
 
+    def refresh_client_index(self, force=False):
+        """Перечитать список клиентов в индекс, если он устарел.
+
+        Если панель отдаёт ETag, повторное чтение неизменного списка
+        заканчивается ответом 304 без тела.
+        """
+        index = self.client_index
+        if not force and not index.is_stale():
+            return index
+
+        headers = {}
+        if index.etag and not force:
+            headers['If-None-Match'] = index.etag
+        response = self._request_response('GET', "/api/clients", "get_clients",
+                                          headers=headers, stream=True)
+        if response.status_code == 304:
+            response.close()
+            index.mark_fresh()
+        else:
+            index.apply_listing(self._iter_records(response), response.headers.get('ETag'))
+        return index
+
+    def iter_clients(self):
+        """Клиенты панели по одному (ClientRecord).
+
+        Ответ читается и разбирается по частям, поэтому память не растёт с
+        числом клиентов. Результат не кэшируется и не объединяется с
+        другими вызовами, в отличие от get_clients.
+        """
+        response = self._request_response('GET', "/api/clients", "get_clients", stream=True)
+        return self._iter_records(response)
+
+    def _iter_records(self, response):
+        with response:
+            if response.status_code != 200:
+                self._handle_response(response, "get_clients")
+            stream = JSONArrayStream()
+            try:
+                for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                    for client in stream.feed(chunk):
+                        yield client_record(client)
+                    check_listing(stream.fields)
+                for client in stream.close():
+                    yield client_record(client)
+                check_listing(stream.fields)
+            except requests.exceptions.RequestException as e:
+                self.breaker.record_failure(e)
+                raise Exception(f"Request failed for get_clients: {str(e)}")
+            except ValueError as e:
+                raise Exception(f"Invalid response for get_clients: {str(e)}")
+
+    def find_client_id(self, email):
+        """client_id по email через индекс; список читается только если индекс устарел"""
+        record = self.client_index.find_by_email(email)
+        if record is None and self.client_index.is_stale():
+            record = self.refresh_client_index().find_by_email(email)
+        return record.client_id if record is not None else None
+
+    def disable_client_by_email(self, email):
+        """Выключение клиента по email"""
+        client_id = self.find_client_id(email)
+        if client_id is None:
+            logger.warning(f"Client {email} not found on {self.panel_url}")
+            return None
+        return self.disable_client(client_id)
+
     def get_panel_status(self):
         """Проверка статуса панели"""
         try:
-            status_url = f"{self.panel_url}/api/status"
-            response = self.session.get(status_url, timeout=10)
-            return self._handle_response(response, "get_status")
+            return _flight.do(
+                (self.panel_url, 'get_status'),
+                lambda: self._request('GET', "/api/status", "get_status"),
+                self.result_ttl
+            )
         except Exception as e:
             logger.error(f"Get panel status failed: {str(e)}")
             return None
@@ -136,9 +334,493 @@ class XUIAPI:
     def delete_client(self, client_id):
         """Удаление клиента"""
         try:
-            delete_url = f"{self.panel_url}/api/client/{client_id}"
-            response = self.session.delete(delete_url, timeout=10)
-            return self._handle_response(response, "delete_client")
+            result = self._request('DELETE', f"/api/client/{client_id}", "delete_client")
+            self.client_index.remove(client_id)
+            return result
+        except Exception as e:
+            logger.error(f"Delete client failed: {str(e)}")
+            raise
+
+    def get_stats(self):
+        """Статистика запросов и переиспользования соединений"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+
+        # urllib3 считает открытые соединения и запросы в каждом пуле
+        opened = 0
+        pooled_requests = 0
+        pools = self._adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            pooled_requests += pool.num_requests
+
+        stats['connections_opened'] = opened
+        stats['connections_reused'] = max(pooled_requests - opened, 0)
+        stats['session_valid'] = self._session_valid()
+        return stats
+
+    def close(self):
+        """Закрытие пула соединений"""
+        self.session.close()
+
+
+# Объединение одинаковых одновременных запросов к панелям
+_flight = SingleFlight()
+_async_flight = AsyncSingleFlight()
+
+def get_singleflight_stats():
+    """Сколько запросов выполнено, разделено между вызывающими и взято из кэша"""
+    return {'sync': dict(_flight.stats), 'async': dict(_async_flight.stats)}
+
+# Реестр клиентов на процесс: одна сессия и один пул соединений на панель
+_registry = {}
+_registry_lock = threading.Lock()
+
+def panel_config(panel):
+    """Параметры подключения к панели из модели Panel"""
+    return {
+        'url': panel.url,
+        'username': panel.username,
+        'password': panel.password
+    }
+
+def get_xui_api(panel_config):
+    """Получить общий для процесса клиент панели.
+
+    Клиент создаётся один раз на URL панели и переиспользуется всеми
+    вызывающими; при смене учётных данных он пересоздаётся.
+    """
+    url = panel_config['url']
+    with _registry_lock:
+        api = _registry.get(url)
+        if api is not None and (api.username != panel_config['username']
+                                or api.password != panel_config['password']):
+            api.close()
+            api = None
+        if api is None:
+            api = XUIAPI(panel_config)
+            _registry[url] = api
+        return api
+
+def drop_xui_api(panel_url):
+    """Удалить клиент панели из реестра (панель удалена или отключена)"""
+    with _registry_lock:
+        api = _registry.pop(panel_url, None)
+    if api is not None:
+        api.close()
+
+def get_registry_stats():
+    """Статистика соединений по всем панелям реестра"""
+    with _registry_lock:
+        apis = dict(_registry)
+    return {url: api.get_stats() for url, api in apis.items()}
+
+
+# Общие пулы соединений asyncio-клиентов, по одному на event loop
+_async_connectors = weakref.WeakKeyDictionary()
+
+def _get_async_connector():
+    loop = asyncio.get_running_loop()
+    connector = _async_connectors.get(loop)
+    if connector is None or connector.closed:
+        connector = aiohttp.TCPConnector(limit=ASYNC_POOL_LIMIT, limit_per_host=POOL_MAXSIZE)
+        _async_connectors[loop] = connector
+    return connector
+
+class AsyncXUIAPI:
+    """Асинхронный клиент панели с тем же набором операций, что и XUIAPI.
+
+    Все клиенты одного event loop работают через общий TCPConnector, а
+    cookie авторизации хранятся отдельно для каждой панели.
+    """
+
+    def __init__(self, panel_config, timeout=REQUEST_TIMEOUT):
+        self.panel_url = panel_config['url']
+        self.username = panel_config['username']
+        self.password = panel_config['password']
+        self.timeout = timeout
+        self.breaker = get_breaker(self.panel_url)
+        self.client_index = get_client_index(self.panel_url)
+        self.result_ttl = RESULT_TTL
+        # None - ещё не проверяли, поддерживает ли панель пакетные запросы
+        self.supports_batch = None
+
+        self._session = None
+        self._loop = None
+        self._login_lock = None
+        self._logged_in_at = None
+        self._stats = {
+            'requests': 0,
+            'logins': 0,
+            'relogins': 0,
+            'connections_opened': 0,
+            'connections_reused': 0,
+        }
+
+    def _trace_config(self):
+        trace = aiohttp.TraceConfig()
+
+        async def on_create(session, ctx, params):
+            self._stats['connections_opened'] += 1
+
+        async def on_reuse(session, ctx, params):
+            self._stats['connections_reused'] += 1
+
+        trace.on_connection_create_end.append(on_create)
+        trace.on_connection_reuseconn.append(on_reuse)
+        return trace
+
+    def _get_session(self):
+        """Сессия панели, привязанная к текущему event loop"""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            self._session = aiohttp.ClientSession(
+                connector=_get_async_connector(),
+                connector_owner=False,
+                cookie_jar=aiohttp.CookieJar(unsafe=True),
+                headers={
+                    'Content-Type': 'application/json',
+                    'Accept': 'application/json',
+                },
+                trace_configs=[self._trace_config()],
+            )
+            self._loop = loop
+            self._login_lock = asyncio.Lock()
+            self._logged_in_at = None
+        return self._session
+
+    async def _handle_response(self, response, operation):
+        if response.status == 200:
+            return await response.json(content_type=None)
+        elif response.status == 401:
+            raise Exception(f"Authentication failed for {operation}")
+        elif response.status == 403:
+            raise Exception(f"Access denied for {operation}")
+        elif response.status == 404:
+            raise Exception(f"Resource not found for {operation}")
+        else:
+            text = await response.text()
+            raise Exception(f"HTTP {response.status} for {operation}: {text}")
+
+    def _session_valid(self):
+        return (self._logged_in_at is not None
+                and time.monotonic() - self._logged_in_at < SESSION_TTL)
+
+    def invalidate_session(self):
+        """Сброс cookie авторизации, следующий запрос выполнит login заново"""
+        self._logged_in_at = None
+        if self._session is not None:
+            self._session.cookie_jar.clear()
+
+    async def _ensure_login(self):
+        self._get_session()
+        if self._session_valid():
+            return
+        async with self._login_lock:
+            if self._session_valid():
+                return
+            await self.login()
+
+    async def _send(self, method, url, operation, timeout, expected=(), stream=False, **kwargs):
+        """Один HTTP-запрос через circuit breaker панели.
+
+        Таймаут - меньшее из запрошенного и адаптивного таймаута панели.
+        Возвращает (status, headers, data); data есть только у ответа 200.
+        С stream=True вместо data возвращается непрочитанный ответ: тело
+        читает и освобождает вызывающий, таймаут действует на каждое чтение.
+        """
+        session = self._get_session()
+        self.breaker.before_call()
+        timeout = min(timeout or self.timeout, self.breaker.timeout())
+        if stream:
+            client_timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout,
+                                                   sock_read=timeout)
+        else:
+            client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+        self._stats['requests'] += 1
+        started = time.monotonic()
+        try:
+            response = await session.request(method, url, timeout=client_timeout, **kwargs)
+            try:
+                if response.status >= 500:
+                    self.breaker.record_failure(f"HTTP {response.status}")
+                else:
+                    self.breaker.record_success(time.monotonic() - started)
+                if (response.status in (401, 304) or response.status in expected) \
+                        and operation != "login":
+                    return response.status, response.headers, None
+                if stream and response.status == 200:
+                    return response.status, response.headers, response
+                data = await self._handle_response(response, operation)
+                return response.status, response.headers, data
+            finally:
+                if not (stream and response.status == 200):
+                    response.release()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.breaker.record_failure(e)
+            raise Exception(f"Request failed for {operation}: {str(e) or type(e).__name__}")
+        except asyncio.CancelledError:
+            # Остановка или дедлайн цикла у вызывающего - не сбой панели
+            self.breaker.record_cancelled()
+            raise
+
+    async def _request_response(self, method, path, operation, timeout=None, expected=(),
+                                **kwargs):
+        """Запрос к панели с переиспользованием авторизации и повтором после 401"""
+        url = f"{self.panel_url}{path}"
+        if method != 'GET':
+            _async_flight.forget((self.panel_url, 'get_clients'))
+
+        await self._ensure_login()
+        result = await self._send(method, url, operation, timeout, expected, **kwargs)
+        if result[0] == 401:
+            logger.info(f"Session expired for {self.panel_url}, re-login")
+            self._stats['relogins'] += 1
+            self.invalidate_session()
+            await self._ensure_login()
+            result = await self._send(method, url, operation, timeout, expected, **kwargs)
+            if result[0] == 401:
+                raise Exception(f"Authentication failed for {operation}")
+        return result
+
+    async def _request(self, method, path, operation, timeout=None, **kwargs):
+        status, headers, data = await self._request_response(method, path, operation,
+                                                             timeout, **kwargs)
+        return data
+
+    async def login(self):
+        """Авторизация в панели"""
+        try:
+            login_data = {
+                "username": self.username,
+                "password": self.password
+            }
+            self._stats['logins'] += 1
+            status, headers, result = await self._send('POST', f"{self.panel_url}/login",
+                                                       "login", None, json=login_data)
+            self._logged_in_at = time.monotonic()
+            return result
+        except Exception as e:
+            self._logged_in_at = None
+            logger.error(f"Login failed: {str(e)}")
+            raise
+
+    async def create_client(self, email, telegram_id, expiry_days=30):
+        """Создание клиента в панели"""
+        try:
+            client_data = client_payload(email, telegram_id, expiry_days)
+
+            result = await self._request('POST', "/api/client", "create_client", json=client_data)
+
+            if result and result.get('success'):
+                self.client_index.add(result.get('id'), email, telegram_id, enabled=False)
+                return result.get('id')
+            else:
+                raise Exception(f"Client creation failed: {result}")
+
+        except Exception as e:
+            logger.error(f"Create client failed: {str(e)}")
+            raise
+
+    async def enable_client(self, client_id):
+        """Включение клиента"""
+        try:
+            result = await self._request('POST', f"/api/client/{client_id}/enable", "enable_client")
+            self.client_index.set_enabled(client_id, True)
+            return result
+        except Exception as e:
+            logger.error(f"Enable client failed: {str(e)}")
+            raise
+
+    async def disable_client(self, client_id):
+        """Выключение клиента"""
+        try:
+            result = await self._request('POST', f"/api/client/{client_id}/disable", "disable_client")
+            if isinstance(result, dict) and result.get('success') is False:
+                raise Exception(f"Panel refused disable_client: {result.get('msg')}")
+            self.client_index.set_enabled(client_id, False)
+            return result
+        except Exception as e:
+            logger.error(f"Disable client failed: {str(e)}")
+            raise
+
+    async def get_clients(self):
+        """Получение списка клиентов (одновременные вызовы объединяются)"""
+        async def fetch():
+            result = await self._request('GET', "/api/clients", "get_clients")
+            self.client_index.apply_listing(client_records(result))
+            return result
+
+        try:
+            return await _async_flight.do((self.panel_url, 'get_clients'), fetch, self.result_ttl)
+        except Exception as e:
+            logger.error(f"Get clients failed: {str(e)}")
+            raise
+
+    async def refresh_client_index(self, force=False):
+        """Перечитать список клиентов в индекс, если он устарел"""
+        index = self.client_index
+        if not force and not index.is_stale():
+            return index
+
+        headers = {}
+        if index.etag and not force:
+            headers['If-None-Match'] = index.etag
+        status, response_headers, response = await self._request_response(
+            'GET', "/api/clients", "get_clients", headers=headers, stream=True
+        )
+        if status == 304:
+            index.mark_fresh()
+        else:
+            seen = set()
+            async for record in self._iter_records(response):
+                index.apply_record(record, seen)
+            index.finish_listing(seen, response_headers.get('ETag'))
+        return index
+
+    async def iter_clients(self):
+        """Клиенты панели по одному (ClientRecord), ответ разбирается по частям"""
+        status, headers, response = await self._request_response(
+            'GET', "/api/clients", "get_clients", stream=True
+        )
+        async for record in self._iter_records(response):
+            yield record
+
+    async def _iter_records(self, response):
+        stream = JSONArrayStream()
+        try:
+            async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                for client in stream.feed(chunk):
+                    yield client_record(client)
+                check_listing(stream.fields)
+            for client in stream.close():
+                yield client_record(client)
+            check_listing(stream.fields)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.breaker.record_failure(e)
+            raise Exception(f"Request failed for get_clients: {str(e) or type(e).__name__}")
+        except ValueError as e:
+            raise Exception(f"Invalid response for get_clients: {str(e)}")
+        finally:
+            response.release()
+
+    async def find_client_id(self, email):
+        """client_id по email через индекс; список читается только если индекс устарел"""
+        record = self.client_index.find_by_email(email)
+        if record is None and self.client_index.is_stale():
+            record = (await self.refresh_client_index()).find_by_email(email)
+        return record.client_id if record is not None else None
+
+    async def disable_client_by_email(self, email):
+        """Выключение клиента по email"""
+        client_id = await self.find_client_id(email)
+        if client_id is None:
+            logger.warning(f"Client {email} not found on {self.panel_url}")
+            return None
+        return await self.disable_client(client_id)
+
+    async def get_panel_status(self, timeout=None):
+        """Проверка статуса панели"""
+        try:
+            return await _async_flight.do(
+                (self.panel_url, 'get_status'),
+                lambda: self._request('GET', "/api/status", "get_status", timeout=timeout),
+                self.result_ttl
+            )
+        except Exception as e:
+            logger.error(f"Get panel status failed: {str(e)}")
+            return None
+
+    async def create_clients(self, clients):
+        """Создание нескольких клиентов одним запросом.
+
+        clients - список тел из client_payload(). Возвращает список id в том
+        же порядке. Если панель не поддерживает пакетные операции, ставит
+        supports_batch = False и выбрасывает BatchNotSupportedError.
+        """
+        result = await self._batch_request('POST', "/api/clients/batch", "create_clients",
+                                           json={"clients": clients})
+        ids = result.get('ids') or []
+        if not result.get('success') or len(ids) != len(clients):
+            raise Exception(f"Batch client creation failed: {result}")
+        for client, client_id in zip(clients, ids):
+            self.client_index.add(client_id, client['email'], client.get('telegramId'),
+                                  enabled=client.get('enable', False))
+        return ids
+
+    async def set_clients_enabled(self, client_ids, enabled):
+        """Включение или выключение нескольких клиентов одним запросом"""
+        action = 'enable' if enabled else 'disable'
+        result = await self._batch_request('POST', f"/api/clients/{action}", f"{action}_clients",
+                                           json={"ids": list(client_ids)})
+        if not result.get('success'):
+            raise Exception(f"Batch {action} failed: {result}")
+        for client_id in client_ids:
+            self.client_index.set_enabled(client_id, enabled)
+        return result
+
+    async def _batch_request(self, method, path, operation, **kwargs):
+        if self.supports_batch is False:
+            raise BatchNotSupportedError(f"Batch operations not supported by {self.panel_url}")
+        status, headers, data = await self._request_response(method, path, operation,
+                                                             expected=(404, 405), **kwargs)
+        if status in (404, 405):
+            self.supports_batch = False
+            logger.info(f"Panel {self.panel_url} has no batch API, using single requests")
+            raise BatchNotSupportedError(f"Batch operations not supported by {self.panel_url}")
+        self.supports_batch = True
+        return data
+
+    async def delete_client(self, client_id):
+        """Удаление клиента"""
+        try:
+            result = await self._request('DELETE', f"/api/client/{client_id}", "delete_client")
+            self.client_index.remove(client_id)
+            return result
         except Exception as e:
             logger.error(f"Delete client failed: {str(e)}")
             raise
+
+    def get_stats(self):
+        """Статистика запросов и переиспользования соединений"""
+        stats = dict(self._stats)
+        stats['session_valid'] = self._session_valid()
+        return stats
+
+    async def close(self):
+        """Закрытие сессии панели (общий пул соединений остаётся открытым)"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+_async_registry = {}
+
+def get_async_xui_api(panel_config):
+    """Получить общий для процесса асинхронный клиент панели.
+
+    Вызывать из корутины: клиент использует пул соединений текущего loop.
+    """
+    url = panel_config['url']
+    api = _async_registry.get(url)
+    if api is not None and (api.username != panel_config['username']
+                            or api.password != panel_config['password']):
+        asyncio.ensure_future(api.close())
+        api = None
+    if api is None:
+        api = AsyncXUIAPI(panel_config)
+        _async_registry[url] = api
+    return api
+
+async def close_async_clients():
+    """Закрыть все асинхронные клиенты и общий пул текущего event loop"""
+    for api in list(_async_registry.values()):
+        await api.close()
+    _async_registry.clear()
+
+    connector = _async_connectors.pop(asyncio.get_running_loop(), None)
+    if connector is not None:
+        await connector.close()